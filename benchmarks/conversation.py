@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+#
+# Copyright 2015, 2016 Adam Victor Brandizzi
+#
+# This file is part of Inelegant.
+#
+# Inelegant is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Inelegant is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Inelegant.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures how many lockstep steps per second ``inelegant.process.Process``
+does with a generator target: each step gets a yielded value and sends one
+back. For comparison, the same steps are measured through two
+``multiprocessing.Queue`` objects, as ``Conversation`` used to do. Then it
+measures how many values per second a target streams with the ``window``
+argument::
+
+    $ python benchmarks/conversation.py --steps 20000 --window 64
+"""
+
+import argparse
+import multiprocessing
+import time
+
+from inelegant.process import Conversation, Process
+
+
+class QueueConversation(Conversation):
+    """
+    ``Conversation`` with its former transport: a queue for each direction.
+    """
+
+    def __init__(self, function):
+        Conversation.__init__(self, function)
+        self.child_to_parent = multiprocessing.Queue()
+        self.parent_to_child = multiprocessing.Queue()
+
+    def get_from_child(self):
+        return self.child_to_parent.get()
+
+    def send_to_child(self, value):
+        self.parent_to_child.put(value)
+
+    def converse(self, generator):
+        to_parent = next(generator)
+        while True:
+            try:
+                self.child_to_parent.put(to_parent)
+                from_parent = self.parent_to_child.get()
+                to_parent = generator.send(from_parent)
+            except StopIteration:
+                break
+
+
+def echo(steps, payload):
+    value = payload
+
+    for i in range(steps):
+        value = yield value
+
+
+def produce(steps, payload):
+    for i in range(steps):
+        yield payload
+
+
+def measure(conversation, steps, payload):
+    process = multiprocessing.Process(
+        target=conversation.start, args=(steps, payload)
+    )
+    process.start()
+
+    start = time.perf_counter()
+
+    for i in range(steps):
+        conversation.send_to_child(conversation.get_from_child())
+
+    elapsed = time.perf_counter() - start
+    process.join()
+
+    return steps / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--steps', type=int, default=20000)
+    parser.add_argument('--payload-size', type=int, default=16)
+    parser.add_argument('--window', type=int, default=64)
+    args = parser.parse_args()
+
+    payload = b'x' * args.payload_size
+    benchmarks = [
+        ('queues', QueueConversation(echo)),
+        ('pipe', Conversation(echo)),
+    ]
+
+    for name, conversation in benchmarks:
+        rate = measure(conversation, args.steps, payload)
+        print('{0:>8}: {1:10.0f} steps/s'.format(name, rate))
+
+    # The whole ``Process`` path, as the tests use it.
+    start = time.perf_counter()
+
+    with Process(target=echo, args=(args.steps, payload)) as process:
+        for i in range(args.steps):
+            process.send(process.get())
+
+    rate = args.steps / (time.perf_counter() - start)
+    print('{0:>8}: {1:10.0f} steps/s'.format('Process', rate))
+
+    start = time.perf_counter()
+
+    with Process(
+            target=produce, args=(args.steps, payload),
+            window=args.window) as process:
+        for value in process:
+            pass
+
+    rate = args.steps / (time.perf_counter() - start)
+    print('{0:>8}: {1:10.0f} values/s'.format('stream', rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+#
+# Copyright 2015, 2016 Adam Victor Brandizzi
+#
+# This file is part of Inelegant.
+#
+# Inelegant is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Inelegant is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Inelegant.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures how much CPU idle servers use and how long they take to shut down,
+comparing the ``SocketServer.TCPServer`` polling loop with the one from
+``inelegant.net.Server``, which blocks until woken up::
+
+    $ python benchmarks/idle.py --servers 50 --duration 3
+"""
+
+import argparse
+import socketserver
+import threading
+import time
+
+from inelegant.net import Server
+
+
+class PollingServer(Server):
+    """
+    A server with the loop ``inelegant.net.Server`` used to have: it checks
+    for the shutdown request every millisecond.
+    """
+
+    def serve_forever(self, poll_interval=0.001):
+        self._lazy_init()
+        socketserver.TCPServer.serve_forever(self, poll_interval)
+
+    def shutdown(self):
+        socketserver.TCPServer.shutdown(self)
+
+
+def start(servers):
+    threads = [
+        threading.Thread(target=server.serve_forever) for server in servers
+    ]
+
+    for thread in threads:
+        thread.start()
+
+    return threads
+
+
+def measure_idle(servers, duration):
+    """
+    Returns the CPU time used by the servers per second, in seconds.
+    """
+    threads = start(servers)
+
+    start_cpu = time.process_time()
+    time.sleep(duration)
+    cpu = time.process_time() - start_cpu
+
+    stop(servers, threads)
+
+    return cpu / duration
+
+
+def measure_shutdown(servers):
+    """
+    Returns the average time ``shutdown()`` took to return, in seconds.
+    """
+    threads = start(servers)
+    time.sleep(0.1)
+
+    elapsed = stop(servers, threads)
+
+    return elapsed / len(servers)
+
+
+def stop(servers, threads):
+    elapsed = 0
+
+    for server, thread in zip(servers, threads):
+        start_time = time.monotonic()
+        server.shutdown()
+        elapsed += time.monotonic() - start_time
+
+        server.server_close()
+        thread.join()
+
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--servers', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--port', type=int, default=9100)
+    args = parser.parse_args()
+
+    ports = range(args.port, args.port + args.servers)
+    loops = [
+        ('polling', PollingServer),
+        ('wake-up', Server),
+    ]
+
+    for name, server_class in loops:
+        cpu = measure_idle(
+            [server_class(port=port) for port in ports], args.duration
+        )
+        latency = measure_shutdown(
+            [server_class(port=port) for port in ports]
+        )
+        print(
+            '{0:>10}: {1:6.1%} CPU while idle, {2:8.3f} ms to shut '
+            'down'.format(name, cpu, latency * 1000)
+        )
+
+
+if __name__ == '__main__':
+    main()
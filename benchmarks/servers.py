@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+# Copyright 2015, 2016 Adam Victor Brandizzi
+#
+# This file is part of Inelegant.
+#
+# Inelegant is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Inelegant is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Inelegant.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures how many connections per second each ``inelegant.net`` server class
+can serve. Many client processes connect in parallel to the server, read the
+whole message and count how many connections they completed::
+
+    $ python benchmarks/servers.py --clients 8 --duration 3
+"""
+
+import argparse
+import contextlib
+import multiprocessing
+import socket
+import time
+
+from inelegant.net import Server, ThreadingServer, SelectorServer, \
+    PreforkServer, wait_server_up
+
+
+def connect_repeatedly(host, port, duration):
+    """
+    Connects to the server and reads its message until ``duration`` seconds
+    have passed. Returns the number of completed connections.
+    """
+    count = 0
+    deadline = time.monotonic() + duration
+
+    while time.monotonic() < deadline:
+        with contextlib.closing(socket.socket()) as s:
+            s.connect((host, port))
+
+            while s.recv(4096):
+                pass
+
+        count += 1
+
+    return count
+
+
+def measure(server, clients, duration):
+    with server:
+        wait_server_up(server.host, server.port)
+
+        with multiprocessing.Pool(clients) as pool:
+            start = time.monotonic()
+            counts = pool.starmap(
+                connect_repeatedly,
+                [(server.host, server.port, duration)] * clients
+            )
+            elapsed = time.monotonic() - start
+
+    return sum(counts) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--port', type=int, default=9010)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    servers = [
+        ('serial', Server(port=args.port)),
+        ('thread', ThreadingServer(port=args.port)),
+        ('selector', SelectorServer(port=args.port)),
+        ('prefork', PreforkServer(port=args.port, workers=args.workers)),
+    ]
+
+    for name, server in servers:
+        rate = measure(server, args.clients, args.duration)
+        print('{0:>10}: {1:10.0f} connections/s'.format(name, rate))
+
+
+if __name__ == '__main__':
+    main()
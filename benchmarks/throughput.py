@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# Copyright 2015, 2016 Adam Victor Brandizzi
+#
+# This file is part of Inelegant.
+#
+# Inelegant is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Inelegant is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Inelegant.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures the raw throughput of local sockets with ``inelegant.net.SinkServer``
+and ``inelegant.net.EchoServer``. Each client process streams data to the
+server for some time, through TCP and through a Unix socket, and the bytes
+per second counted by the server are reported::
+
+    $ python benchmarks/throughput.py --clients 2 --duration 3
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from inelegant.net import EchoServer, SinkServer
+
+
+def stream(address, duration, chunk_size):
+    """
+    Sends data to the server until ``duration`` seconds have passed, reading
+    whatever it sends back, and waits for the server to close the connection.
+    """
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    chunk = memoryview(bytearray(chunk_size))
+    buffer = memoryview(bytearray(chunk_size))
+
+    with socket.socket(family) as s:
+        s.connect(address)
+
+        def drain():
+            while s.recv_into(buffer):
+                pass
+
+        thread = threading.Thread(target=drain)
+        thread.start()
+
+        deadline = time.monotonic() + duration
+
+        while time.monotonic() < deadline:
+            s.sendall(chunk)
+
+        s.shutdown(socket.SHUT_WR)
+        thread.join()
+
+
+def measure(server, address, clients, duration, chunk_size):
+    with server:
+        with multiprocessing.Pool(clients) as pool:
+            pool.starmap(
+                stream, [(address, duration, chunk_size)] * clients
+            )
+
+        return server.stats.throughput
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clients', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=3.0)
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024)
+    parser.add_argument('--port', type=int, default=9010)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'throughput.sock')
+        benchmarks = [
+            ('tcp sink', SinkServer(port=args.port), ('localhost', args.port)),
+            ('tcp echo', EchoServer(port=args.port), ('localhost', args.port)),
+            ('unix sink', SinkServer(path=path), path),
+            ('unix echo', EchoServer(path=path), path),
+        ]
+
+        for name, server, address in benchmarks:
+            rate = measure(
+                server, address, args.clients, args.duration, args.chunk_size
+            )
+            print('{0:>10}: {1:10.1f} MiB/s'.format(name, rate / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,701 @@
+#
+# Copyright 2015, 2016 Adam Victor Brandizzi
+#
+# This file is part of Inelegant.
+#
+# Inelegant is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Inelegant is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Inelegant.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import socket
+import struct
+import threading
+import time
+
+from inelegant.record import Histogram, FRAME_OPEN, FRAME_CLIENT, \
+    FRAME_SERVER, FRAME_CLOSE
+
+
+def generate_load(
+        host, port, connections=1, duration=1, rate=None, payload=b'',
+        response_size=None, timeout=1):
+    """
+    ``generate_load()`` sends requests to a TCP server from many connections
+    at once, for some time, and reports how many requests were answered and
+    how long they took::
+
+    >>> from inelegant.net import Server
+    >>> with Server(port=9001, message='My message'):
+    ...     report = generate_load(
+    ...         'localhost', 9001, connections=4, duration=0.1
+    ...     )
+    >>> report.requests > 0
+    True
+    >>> report.errors
+    0
+
+    By default, a request opens a connection, sends the ``payload`` argument
+    (if any) and reads the response until the server closes the connection,
+    as ``inelegant.net.Server`` does. If the server keeps the connections
+    open, give the size of each response as the ``response_size`` argument:
+    then each connection is kept open, and the payload is sent again as soon
+    as the whole response is read.
+
+    Throughput and latency
+    ----------------------
+
+    The report tells how many requests were answered per second, and the
+    latencies at any percentile::
+
+    >>> report.throughput > 0
+    True
+    >>> report.percentile(50) <= report.percentile(99)
+    True
+
+    Latencies are recorded in a ``Histogram``, available in the
+    ``histogram`` attribute. See ``LoadReport`` for more.
+
+    Closed and open loop
+    --------------------
+
+    By default, each connection sends a request as soon as the previous one
+    is answered, so the load is as high as the server can take. If the
+    ``rate`` argument is given, the requests are instead started at that
+    rate (in requests per second) spread among the connections::
+
+    >>> with Server(port=9001, message='My message'):
+    ...     report = generate_load(
+    ...         'localhost', 9001, connections=2, duration=0.2, rate=100
+    ...     )
+    >>> 15 <= report.requests <= 25
+    True
+
+    If the server cannot keep up with the rate, the requests are started
+    late. Their latencies are measured from the moment they should have
+    started, so the wait for the server is not hidden from the report.
+
+    Errors
+    ------
+
+    Requests that fail (e.g. because the connection was refused or because
+    the response took more than ``timeout`` seconds) are counted as errors,
+    but do not stop the load::
+
+    >>> report = generate_load('localhost', 9001, duration=0.05)
+    >>> report.requests
+    0
+    >>> report.errors > 0
+    True
+    """
+    start = time.monotonic()
+    workers = [
+        _LoadWorker(
+            host, port, payload, response_size, timeout, start, duration,
+            rate, connections, i
+        )
+        for i in range(connections)
+    ]
+    threads = [threading.Thread(target=worker.run) for worker in workers]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.monotonic() - start
+    histogram = Histogram()
+
+    for worker in workers:
+        histogram.merge(worker.histogram)
+
+    return LoadReport(histogram, sum(w.errors for w in workers), elapsed)
+
+
+def replay(log, host, port, speed=1, copies=1, timeout=1):
+    """
+    ``replay()`` sends the traffic recorded by a ``TrafficRecorder`` to a
+    server again, so a real session can be turned into a repeatable load
+    test. Each recorded connection is opened again, and sends what its
+    client sent::
+
+    >>> import io
+    >>> from inelegant.net import HTTPServer, Proxy
+    >>> request = b'GET / HTTP/1.1\\r\\nConnection: close\\r\\n\\r\\n'
+    >>> log = io.BytesIO()
+    >>> with HTTPServer(port=0, routes={'/': 'Hello'}) as server:
+    ...     target = ('localhost', server.port)
+    ...     with TrafficRecorder(log) as recorder:
+    ...         with Proxy(target, recorder=recorder) as proxy:
+    ...             address = ('localhost', proxy.port)
+    ...             with socket.create_connection(address) as s:
+    ...                 s.sendall(request)
+    ...                 while s.recv(1024):
+    ...                     pass
+    ...     _ = log.seek(0)
+    ...     report = replay(log, 'localhost', server.port)
+    >>> report.requests
+    1
+    >>> report.errors
+    0
+
+    The report is a ``LoadReport``. Each time a connection waits for the
+    server to answer, it counts as a request, and the wait is its latency.
+
+    Ordering
+    --------
+
+    Before sending something, a connection waits until it has received as
+    many bytes as its client had received at that moment of the recording.
+    So, a request is never sent before the response to the previous one,
+    whatever the speed. It also means that the server is expected to send
+    responses of the recorded sizes: if a response is shorter, or takes
+    more than ``timeout`` seconds, the connection is counted as an error
+    and closed.
+
+    Speed
+    -----
+
+    By default, the traffic is replayed at the recorded pace: connections
+    are opened, and data is sent, at the moments they were recorded. With
+    the ``speed`` argument, the traffic is replayed that many times faster
+    (or slower, if it is less than one). If ``speed`` is ``None``, nothing
+    waits but the responses: all connections are opened at once and send
+    as fast as the server answers.
+
+    Concurrency
+    -----------
+
+    Connections that overlapped in the recording overlap in the replay as
+    well, each one in its own thread. To put more load on the server, the
+    ``copies`` argument replays that many copies of the traffic at the
+    same time::
+
+    >>> with HTTPServer(port=0, routes={'/': 'Hello'}) as server:
+    ...     _ = log.seek(0)
+    ...     report = replay(
+    ...         log, 'localhost', server.port, speed=None, copies=10
+    ...     )
+    >>> report.requests
+    10
+    >>> server.stats.connections
+    10
+    """
+    sessions = _read_sessions(log)
+    start = time.monotonic()
+    players = [
+        _SessionPlayer(session, host, port, speed, timeout, start)
+        for i in range(copies)
+        for session in sessions
+    ]
+    threads = [threading.Thread(target=player.run) for player in players]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.monotonic() - start
+    histogram = Histogram()
+
+    for player in players:
+        histogram.merge(player.histogram)
+
+    return LoadReport(histogram, sum(p.errors for p in players), elapsed)
+
+
+class TrafficRecorder(object):
+    """
+    ``TrafficRecorder`` writes the traffic of many connections to a log, as
+    timestamped frames. It is given to an ``inelegant.net.Proxy`` which,
+    placed between the clients and a server, records everything they send
+    to each other::
+
+    >>> import io
+    >>> from inelegant.net import HTTPServer, Proxy
+    >>> request = b'GET / HTTP/1.1\\r\\nConnection: close\\r\\n\\r\\n'
+    >>> log = io.BytesIO()
+    >>> with HTTPServer(port=0, routes={'/': 'Hello'}) as server:
+    ...     target = ('localhost', server.port)
+    ...     with TrafficRecorder(log) as recorder:
+    ...         with Proxy(target, recorder=recorder) as proxy:
+    ...             address = ('localhost', proxy.port)
+    ...             with socket.create_connection(address) as s:
+    ...                 s.sendall(request)
+    ...                 while s.recv(1024):
+    ...                     pass
+
+    The log is given either as the path of a file or as a binary file
+    object. Files the recorder opens are closed by its ``close()`` method,
+    called at the end of the ``with`` block; other files are only flushed.
+
+    ``read_traffic()`` reads the frames back. Each one is a tuple with the
+    time it was recorded (in seconds since the recorder was created), the
+    number of the connection, the kind of frame and its data::
+
+    >>> _ = log.seek(0)
+    >>> for time, connection, kind, data in read_traffic(log):
+    ...     print(connection, kind, len(data))
+    0 0 0
+    0 1 37
+    0 2 103
+    0 2 0
+    0 1 0
+    0 3 0
+
+    The kinds are ``FRAME_OPEN`` and ``FRAME_CLOSE``, for when the
+    connection was opened and closed, and ``FRAME_CLIENT`` and
+    ``FRAME_SERVER``, for the data sent by the client and by the server. An
+    empty data frame means that side will send nothing else.
+
+    The frames have a 17-byte header and, as they are, the data. They are
+    written from any thread, as they are recorded, but the file is only
+    flushed when the recorder is closed.
+    """
+
+    def __init__(self, log):
+        if isinstance(log, (str, bytes)):
+            self.file = open(log, 'wb')
+            self._owns_file = True
+        else:
+            self.file = log
+            self._owns_file = False
+
+        self.start = time.monotonic()
+        self._next_connection = 0
+        self._lock = threading.Lock()
+
+        self.file.write(_TRAFFIC_MAGIC)
+
+    def start_connection(self):
+        """
+        Records a new connection, returning its number.
+        """
+        with self._lock:
+            connection = self._next_connection
+            self._next_connection += 1
+
+        self.record(connection, FRAME_OPEN)
+
+        return connection
+
+    def record(self, connection, kind, data=b''):
+        timestamp = int((time.monotonic() - self.start) * 1000000)
+        header = _FRAME.pack(timestamp, connection, kind, len(data))
+
+        with self._lock:
+            self.file.write(header)
+            self.file.write(data)
+
+    def close(self):
+        with self._lock:
+            if self._owns_file:
+                self.file.close()
+            else:
+                self.file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+def read_traffic(log):
+    """
+    Yields the frames of a log written by ``TrafficRecorder``, given as a
+    path or as a binary file object. See ``TrafficRecorder`` for the format
+    of the frames.
+
+    A file that is not a traffic log is refused::
+
+    >>> import io
+    >>> list(read_traffic(io.BytesIO(b'Not a log')))
+    Traceback (most recent call last):
+     ...
+    ValueError: Not a traffic log.
+    """
+    if isinstance(log, (str, bytes)):
+        with open(log, 'rb') as f:
+            yield from read_traffic(f)
+
+        return
+
+    if log.read(len(_TRAFFIC_MAGIC)) != _TRAFFIC_MAGIC:
+        raise ValueError('Not a traffic log.')
+
+    while True:
+        header = log.read(_FRAME.size)
+
+        if not header:
+            break
+
+        if len(header) < _FRAME.size:
+            raise ValueError('Truncated traffic log.')
+
+        timestamp, connection, kind, size = _FRAME.unpack(header)
+        data = log.read(size)
+
+        if len(data) < size:
+            raise ValueError('Truncated traffic log.')
+
+        yield timestamp / 1000000, connection, kind, data
+
+
+class LoadReport(object):
+    """
+    ``LoadReport`` is what ``generate_load()`` returns. It has the number of
+    answered requests, the number of errors, the time the load took and a
+    ``Histogram`` with the latencies of the answered requests::
+
+    >>> histogram = Histogram()
+    >>> for latency in (0.001, 0.002, 0.003, 0.004):
+    ...     histogram.record(latency)
+    >>> report = LoadReport(histogram, errors=1, elapsed=2)
+    >>> report.requests
+    4
+    >>> report.throughput
+    2.0
+    >>> report.percentile(50)
+    0.002
+
+    Printed, it shows a summary::
+
+    >>> print(report)
+    4 requests in 2.000 s (2.0 requests/s), 1 errors
+    latency: p50=2.000 ms p90=4.000 ms p99=4.000 ms p99.9=4.000 ms max=4.000 ms
+    """
+
+    def __init__(self, histogram, errors, elapsed):
+        self.histogram = histogram
+        self.errors = errors
+        self.elapsed = elapsed
+
+    @property
+    def requests(self):
+        return self.histogram.count
+
+    @property
+    def throughput(self):
+        """
+        The number of answered requests per second.
+        """
+        return self.requests / self.elapsed
+
+    def percentile(self, percent):
+        return self.histogram.percentile(percent)
+
+    def __str__(self):
+        lines = [
+            '{0} requests in {1:.3f} s ({2:.1f} requests/s), {3} errors'
+            .format(self.requests, self.elapsed, self.throughput, self.errors)
+        ]
+
+        if self.requests:
+            lines.append('latency: ' + ' '.join(
+                'p{0:g}={1:.3f} ms'.format(p, self.percentile(p) * 1000)
+                for p in (50, 90, 99, 99.9)
+            ) + ' max={0:.3f} ms'.format(self.histogram.max * 1000))
+
+        return '\n'.join(lines)
+
+
+class _LoadWorker(object):
+    """
+    Sends requests from a single connection for ``generate_load()``,
+    recording their latencies in its own histogram.
+    """
+
+    def __init__(
+            self, host, port, payload, response_size, timeout, start,
+            duration, rate, connections, index):
+        self.host = host
+        self.port = port
+        self.payload = payload
+        self.response_size = response_size
+        self.timeout = timeout
+        self.deadline = start + duration
+
+        if rate:
+            # Each connection takes its share of the rate, and they are
+            # staggered so the requests are evenly spread over time.
+            self.interval = connections / rate
+            self.next_start = start + index * self.interval / connections
+        else:
+            self.interval = None
+            self.next_start = start
+
+        self.socket = None
+        self.histogram = Histogram()
+        self.errors = 0
+
+    def run(self):
+        try:
+            while True:
+                now = time.monotonic()
+
+                if self.interval is None:
+                    self.next_start = now
+                elif self.next_start > now:
+                    time.sleep(self.next_start - now)
+
+                if self.next_start >= self.deadline:
+                    break
+
+                try:
+                    self.request()
+                    self.histogram.record(time.monotonic() - self.next_start)
+                except socket.error:
+                    self.errors += 1
+                    self.disconnect()
+
+                if self.interval is not None:
+                    self.next_start += self.interval
+        finally:
+            self.disconnect()
+
+    def request(self):
+        if self.socket is None:
+            self.socket = socket.create_connection(
+                (self.host, self.port), self.timeout
+            )
+
+        if self.payload:
+            self.socket.sendall(self.payload)
+
+        if self.response_size is None:
+            while self.socket.recv(_CHUNK_SIZE):
+                pass
+
+            self.disconnect()
+        else:
+            remaining = self.response_size
+
+            while remaining:
+                chunk = self.socket.recv(min(remaining, _CHUNK_SIZE))
+
+                if not chunk:
+                    raise ConnectionResetError(
+                        'Connection closed before the whole response was read'
+                    )
+
+                remaining -= len(chunk)
+
+    def disconnect(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+
+class _Session(object):
+    """
+    A connection recorded in a traffic log, as ``replay()`` plays it: when
+    it was opened and what its client did, in ``(time, action, data,
+    expected)`` steps. ``expected`` is how many bytes the client had
+    received from the server before the step.
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.steps = []
+        self.server_bytes = 0
+        self.closed = False
+
+    def add(self, time, action, data=b''):
+        if not self.closed:
+            self.steps.append((time, action, data, self.server_bytes))
+            self.closed = action == _CLOSE
+
+
+def _read_sessions(log):
+    """
+    Reads a traffic log into ``_Session`` objects, in the order the
+    connections were opened.
+    """
+    sessions = collections.OrderedDict()
+
+    for time, connection, kind, data in read_traffic(log):
+        if kind == FRAME_OPEN:
+            sessions[connection] = _Session(time)
+            continue
+
+        session = sessions.get(connection)
+
+        if session is None:
+            continue
+        elif kind == FRAME_CLIENT:
+            session.add(time, _SEND if data else _SHUTDOWN, data)
+        elif kind == FRAME_SERVER:
+            session.server_bytes += len(data)
+        elif kind == FRAME_CLOSE:
+            session.add(time, _CLOSE)
+
+    # Connections still open when the recording stopped wait for what the
+    # server sent, and then are closed.
+    for session in sessions.values():
+        if not session.closed:
+            session.add(session.steps[-1][0] if session.steps else
+                        session.start, _CLOSE)
+
+    return list(sessions.values())
+
+
+class _SessionPlayer(object):
+    """
+    Replays a single recorded connection for ``replay()``, recording in its
+    own histogram how long it waited for each response.
+
+    A thread reads from the server all the time, noting when each chunk
+    arrives in the ``arrivals`` queue, as ``(time, received)`` pairs, where
+    ``received`` is the number of bytes received until then. So, the
+    latency of a response is measured until the moment it was complete,
+    even if nobody was waiting for it then.
+    """
+
+    def __init__(self, session, host, port, speed, timeout, start):
+        self.session = session
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.timeout = timeout
+        self.start = start
+
+        self.socket = None
+        self.histogram = Histogram()
+        self.errors = 0
+
+        self.received = 0
+        self.expected = 0
+        self.eof = False
+        self.arrivals = collections.deque()
+        self.condition = threading.Condition()
+
+    def run(self):
+        self.sleep_until(self.session.start)
+
+        try:
+            self.socket = socket.create_connection(
+                (self.host, self.port), self.timeout
+            )
+        except socket.error:
+            self.errors += 1
+            return
+
+        # The reader waits for the server for as long as the connection is
+        # open; only the responses have a timeout.
+        self.socket.settimeout(None)
+        reader = threading.Thread(target=self.read)
+        reader.start()
+
+        try:
+            self.play()
+        except socket.error:
+            self.errors += 1
+        finally:
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+            reader.join()
+            self.socket.close()
+
+    def play(self):
+        last_sent = time.monotonic()
+
+        for offset, action, data, expected in self.session.steps:
+            self.wait_response(expected, last_sent)
+            self.sleep_until(offset)
+
+            if action == _SEND:
+                self.socket.sendall(data)
+                last_sent = time.monotonic()
+            elif action == _SHUTDOWN:
+                self.socket.shutdown(socket.SHUT_WR)
+
+    def wait_response(self, expected, since):
+        """
+        Waits until ``expected`` bytes are received, recording the time from
+        ``since`` until they arrived.
+        """
+        if expected <= self.expected:
+            return
+
+        self.expected = expected
+        deadline = time.monotonic() + self.timeout
+
+        with self.condition:
+            while self.received < expected:
+                remaining = deadline - time.monotonic()
+
+                if self.eof:
+                    raise ConnectionResetError(
+                        'Connection closed before the whole response was read'
+                    )
+                elif remaining <= 0:
+                    raise socket.timeout('Response took too long')
+
+                self.condition.wait(remaining)
+
+            while self.arrivals[0][1] < expected:
+                self.arrivals.popleft()
+
+            arrived = self.arrivals[0][0]
+
+        self.histogram.record(arrived - since)
+
+    def read(self):
+        buffer = bytearray(_CHUNK_SIZE)
+
+        try:
+            while True:
+                size = self.socket.recv_into(buffer)
+                now = time.monotonic()
+
+                with self.condition:
+                    if not size:
+                        break
+
+                    self.received += size
+                    self.arrivals.append((now, self.received))
+                    self.condition.notify_all()
+        except socket.error:
+            pass
+
+        with self.condition:
+            self.eof = True
+            self.condition.notify_all()
+
+    def sleep_until(self, offset):
+        """
+        Waits for the moment, scaled by the speed, of something recorded
+        ``offset`` seconds after the recording started.
+        """
+        if self.speed:
+            delay = self.start + offset / self.speed - time.monotonic()
+
+            if delay > 0:
+                time.sleep(delay)
+
+
+_CHUNK_SIZE = 64 * 1024
+
+# A traffic log starts with ``_TRAFFIC_MAGIC``, followed by the frames. Each
+# frame has a header with its time in microseconds, the connection number,
+# the kind of frame and the size of its data, which follows the header.
+_TRAFFIC_MAGIC = b'INELTRF1'
+_FRAME = struct.Struct('<QIBI')
+
+# What a connection does at each step of a replay.
+_SEND = 'send'
+_SHUTDOWN = 'shutdown'
+_CLOSE = 'close'
@@ -16,15 +16,40 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with Inelegant.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import io
+import fnmatch
+import functools
+import inspect
+import random
+import collections
+import asyncio
+import fcntl
+import tempfile
 import socket
+import struct
 import errno
 import time
 import contextlib
+import multiprocessing
+import selectors
 import socketserver
 import threading
 
+from http import HTTPStatus
 
-def wait_server_up(host, port, timeout=1, tries=100):
+from inelegant.object import temp_attr
+from inelegant.record import Histogram, FRAME_CLIENT, FRAME_SERVER, \
+    FRAME_CLOSE
+
+# The first attempt is made immediately. If it fails, the next one waits this
+# many seconds, and the wait doubles after each failure until it reaches the
+# interval derived from the waiter's ``timeout`` and ``tries`` arguments.
+_FIRST_RETRY_DELAY = 0.00005
+_MINIMUM_RETRY_INTERVAL = 0.0001
+
+
+def wait_server_up(host=None, port=None, timeout=1, tries=100, path=None):
     """
     This function blocks the execution until connecting successfully to the
     given address and port.
@@ -100,42 +125,61 @@ def wait_server_up(host, port, timeout=1, tries=100):
 
     >>> start = time.time()
     >>> wait_server_up('localhost', 9000, timeout=0.05)
+    ... # doctest: +ELLIPSIS
     Traceback (most recent call last):
      ...
-    Exception: Connection to server failed after 100 attempts
+    Exception: Connection to server failed after ... attempts
     >>> 0.05 < time.time() - start < 0.1
     True
 
     If a network error happens, it will raise the exception, except if the
-    connection is refused. If an conection is refused, this error will be
-    ignored since it probably means the server is not up yet. However, this
-    error will only be ignored for <tries> times (by default 1000). Once the
-    connection is refuses for more than <tries> times, an exception will be
-    raised.
-    """
-    socket_timeout = float(timeout) / tries
-    if socket_timeout < 0.0001:
-        socket_timeout = 0.0001
-
-    for i in range(tries):
-        s = socket.socket()
-        s.settimeout(socket_timeout)
-        with contextlib.closing(s):
-            try:
-                s.connect((host, port))
-                break
-            except socket.error as e:
-                if e.errno == errno.ECONNREFUSED:
-                    time.sleep(socket_timeout)
-                else:
-                    raise
-    else:
+    connection is refused or takes too long to be established. These errors
+    will be ignored since they probably mean the server is not up yet.
+
+    The first connection attempt is made right away. If it fails, the function
+    waits a very short time before trying again, and doubles the wait after
+    each failure. Servers that start fast are detected almost as soon as they
+    call ``listen()``, while slow ones are not flooded with attempts. The wait
+    never grows beyond ``timeout/tries`` seconds, so ``tries`` sets how fine
+    grained the polling is once the server takes long to start.
+
+    The host is resolved only once per call. If it has many addresses (e.g.
+    ``localhost`` may be both ``::1`` and ``127.0.0.1``), all of them are
+    probed at the same time, and the server is up as soon as any of them
+    accepts the connection. IP addresses, such as the ones returned by
+    ``socket.getaddrinfo()``, are not resolved at all::
+
+    >>> with Server(host='127.0.0.1', port=9000):
+    ...     wait_server_up('127.0.0.1', 9000)
+
+    Unix sockets
+    ------------
+
+    To wait for a server listening to a Unix socket, give its path as the
+    ``path`` argument, instead of the host and port::
+
+    >>> with Server(path='\\0inelegant-example'):
+    ...     wait_server_up(path='\\0inelegant-example')
+
+    The other waiters accept the ``path`` argument as well, and
+    ``wait_servers_up()`` and ``wait_servers_down()`` accept paths among the
+    ``(host, port)`` pairs.
+    """
+    missed = _wait_servers(
+        [_get_address(host, port, path)], timeout, tries, _UP
+    )
+
+    if missed:
         raise Exception(
-            'Connection to server failed after {0} attempts'.format(tries)
+            'Connection to server failed after {0} attempts'.format(
+                missed[0].attempts
+            )
         )
 
 
-def wait_server_down(host, port, timeout=1, tries=100):
+def wait_server_down(
+        host=None, port=None, timeout=1, tries=100, probe='connect',
+        path=None):
     """
     This function blocks until the given port is free at the given address.
 
@@ -206,41 +250,424 @@ def wait_server_down(host, port, timeout=1, tries=100):
     >>> with Server():
     ...     start = time.time()
     ...     wait_server_down('localhost', 9000, timeout=0.05)
+    ... # doctest: +ELLIPSIS
     Traceback (most recent call last):
      ...
-    Exception: Server stayed up after 100 connection attempts. May it be runni\
+    Exception: Server stayed up after ... connection attempts. May it be runni\
 ng from a process outside the tests?
     >>> 0.05 < time.time() - start < 0.1
     True
+
+    As ``wait_server_up()``, it tries to connect right away and then waits
+    increasingly longer between attempts, never more than ``timeout/tries``
+    seconds.
+
+    Checking without connecting
+    ---------------------------
+
+    Every connection attempt reaches the server being waited, and so it may
+    affect it - e.g. changing its connection counts or delaying its shutdown.
+    On Linux, one can avoid it by setting the ``probe`` argument to
+    ``'proc'``. In this case, the function will look for the address in the
+    table of listening sockets from ``/proc/net/tcp`` and ``/proc/net/tcp6``
+    (see ``get_listening_addresses()``) instead of connecting to it::
+
+    >>> server = Server('localhost', 9000)
+    >>> thread = threading.Thread(target=serve)
+    >>> thread.start()
+    >>> wait_server_up('localhost', 9000)
+    >>> server.shutdown()
+    >>> wait_server_down('localhost', 9000, probe='proc')
+    >>> thread.join()
     """
-    socket_timeout = float(timeout) / tries
-    if socket_timeout < 0.0001:
-        socket_timeout = 0.0001
+    missed = _wait_servers_down(
+        [_get_address(host, port, path)], timeout, tries, probe
+    )
 
-    for i in range(tries):
-        s = socket.socket()
-        with contextlib.closing(s):
-            try:
-                s.settimeout(socket_timeout)
-                s.connect((host, port))
-                time.sleep(socket_timeout)
-            except socket.timeout:
-                continue
-            except socket.error as e:
-                if e.errno in (errno.ECONNREFUSED, errno.ECONNRESET):
-                    break
-                elif e.errno == errno.ETIMEDOUT:
-                    continue
-                else:
-                    raise
-    else:
+    if missed:
+        raise Exception(
+            'Server stayed up after {0} connection attempts. May it be '
+            'running from a process outside the tests?'.format(
+                missed[0].attempts
+            )
+        )
+
+
+def wait_servers_up(addresses, timeout=1, tries=100):
+    """
+    ``wait_servers_up()`` works as ``wait_server_up()`` but waits for many
+    servers at once. It expects a list of ``(host, port)`` pairs::
+
+    >>> import inelegant.net, threading
+    >>> servers = [
+    ...     inelegant.net.Server('localhost', port, message='my message')
+    ...     for port in (9000, 9001, 9002)
+    ... ]
+    >>> threads = [
+    ...     threading.Thread(target=server.serve_forever)
+    ...     for server in servers
+    ... ]
+    >>> for thread in threads:
+    ...     thread.start()
+    >>> wait_servers_up([
+    ...     ('localhost', 9000), ('localhost', 9001), ('localhost', 9002)
+    ... ])
+
+    All addresses are probed at the same time, so the time it takes is bounded
+    by the slowest server, and not by the sum of the time each one takes to
+    start.
+
+    If any of the servers is not up before the timeout, an exception listing
+    the missing addresses is raised::
+
+    >>> wait_servers_up(
+    ...     [('localhost', 9000), ('localhost', 9003), ('localhost', 9004)],
+    ...     timeout=0.05
+    ... ) # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+     ...
+    Exception: Connection failed to 2 of 3 servers: localhost:9003 (... attem\
+pts), localhost:9004 (... attempts)
+
+    >>> for server, thread in zip(servers, threads):
+    ...     server.shutdown()
+    ...     server.server_close()
+    ...     thread.join()
+    """
+    missed = _wait_servers(addresses, timeout, tries, _UP)
+
+    if missed:
+        raise Exception(
+            'Connection failed to {0} of {1} servers: {2}'.format(
+                len(missed), len(addresses), _describe_probes(missed)
+            )
+        )
+
+
+def wait_servers_down(addresses, timeout=1, tries=100, probe='connect'):
+    """
+    ``wait_servers_down()`` is to ``wait_server_down()`` what
+    ``wait_servers_up()`` is to ``wait_server_up()``: it blocks until all the
+    ``(host, port)`` pairs from the given list are not listening anymore::
+
+    >>> import inelegant.net, threading
+    >>> servers = [
+    ...     inelegant.net.Server('localhost', port, message='my message')
+    ...     for port in (9000, 9001)
+    ... ]
+    >>> for server in servers:
+    ...     threading.Thread(target=server.serve_forever).start()
+    >>> addresses = [('localhost', 9000), ('localhost', 9001)]
+    >>> wait_servers_up(addresses)
+    >>> for server in servers:
+    ...     server.shutdown()
+    ...     server.server_close()
+    >>> wait_servers_down(addresses)
+
+    Again, all addresses are probed together. If some server is still up after
+    the timeout, the exception tells which ones::
+
+    >>> with Server('localhost', 9001):
+    ...     wait_servers_down(addresses, timeout=0.05) # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+     ...
+    Exception: 1 of 2 servers stayed up: localhost:9001 (... attempts)
+
+    It also accepts the ``probe`` argument. With ``probe='proc'``, all
+    addresses are checked with a single read of the listening sockets table::
+
+    >>> with Server('localhost', 9001):
+    ...     wait_servers_down(addresses, timeout=0.05, probe='proc')
+    ... # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+     ...
+    Exception: 1 of 2 servers stayed up: localhost:9001 (... attempts)
+    """
+    missed = _wait_servers_down(addresses, timeout, tries, probe)
+
+    if missed:
+        raise Exception(
+            '{0} of {1} servers stayed up: {2}'.format(
+                len(missed), len(addresses), _describe_probes(missed)
+            )
+        )
+
+
+async def async_wait_server_up(
+        host=None, port=None, timeout=1, tries=100, path=None):
+    """
+    ``async_wait_server_up()`` is a coroutine version of ``wait_server_up()``:
+    instead of blocking the thread, it waits using the event loop, so many
+    servers can be waited concurrently::
+
+    >>> import asyncio
+    >>> async def main():
+    ...     with Server('localhost', 9000), Server('localhost', 9001):
+    ...         await asyncio.gather(
+    ...             async_wait_server_up('localhost', 9000),
+    ...             async_wait_server_up('localhost', 9001)
+    ...         )
+    ...         return 'Both are up'
+    >>> asyncio.run(main())
+    'Both are up'
+
+    It accepts the same arguments and has the same timeout behavior::
+
+    >>> asyncio.run(async_wait_server_up('localhost', 9000, timeout=0.05))
+    ... # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+     ...
+    Exception: Connection to server failed after ... attempts
+    """
+    probe = await _async_wait_server(
+        _get_address(host, port, path), timeout, tries, _UP
+    )
+
+    if probe is not None:
+        raise Exception(
+            'Connection to server failed after {0} attempts'.format(
+                probe.attempts
+            )
+        )
+
+
+async def async_wait_server_down(
+        host=None, port=None, timeout=1, tries=100, path=None):
+    """
+    ``async_wait_server_down()`` is a coroutine version of
+    ``wait_server_down()``::
+
+    >>> import asyncio
+    >>> async def main():
+    ...     async with Server('localhost', 9000):
+    ...         await async_wait_server_up('localhost', 9000)
+    ...     await async_wait_server_down('localhost', 9000)
+    ...     return 'Server is down'
+    >>> asyncio.run(main())
+    'Server is down'
+
+    It also fails if the server stays up after the timeout::
+
+    >>> async def main():
+    ...     async with Server('localhost', 9000):
+    ...         await async_wait_server_down('localhost', 9000, timeout=0.05)
+    >>> asyncio.run(main()) # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+     ...
+    Exception: Server stayed up after ... connection attempts. May it be runni\
+ng from a process outside the tests?
+    """
+    probe = await _async_wait_server(
+        _get_address(host, port, path), timeout, tries, _DOWN
+    )
+
+    if probe is not None:
         raise Exception(
-            'Server stayed up after {0} connection attempts. '
-            'May it be running from a process outside the tests?'.format(tries)
+            'Server stayed up after {0} connection attempts. May it be '
+            'running from a process outside the tests?'.format(probe.attempts)
         )
 
 
-class Server(socketserver.TCPServer):
+class _Listener(socketserver.TCPServer):
+    """
+    Base of the servers and of ``Proxy``: it listens to a TCP port or a Unix
+    socket, binding it on the first use, and serves from a loop woken up by
+    ``shutdown()``. With the ``with`` statement, it serves from a thread.
+    What is done with each connection is up to the subclasses.
+    """
+
+    # Connections closed by the server leave the port in TIME_WAIT. Without
+    # this option, the port could not be bound again for a while.
+    allow_reuse_address = True
+
+    # The default backlog (5) is too short for clients opening many
+    # connections at once: the kernel would drop them until they are accepted.
+    request_queue_size = socket.SOMAXCONN
+
+    # Subclasses either replace it or override ``finish_request()``.
+    RequestHandlerClass = socketserver.BaseRequestHandler
+
+    def __init__(self, host='localhost', port=9000, path=None):
+        self.host = host
+        self.port = port
+        self.path = path
+
+        self.init_lock = threading.Lock()
+        self._is_serving = threading.Event()
+        self._shutdown_request = False
+        self._is_shut_down = threading.Event()
+
+    def handle_request(self):
+        self._lazy_init()
+
+        return socketserver.TCPServer.handle_request(self)
+
+    def serve_forever(self, poll_interval=None):
+        """
+        Serves until ``shutdown()`` is called. Different from
+        ``SocketServer.TCPServer``, it does not poll for the shutdown request:
+        ``shutdown()`` wakes the loop up through a socket pair, so an idle
+        server uses no CPU and stops right away. If ``poll_interval`` is given,
+        the loop also wakes up after that many seconds without connections to
+        call ``service_actions()``.
+        """
+        self._lazy_init()
+
+        with self._serving_selector() as selector:
+            while not self._shutdown_request:
+                for key, events in selector.select(poll_interval):
+                    if key.fileobj is self.socket:
+                        self._handle_request_noblock()
+
+                self.service_actions()
+
+    def server_close(self):
+        if self._is_initialized():
+            socketserver.TCPServer.server_close(self)
+            self._wake_up_reader.close()
+            self._wake_up_writer.close()
+            self._remove_socket_file()
+
+    def shutdown(self):
+        if self._is_initialized():
+            self._shutdown_request = True
+            self._wake_up()
+            self._is_shut_down.wait()
+
+    def __enter__(self):
+        # The socket is bound and listening before the thread starts, so
+        # failures to bind are raised here. Then we only wait for the thread
+        # to start serving, raising its error if it fails before that.
+        self._lazy_init()
+
+        self._is_serving.clear()
+        self._serving_error = None
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+        while not self._is_serving.wait(0.01):
+            if not self.thread.is_alive() and not self._is_serving.is_set():
+                self.thread.join()
+                self.server_close()
+
+                if self._serving_error is not None:
+                    raise self._serving_error
+
+                raise RuntimeError('The server stopped before serving.')
+
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self._is_initialized():
+            self.shutdown()
+            self.server_close()
+            self.thread.join()
+
+    def _serve(self):
+        """
+        Serves forever. If the server fails before it starts serving, the
+        error is kept to be raised by ``__enter__()``.
+        """
+        try:
+            self.serve_forever()
+        except BaseException as e:
+            if self._is_serving.is_set():
+                raise
+
+            self._serving_error = e
+
+    def _remove_socket_file(self):
+        """
+        Removes the file of the Unix socket, if the server created one.
+        """
+        if getattr(self, '_owns_path', False):
+            self._owns_path = False
+
+            if not os.fsdecode(self.path).startswith('\0'):
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(self.path)
+
+    @contextlib.contextmanager
+    def _serving_selector(self):
+        """
+        Sets up a serving loop, yielding a selector watching the listening
+        socket and the wake-up socket. At the end of the block, the loop is
+        marked as shut down.
+        """
+        self._is_shut_down.clear()
+
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(self.socket, selectors.EVENT_READ)
+                selector.register(self._wake_up_reader, selectors.EVENT_READ)
+                self._is_serving.set()
+
+                yield selector
+        finally:
+            self._drain_wake_up()
+            self._shutdown_request = False
+            self._is_shut_down.set()
+
+    def _wake_up(self):
+        try:
+            self._wake_up_writer.send(b'\0')
+        except BlockingIOError:
+            pass  # The buffer is full, so the loop will wake up anyway.
+
+    def _drain_wake_up(self):
+        try:
+            while self._wake_up_reader.recv(1024):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _lazy_init(self):
+        with self.init_lock:
+            if not self._is_initialized():
+                # Created first because ``server_close()`` closes them, and it
+                # is called if the server fails to bind.
+                self._wake_up_reader, self._wake_up_writer = \
+                    socket.socketpair()
+                self._wake_up_reader.setblocking(False)
+                self._wake_up_writer.setblocking(False)
+
+                if self.path is not None:
+                    self.address_family = socket.AF_UNIX
+                    socketserver.TCPServer.__init__(
+                        self, self.path, self.RequestHandlerClass)
+                    # Only set now: if binding failed, the file belongs to
+                    # someone else.
+                    self._owns_path = True
+                else:
+                    socketserver.TCPServer.__init__(
+                        self, (self.host, self.port),
+                        self.RequestHandlerClass)
+                    self.port = self.server_address[1]
+
+    def _is_initialized(self):
+        return hasattr(self, 'socket')
+
+
+class ServerHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        payload = self.server._get_payload()
+
+        try:
+            if isinstance(payload, io.IOBase):
+                sent = self.request.sendfile(payload, 0)
+            else:
+                self.request.sendall(payload)
+                sent = len(payload)
+        except (ConnectionResetError, BrokenPipeError):
+            return  # The client does not want the message anymore.
+
+        if self.server.stats is not None:
+            self.server.stats._sent(sent)
+
+
+class Server(_Listener):
     """
     ``inelegant.net.Server`` is a very simple TCP server that only responds
     with the same message, given to its constructor::
@@ -289,84 +716,3284 @@ class Server(socketserver.TCPServer):
     Traceback (most recent call last):
      ...
     ConnectionRefusedError: [Errno 111] Connection refused
+
+    The server is already listening when the ``with`` block starts, so there
+    is no need to wait for it. If it cannot listen to the port, the error is
+    raised by the ``with`` statement itself::
+
+    >>> with Server(port=9001):
+    ...     with Server(port=9001):
+    ...         pass
+    Traceback (most recent call last):
+     ...
+    OSError: [Errno 98] Address already in use
+
+    Inside coroutines, it can be given to an ``async with`` statement. Then no
+    thread is started: the server runs in the current event loop, so one can
+    have many of them running at once without blocking anything::
+
+    >>> import asyncio
+    >>> async def main():
+    ...     async with Server(port=9001, message='My message'):
+    ...         reader, writer = await asyncio.open_connection(
+    ...             'localhost', 9001
+    ...         )
+    ...         message = await reader.read()
+    ...         writer.close()
+    ...         await writer.wait_closed()
+    ...         return message
+    >>> asyncio.run(main())
+    b'My message\\x00'
+
+    Getting a free port
+    -------------------
+
+    If the port is ``0``, the operating system chooses a free port when the
+    server starts, and the ``port`` attribute is updated to it. This way,
+    many servers can run at the same time (even from many test processes)
+    without colliding::
+
+    >>> with Server(port=0, message='My message') as server:
+    ...     server.port != 0
+    ...     with contextlib.closing(socket.socket()) as s:
+    ...         s.connect(('localhost', server.port))
+    ...         s.recv(10)
+    True
+    b'My message'
+
+    If the port should be known before the server starts (for example, to be
+    given to the code under test), see ``reserve_port()``.
+
+    Large messages
+    --------------
+
+    A string message is encoded and followed by a null byte. If the message
+    is a ``bytes`` or ``memoryview`` object, though, it is sent as is, without
+    being copied or encoded again for each connection::
+
+    >>> with Server(port=9001, message=b'My message'):
+    ...     with contextlib.closing(socket.socket()) as s:
+    ...         s.connect(('localhost', 9001))
+    ...         s.recv(20)
+    b'My message'
+
+    The message can also be a file opened in binary mode. In this case, the
+    whole file is sent with ``socket.sendfile()``, so even large responses
+    are sent without being read into memory::
+
+    >>> import tempfile
+    >>> with tempfile.TemporaryFile() as f:
+    ...     _ = f.write(b'My file content')
+    ...     f.flush()
+    ...     with Server(port=9001, message=f):
+    ...         with contextlib.closing(socket.socket()) as s:
+    ...             s.connect(('localhost', 9001))
+    ...             s.recv(20)
+    b'My file content'
+
+    Unix sockets
+    ------------
+
+    If the ``path`` argument is given, the server listens to a Unix socket
+    in that path, instead of a TCP port. Local Unix sockets are faster than
+    TCP connections through the loopback interface::
+
+    >>> with tempfile.TemporaryDirectory() as directory:
+    ...     path = os.path.join(directory, 'server.sock')
+    ...     with Server(path=path, message='My message'):
+    ...         with contextlib.closing(socket.socket(socket.AF_UNIX)) as s:
+    ...             s.connect(path)
+    ...             s.recv(10)
+    ...     os.path.exists(path)
+    b'My message'
+    False
+
+    As seen above, the socket file is removed once the server is closed.
+
+    A path starting with a null character is from the abstract namespace:
+    no file is created at all::
+
+    >>> with Server(path='\\0inelegant-example', message='My message'):
+    ...     with contextlib.closing(socket.socket(socket.AF_UNIX)) as s:
+    ...         s.connect('\\0inelegant-example')
+    ...         s.recv(10)
+    b'My message'
+
+    Socket pairs
+    ------------
+
+    The cheapest way to get the message, though, is ``socketpair()``. It
+    returns a socket connected to the server through a socket pair, so there
+    is no listening socket, no address and no connection to establish. The
+    server does not even need to be serving::
+
+    >>> server = Server(message='My message')
+    >>> with contextlib.closing(server.socketpair()) as s:
+    ...     s.recv(10)
+    b'My message'
+
+    Statistics
+    ----------
+
+    If the ``stats`` argument is true, the server keeps statistics of the
+    connections it accepts in a ``ServerStats`` object, in the ``stats``
+    attribute::
+
+    >>> with Server(port=0, message='My message', stats=True) as server:
+    ...     for i in range(3):
+    ...         with contextlib.closing(socket.socket()) as s:
+    ...             s.connect(('localhost', server.port))
+    ...             s.recv(10)
+    b'My message'
+    b'My message'
+    b'My message'
+    >>> server.stats.connections, server.stats.bytes_sent
+    (3, 33)
+
+    They are cheap to keep, so they can be left on to see how the server
+    behaved under the load of a client. See ``ServerStats`` for more.
     """
 
+    RequestHandlerClass = ServerHandler
+
     def __init__(
             self, host='localhost', port=9000, message='Message sent',
-            wait_for_release=0.001):
-        self.host = host
-        self.port = port
+            wait_for_release=0.001, path=None, stats=False):
+        _Listener.__init__(self, host=host, port=port, path=path)
+
         self.message = message
+        self.stats = ServerStats() if stats else None
+        self._payload = (None, None)
+        # Not needed anymore since ``__enter__()`` binds the socket itself,
+        # but kept for compatibility.
         self.wait_for_release = wait_for_release
 
-        self.init_lock = threading.Lock()
+    def get_request(self):
+        request, client_address = socketserver.TCPServer.get_request(self)
 
-    def handle_request(self):
-        self._lazy_init()
+        if self.stats is not None:
+            self.stats._accepted(request, self.socket)
 
-        return socketserver.TCPServer.handle_request(self)
+        return request, client_address
 
-    def serve_forever(self, poll_interval=0.001):
-        self._lazy_init()
+    def shutdown_request(self, request):
+        if self.stats is not None:
+            self.stats._closed(request)
 
-        socketserver.TCPServer.serve_forever(self, poll_interval)
+        socketserver.TCPServer.shutdown_request(self, request)
 
-    def server_close(self):
-        if self._is_initialized():
-            socketserver.TCPServer.server_close(self)
+    def socketpair(self):
+        """
+        Returns a socket connected to the server through a socket pair. The
+        message is sent right away, if it fits the socket buffer, or from
+        another thread otherwise. Either way, the connection is counted in
+        the statistics like the accepted ones, except for the backlog.
+        """
+        client, request = socket.socketpair()
+        payload = self._get_payload()
+        sent = 0
 
-    def shutdown(self):
-        if self._is_initialized():
-            socketserver.TCPServer.shutdown(self)
+        if self.stats is not None:
+            self.stats._accepted(request)
 
-    def __enter__(self):
-        self.thread = threading.Thread(target=self.serve_forever)
-        self.thread.daemon = True
-        self.thread.start()
+        if not isinstance(payload, io.IOBase):
+            request.setblocking(False)
+
+            try:
+                sent = request.send(payload)
+                payload = payload[sent:]
+            except BlockingIOError:
+                pass
+
+            request.setblocking(True)
+
+        if isinstance(payload, io.IOBase) or payload:
+            thread = threading.Thread(
+                target=self._send_to_pair, args=(request, payload, sent)
+            )
+            thread.daemon = True
+            thread.start()
+        else:
+            self._close_pair(request, sent)
+
+        return client
 
-        self.init_lock.acquire()
-        self.init_lock.release()
-        time.sleep(self.wait_for_release)
+    async def __aenter__(self):
+        if self.path is not None:
+            sock = socket.socket(socket.AF_UNIX)
+
+            try:
+                sock.bind(self.path)
+                sock.listen(self.request_queue_size)
+            except socket.error:
+                sock.close()
+                raise
+
+            self._owns_path = True
+        else:
+            # We bind the socket ourselves so it has a single address, as the
+            # synchronous server: asyncio would bind every address of the
+            # host, each one to a different port if the port is zero.
+            sock = socket.create_server(
+                (self.host, self.port), backlog=self.request_queue_size
+            )
+            self.port = sock.getsockname()[1]
+
+        self.async_server = await asyncio.start_server(
+            self._handle_connection, sock=sock
+        )
 
         return self
 
-    def __exit__(self, type, value, traceback):
-        with self.init_lock:
-            if self._is_initialized():
-                self.shutdown()
-                self.server_close()
-                self.thread.join()
+    async def __aexit__(self, type, value, traceback):
+        self.async_server.close()
+        await self.async_server.wait_closed()
+        self._remove_socket_file()
+
+    async def _handle_connection(self, reader, writer):
+        if self.stats is not None:
+            self.stats._accepted(writer)
+
+        try:
+            await self._serve_connection(reader, writer)
+        finally:
+            if self.stats is not None:
+                self.stats._closed(writer)
+
+    async def _serve_connection(self, reader, writer):
+        """
+        Serves a connection accepted in the ``async with`` statement.
+        """
+        payload = self._get_payload()
+
+        try:
+            if isinstance(payload, io.IOBase):
+                loop = asyncio.get_running_loop()
+                sent = await loop.sendfile(writer.transport, payload, 0)
+            else:
+                writer.write(payload)
+                await writer.drain()
+                sent = len(payload)
+
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionResetError, BrokenPipeError):
+            return  # The client does not want the message anymore.
+
+        if self.stats is not None:
+            self.stats._sent(sent)
+
+    def _send_to_pair(self, request, payload, sent):
+        try:
+            if isinstance(payload, io.IOBase):
+                sent += request.sendfile(payload, 0)
+            else:
+                request.sendall(payload)
+                sent += len(payload)
+        except (ConnectionResetError, BrokenPipeError):
+            sent = None  # The client does not want the message anymore.
+        finally:
+            self._close_pair(request, sent)
+
+    def _close_pair(self, request, sent):
+        if self.stats is not None and sent is not None:
+            self.stats._sent(sent)
+
+        self.shutdown_request(request)
+
+    def _get_payload(self):
+        """
+        Returns what should be sent to each connection: a ``memoryview`` of
+        the encoded message or, if the message is a file, the file itself.
+        It is only computed again if the message is replaced.
+        """
+        message, payload = self._payload
+
+        if message is not self.message:
+            message = self.message
+
+            if isinstance(message, str):
+                payload = memoryview((message+'\0').encode())
+            elif isinstance(message, io.IOBase):
+                payload = message
+            else:
+                payload = memoryview(message)
+
+            self._payload = (message, payload)
+
+        return payload
+
+
+class ServerStats(object):
+    """
+    ``ServerStats`` keeps the statistics of a ``Server`` created with the
+    ``stats`` argument::
+
+    >>> server = ThreadingServer(port=0, message=b'x' * 1000, stats=True)
+    >>> with server:
+    ...     for i in range(10):
+    ...         with socket.create_connection(('localhost', server.port)) as s:
+    ...             while s.recv(1024):
+    ...                 pass
+    >>> stats = server.stats
+
+    It counts the connections accepted by the server, how many of them are
+    still open and how many bytes were received from and sent to them::
+
+    >>> stats.connections, stats.active_connections
+    (10, 0)
+    >>> stats.bytes_received, stats.bytes_sent
+    (0, 10000)
+
+    The servers that read what their connections send (``EchoServer``,
+    ``SinkServer``, ``HTTPServer`` and ``RedisServer``) keep statistics by
+    default. The ``throughput`` attribute has the bytes they received per
+    second, from the first connection until the last byte arrived, and
+    ``requests`` counts the requests answered by the ones that understand a
+    protocol.
+
+    The ``handle_time`` attribute is an ``inelegant.record.Histogram`` with
+    the seconds between accepting each connection and closing it, after the
+    message was sent. It includes the time a connection waited for a thread
+    to serve it, for example::
+
+    >>> stats.handle_time.count
+    10
+    >>> 0 < stats.handle_time.percentile(50) < 1
+    True
 
-    def _lazy_init(self):
-        with self.init_lock:
-            if not self._is_initialized():
-                socketserver.TCPServer.__init__(
-                    self, (self.host, self.port), ServerHandler)
+    Backlog
+    -------
 
-    def _is_initialized(self):
-        return hasattr(self, 'socket')
+    The ``backlog`` attribute is a histogram of how many connections were
+    waiting to be accepted each time the server accepted one. If it grows,
+    the server is not keeping up with the clients; once it reaches the
+    ``request_queue_size`` of the server, the kernel starts refusing
+    connections. It is only measured for TCP servers on Linux::
 
+    >>> stats.backlog.max
+    0
 
-class ServerHandler(socketserver.BaseRequestHandler):
+    The statistics can be printed::
 
-    def handle(self):
-        self.request.sendall((self.server.message+'\0').encode())
+    >>> print(stats) # doctest: +ELLIPSIS
+    10 connections (0 active), 0 bytes received, 10000 bytes sent
+    handle time: p50=... ms p90=... ms p99=... ms max=... ms
+    backlog: max=0
 
+    ``reset()`` sets everything back to zero, e.g. between measurements.
+    """
 
-def get_socket(timeout=None):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._accept_times = {}
+        self.active_connections = 0
+        self.reset()
+
+    def reset(self):
+        """
+        Sets all statistics back to zero. Connections still open are still
+        counted as active.
+        """
+        with self._lock:
+            self.connections = 0
+            self.requests = 0
+            self.bytes_received = 0
+            self.bytes_sent = 0
+            self.first_connection = None
+            self.last_byte = None
+            self.handle_time = Histogram()
+            self.backlog = Histogram(unit=1)
+
+    @property
+    def throughput(self):
+        """
+        The bytes received per second, from the moment the first connection
+        was accepted until the last byte arrived. It is ``None`` if nothing
+        was received yet.
+        """
+        if self.last_byte is not None and self.last_byte > \
+                self.first_connection:
+            return self.bytes_received / (
+                self.last_byte - self.first_connection
+            )
+
+    def _accepted(self, request, listening_socket=None):
+        backlog = _get_backlog(listening_socket)
+        now = time.monotonic()
+
+        with self._lock:
+            self._accept_times[request] = now
+            self.connections += 1
+            self.active_connections += 1
+
+            if self.first_connection is None:
+                self.first_connection = now
+
+            if backlog is not None:
+                self.backlog.record(backlog)
+
+    def _received(self, size):
+        now = time.monotonic()
+
+        with self._lock:
+            self.bytes_received += size
+            self.last_byte = now
+
+    def _sent(self, size):
+        with self._lock:
+            self.bytes_sent += size
+
+    def _answered(self, count):
+        with self._lock:
+            self.requests += count
+
+    def _closed(self, request):
+        now = time.monotonic()
+
+        with self._lock:
+            accepted = self._accept_times.pop(request, None)
+
+            if accepted is not None:
+                self.active_connections -= 1
+                self.handle_time.record(now - accepted)
+
+    def __str__(self):
+        lines = [
+            '{0} connections ({1} active), {2} bytes received, {3} bytes '
+            'sent'.format(
+                self.connections, self.active_connections,
+                self.bytes_received, self.bytes_sent
+            )
+        ]
+
+        if self.requests:
+            lines.append('{0} requests'.format(self.requests))
+
+        if self.handle_time.count:
+            lines.append('handle time: ' + ' '.join(
+                'p{0:g}={1:.3f} ms'.format(
+                    p, self.handle_time.percentile(p) * 1000
+                )
+                for p in (50, 90, 99)
+            ) + ' max={0:.3f} ms'.format(self.handle_time.max * 1000))
+
+        if self.backlog.count:
+            lines.append('backlog: max={0}'.format(self.backlog.max))
+
+        return '\n'.join(lines)
+
+
+class ThreadingServer(socketserver.ThreadingMixIn, Server):
     """
-    This function creates sockets. Its main appeal is that one can give the
-    timeout as an argument::
+    ``ThreadingServer`` is a ``Server`` that serves each connection in its own
+    thread. Since ``Server`` responds one connection after the other, it can
+    become a bottleneck when clients open many connections at once.
+    ``ThreadingServer`` does not wait for a response to be sent before
+    accepting the next connection::
 
-    >>> import socket
-    >>> s = get_socket(timeout=3.0)
-    >>> isinstance(s, socket.socket)
-    True
-    >>> s.gettimeout()
-    3.0
-    >>> s.close()
+    >>> with ThreadingServer(message='My message'):
+    ...     with contextlib.closing(socket.socket()) as s:
+    ...         s.connect(('localhost', 9000))
+    ...         s.recv(10)
+    b'My message'
     """
-    s = socket.socket()
-    s.settimeout(timeout)
 
-    return s
+    daemon_threads = True
+
+
+class SelectorServer(Server):
+    """
+    ``SelectorServer`` is a ``Server`` that serves all connections from a
+    single thread, using a ``selectors`` event loop. It accepts connections
+    and sends messages without ever blocking, so slow clients do not delay
+    the others, and no thread is spawned per connection::
+
+    >>> with SelectorServer(message='My message'):
+    ...     with contextlib.closing(socket.socket()) as s:
+    ...         s.connect(('localhost', 9000))
+    ...         s.recv(10)
+    b'My message'
+
+    ``handle_request()`` runs the event loop once: it waits for connections
+    (up to the ``timeout`` attribute, as in ``SocketServer.TCPServer``),
+    accepts all that are pending and returns once their messages are sent::
+
+    >>> server = SelectorServer(port=9001, message='My message')
+    >>> def serve():
+    ...     server.handle_request()
+    ...     server.server_close()
+    >>> thread = threading.Thread(target=serve)
+    >>> thread.start()
+    >>> time.sleep(0.01)
+    >>> with contextlib.closing(socket.socket()) as s:
+    ...     s.connect(('localhost', 9001))
+    ...     s.recv(10)
+    b'My message'
+    >>> thread.join()
+    """
+
+    def handle_request(self):
+        self._lazy_init()
+        self.socket.setblocking(False)
+
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.socket, selectors.EVENT_READ)
+
+            if not selector.select(self.timeout):
+                return self.handle_timeout()
+
+            selector.unregister(self.socket)
+            self._accept(selector)
+
+            while selector.get_map():
+                for key, events in selector.select():
+                    self._send(selector, key.fileobj, key.data)
+
+    def serve_forever(self, poll_interval=None):
+        self._lazy_init()
+        self.socket.setblocking(False)
+
+        with self._serving_selector() as selector:
+            loop_files = (self.socket, self._wake_up_reader)
+
+            try:
+                while not self._shutdown_request:
+                    for key, events in selector.select(poll_interval):
+                        if key.fileobj is self.socket:
+                            self._accept(selector)
+                        elif key.fileobj is not self._wake_up_reader:
+                            self._send(selector, key.fileobj, key.data)
+
+                    self.service_actions()
+            finally:
+                for key in list(selector.get_map().values()):
+                    if key.fileobj not in loop_files:
+                        self.shutdown_request(key.fileobj)
+
+    def _accept(self, selector):
+        """
+        Accepts all pending connections, sending as much of the message as
+        possible right away.
+        """
+        while True:
+            try:
+                request, client_address = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                break
+
+            request.setblocking(False)
+            payload = self._get_payload()
+
+            if self.stats is not None:
+                self.stats._accepted(request, self.socket)
+
+            if isinstance(payload, io.IOBase):
+                size = os.fstat(payload.fileno()).st_size
+                payload = _FileRegion(payload, 0, size)
+
+            self._send(selector, request, payload, registered=False)
+
+    def _send(self, selector, request, message, registered=True):
+        """
+        Sends what the connection can take of the message. The connection is
+        watched until the whole message is sent, and then closed.
+        """
+        try:
+            if isinstance(message, _FileRegion):
+                sent = os.sendfile(
+                    request.fileno(), message.file.fileno(), message.offset,
+                    len(message)
+                )
+            else:
+                sent = request.send(message)
+
+            message = message[sent:]
+
+            if self.stats is not None:
+                self.stats._sent(sent)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except socket.error:
+            message = message[:0]
+
+        if registered and not message:
+            selector.unregister(request)
+        elif registered:
+            selector.modify(request, selectors.EVENT_WRITE, message)
+        elif message:
+            selector.register(request, selectors.EVENT_WRITE, message)
+
+        if not message:
+            self.shutdown_request(request)
+
+
+class PreforkServer(Server):
+    """
+    ``PreforkServer`` is a ``Server`` that serves from many processes. Each
+    worker process has its own listening socket bound to the same port with
+    the ``SO_REUSEPORT`` option, so the kernel balances the connections among
+    them. The process that starts the server is one of the workers, and the
+    others are forked when it starts serving. The number of workers is given
+    by the ``workers`` argument (by default, the number of CPUs)::
+
+    >>> with PreforkServer(message='My message', workers=2) as server:
+    ...     len(server.processes)
+    ...     with contextlib.closing(socket.socket()) as s:
+    ...         s.connect(('localhost', 9000))
+    ...         s.recv(10)
+    1
+    b'My message'
+
+    The forked workers are terminated once the server is shut down::
+
+    >>> any(process.is_alive() for process in server.processes)
+    False
+
+    ``SO_REUSEPORT`` is not available in every platform (notably, Windows),
+    and it does not work with Unix sockets, so ``PreforkServer`` only listens
+    to TCP ports.
+
+    If ``stats`` is true, only the connections served by the process that
+    started the server are counted.
+
+    Forking
+    -------
+
+    Only the thread that forks survives in the child processes, so a worker
+    forked while another thread holds a lock (e.g. the one from the
+    ``logging`` module) may block forever on that lock. With the ``with``
+    statement, the workers are forked before the server starts its own
+    thread. If ``serve_forever()`` is called directly, they are forked from
+    the thread calling it, so call it before starting other threads.
+    """
+
+    def __init__(
+            self, host='localhost', port=9000, message='Message sent',
+            wait_for_release=0.001, workers=None, stats=False):
+        Server.__init__(
+            self, host, port, message, wait_for_release, stats=stats
+        )
+
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.processes = []
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        socketserver.TCPServer.server_bind(self)
+
+    def serve_forever(self, poll_interval=None):
+        self._lazy_init()
+
+        if not self._has_workers():
+            self._fork_workers(poll_interval)
+
+        try:
+            Server.serve_forever(self, poll_interval)
+        finally:
+            self._stop_workers()
+
+    def __enter__(self):
+        # Forked before the serving thread starts, so it is not one more
+        # thread of the process being forked.
+        self._lazy_init()
+        self._fork_workers()
+
+        try:
+            return Server.__enter__(self)
+        except BaseException:
+            self._stop_workers()
+            raise
+
+    def _has_workers(self):
+        return any(process.is_alive() for process in self.processes)
+
+    def _fork_workers(self, poll_interval=None):
+        context = multiprocessing.get_context('fork')
+        self.processes = [
+            context.Process(target=self._serve_worker, args=(poll_interval,))
+            for i in range(self.workers - 1)
+        ]
+
+        for process in self.processes:
+            process.daemon = True
+            process.start()
+
+    def _stop_workers(self):
+        for process in self.processes:
+            process.terminate()
+            process.join()
+
+    def _serve_worker(self, poll_interval):
+        """
+        Serves in a forked worker process, with its own listening socket.
+        """
+        self.socket.close()
+        socketserver.TCPServer.__init__(
+            self, (self.host, self.server_address[1]), ServerHandler
+        )
+        socketserver.TCPServer.serve_forever(self, poll_interval)
+
+
+class _StreamServer(ThreadingServer):
+    """
+    Base of the servers that read everything their connections send instead
+    of sending a message: ``EchoServer``, ``SinkServer``, ``HTTPServer`` and
+    ``RedisServer``. Each connection is served in its own thread, reading
+    into a buffer allocated once for the connection, and the server keeps
+    ``ServerStats`` unless ``stats`` is false. Connections still open are
+    shut down when the server is closed.
+    """
+
+    # Whether the data read is sent back.
+    echo = False
+
+    # The connection threads are joined when the server is closed, so the
+    # statistics are complete once it is.
+    daemon_threads = False
+
+    def __init__(self, host='localhost', port=9000, path=None, stats=True):
+        ThreadingServer.__init__(
+            self, host=host, port=port, path=path, stats=stats
+        )
+
+        self._requests_lock = threading.Lock()
+        self._requests = set()
+
+    def finish_request(self, request, client_address):
+        buffer = memoryview(bytearray(_CHUNK_SIZE))
+        self._opened(request)
+
+        try:
+            while True:
+                size = request.recv_into(buffer)
+
+                if not size:
+                    break
+
+                self._received(size)
+
+                if self.echo:
+                    request.sendall(buffer[:size])
+                    self._sent(size)
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            self._closed(request)
+
+    def server_close(self):
+        # Connections still open would keep their threads reading forever.
+        with self._requests_lock:
+            requests = list(self._requests)
+
+        for request in requests:
+            with contextlib.suppress(socket.error):
+                request.shutdown(socket.SHUT_RDWR)
+
+        ThreadingServer.server_close(self)
+
+    def socketpair(self):
+        """
+        Returns a socket connected to the server through a socket pair, as
+        ``Server.socketpair()``. The other side is served from a new thread.
+        """
+        client, request = socket.socketpair()
+
+        if self.stats is not None:
+            self.stats._accepted(request)
+
+        thread = threading.Thread(
+            target=self.process_request_thread, args=(request, None)
+        )
+        thread.daemon = True
+        thread.start()
+
+        return client
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            while True:
+                data = await reader.read(_CHUNK_SIZE)
+
+                if not data:
+                    break
+
+                self._received(len(data))
+
+                if self.echo:
+                    writer.write(data)
+                    await writer.drain()
+                    self._sent(len(data))
+
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+
+    def _opened(self, request):
+        with self._requests_lock:
+            self._requests.add(request)
+
+    def _closed(self, request):
+        with self._requests_lock:
+            self._requests.discard(request)
+
+    def _received(self, size):
+        if self.stats is not None:
+            self.stats._received(size)
+
+    def _sent(self, size):
+        if self.stats is not None:
+            self.stats._sent(size)
+
+    def _answered(self, count):
+        if self.stats is not None:
+            self.stats._answered(count)
+
+
+class EchoServer(_StreamServer):
+    """
+    ``EchoServer`` sends back everything each connection sends, until the
+    connection is closed::
+
+    >>> with EchoServer(port=0) as server:
+    ...     with socket.create_connection(('localhost', server.port)) as s:
+    ...         s.sendall(b'My message')
+    ...         s.recv(10)
+    b'My message'
+
+    Each connection is served in its own thread, and the data is read into a
+    buffer allocated once per connection, so it is a cheap baseline when
+    measuring the throughput of socket clients.
+
+    The server keeps ``ServerStats`` in the ``stats`` attribute, counting the
+    connections and the bytes received and sent by all of them::
+
+    >>> server.stats.connections, server.stats.active_connections
+    (1, 0)
+    >>> server.stats.bytes_received, server.stats.bytes_sent
+    (10, 10)
+
+    The ``throughput`` of the statistics has the bytes received per second
+    since the first connection was accepted, and ``reset()`` sets them back
+    to zero, e.g. between measurements. If the ``stats`` argument is false,
+    no statistics are kept.
+
+    As ``Server``, it can listen to a Unix socket if given a ``path``, be
+    used in an ``async with`` statement and serve a ``socketpair()``.
+    """
+
+    echo = True
+
+
+class SinkServer(_StreamServer):
+    """
+    ``SinkServer`` reads and counts everything each connection sends, as fast
+    as it can, and sends nothing back. It closes the connection once the
+    client stops sending, so a client can know all its data was counted by
+    shutting its side down and waiting for the server to close::
+
+    >>> with SinkServer(port=0) as server:
+    ...     with socket.create_connection(('localhost', server.port)) as s:
+    ...         s.sendall(b'x' * 100000)
+    ...         s.shutdown(socket.SHUT_WR)
+    ...         s.recv(10)
+    b''
+    >>> server.stats.bytes_received, server.stats.bytes_sent
+    (100000, 0)
+    >>> server.stats.throughput > 0
+    True
+
+    It keeps the same statistics as ``EchoServer``.
+    """
+
+
+class HTTPServer(_StreamServer):
+    """
+    ``HTTPServer`` is a stand-in for HTTP servers. It answers each path with
+    a canned response, given by the ``routes`` argument::
+
+    >>> import http.client
+    >>> with HTTPServer(port=0, routes={'/': 'My message'}) as server:
+    ...     client = http.client.HTTPConnection('localhost', server.port)
+    ...     client.request('GET', '/')
+    ...     response = client.getresponse()
+    ...     response.status, response.read()
+    ...     client.close()
+    (200, b'My message')
+
+    Paths without a route get a ``404 Not Found`` response. The query string
+    is ignored, unless the route has it.
+
+    Responses
+    ---------
+
+    A route may map to the body of the response: a string (sent as UTF-8
+    text) or a ``bytes`` object. It can also map to a ``(status, body)`` or
+    a ``(status, headers, body)`` tuple, where the headers are a dict. Routes
+    can also be added by the ``route()`` method::
+
+    >>> server = HTTPServer(port=0)
+    >>> server.route(
+    ...     '/data', b'{}', status=201,
+    ...     headers={'Content-Type': 'application/json'}
+    ... )
+
+    Any status code can be given, even one not in the standard (such as
+    ``299``), in which case the status line has no reason phrase.
+
+    The responses (status line, headers and body) are computed once, when
+    the route is set, so serving a request costs no more than parsing it and
+    sending bytes that are ready.
+
+    Connections
+    -----------
+
+    The connections are persistent, as HTTP/1.1 asks: many requests can be
+    sent through the same connection, which is only closed when the client
+    closes it or sends a ``Connection: close`` header. Clients can also
+    pipeline requests, sending them without waiting for the previous
+    responses. All responses to the requests read at once are sent together::
+
+    >>> with server:
+    ...     with socket.create_connection(('localhost', server.port)) as s:
+    ...         s.sendall(
+    ...             b'GET /data HTTP/1.1\\r\\nHost: localhost\\r\\n\\r\\n'
+    ...             b'GET /none HTTP/1.1\\r\\nHost: localhost\\r\\n'
+    ...             b'Connection: close\\r\\n\\r\\n'
+    ...         )
+    ...         response = b''
+    ...         while not response.endswith(b'Not Found'):
+    ...             response += s.recv(1024)
+    >>> print(response.decode().replace('\\r\\n', '\\n'))
+    HTTP/1.1 201 Created
+    Content-Type: application/json
+    Content-Length: 2
+    <BLANKLINE>
+    {}HTTP/1.1 404 Not Found
+    Content-Type: text/plain; charset=utf-8
+    Content-Length: 9
+    Connection: close
+    <BLANKLINE>
+    Not Found
+
+    Each connection is served in its own thread. Besides the statistics of
+    ``EchoServer``, the server counts the requests it answered::
+
+    >>> server.stats.requests, server.stats.connections
+    (2, 1)
+
+    Request bodies are read (according to their ``Content-Length`` header)
+    and ignored. Chunked request bodies are not supported.
+    """
+
+    def __init__(
+            self, host='localhost', port=9000, routes=None, path=None,
+            stats=True):
+        _StreamServer.__init__(
+            self, host=host, port=port, path=path, stats=stats
+        )
+
+        self.routes = {}
+
+        for route_path, response in (routes or {}).items():
+            if not isinstance(response, tuple):
+                self.route(route_path, response)
+            elif len(response) == 2:
+                status, body = response
+                self.route(route_path, body, status)
+            else:
+                status, headers, body = response
+                self.route(route_path, body, status, headers)
+
+    def route(self, path, body, status=200, headers=None):
+        """
+        Answers requests to the path with the given response.
+        """
+        self.routes[path] = _HTTPResponse(status, headers, body)
+
+    def finish_request(self, request, client_address):
+        parser = _HTTPParser()
+        self._opened(request)
+
+        try:
+            while True:
+                data = request.recv(_CHUNK_SIZE)
+
+                if not data:
+                    break
+
+                self._received(len(data))
+                response, close = self._respond(parser, data)
+
+                if response:
+                    request.sendall(response)
+                    self._sent(len(response))
+
+                if close:
+                    break
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            self._closed(request)
+
+    async def _serve_connection(self, reader, writer):
+        parser = _HTTPParser()
+
+        try:
+            while True:
+                data = await reader.read(_CHUNK_SIZE)
+
+                if not data:
+                    break
+
+                self._received(len(data))
+                response, close = self._respond(parser, data)
+
+                if response:
+                    writer.write(response)
+                    await writer.drain()
+                    self._sent(len(response))
+
+                if close:
+                    break
+
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+
+    def _respond(self, parser, data):
+        """
+        Parses the data read from a connection, returning the responses to
+        all requests it completed and whether the connection should be closed
+        after them.
+        """
+        responses = []
+        close = False
+
+        for request in parser.feed(data):
+            if request is None:
+                responses.append(_BAD_REQUEST.get(False, 'close'))
+                close = True
+                break
+
+            method, target, connection = request
+            responses.append(
+                self._find_route(target).get(method == 'HEAD', connection)
+            )
+
+            if connection == 'close':
+                close = True
+                break
+
+        self._answered(len(responses))
+
+        return b''.join(responses), close
+
+    def _find_route(self, target):
+        response = self.routes.get(target)
+
+        if response is None:
+            response = self.routes.get(target.partition('?')[0], _NOT_FOUND)
+
+        return response
+
+
+class RedisServer(_StreamServer):
+    """
+    ``RedisServer`` is an in-memory stand-in for Redis. It speaks enough of
+    the Redis protocol (RESP) for tests that use Redis as a cache or a
+    counter, so they can run without a real Redis::
+
+    >>> with RedisServer(port=0) as server:
+    ...     with socket.create_connection(('localhost', server.port)) as s:
+    ...         s.sendall(b'*2\\r\\n$3\\r\\nGET\\r\\n$3\\r\\nkey\\r\\n')
+    ...         s.recv(1024)
+    b'$-1\\r\\n'
+
+    By default, it listens to the port of Redis, 6379.
+
+    Commands can also be sent inline, as from a terminal. As any Redis
+    client does, many commands can be sent at once. They are run in a batch,
+    and their replies are sent together::
+
+    >>> with RedisServer(port=0) as server:
+    ...     with socket.create_connection(('localhost', server.port)) as s:
+    ...         s.sendall(b'INCR hits\\r\\nINCR hits\\r\\nGET hits\\r\\n')
+    ...         reply = b''
+    ...         while not reply.endswith(b'$1\\r\\n2\\r\\n'):
+    ...             reply += s.recv(1024)
+    >>> reply
+    b':1\\r\\n:2\\r\\n$1\\r\\n2\\r\\n'
+
+    Data
+    ----
+
+    The values are kept in the ``data`` attribute, a dict mapping keys to
+    values, both as ``bytes``. It can be inspected and changed by the tests,
+    and the initial values can be given by the ``data`` argument::
+
+    >>> server = RedisServer(port=0, data={'key': 'value'})
+    >>> server.data
+    {b'key': b'value'}
+
+    The data is shared by all connections, and is still there after the
+    server is closed.
+
+    Commands
+    --------
+
+    The supported commands are ``PING``, ``ECHO``, ``GET``, ``SET`` (with
+    the ``EX``, ``PX``, ``NX`` and ``XX`` options), ``MGET``, ``MSET``,
+    ``DEL``, ``EXISTS``, ``KEYS``, ``DBSIZE``, ``INCR``, ``INCRBY``,
+    ``DECR``, ``DECRBY``, ``EXPIRE``, ``PEXPIRE``, ``TTL``, ``PTTL``,
+    ``PERSIST``, ``FLUSHDB``, ``FLUSHALL``, ``SELECT`` and ``QUIT``, as well
+    as the ``MULTI``, ``EXEC`` and ``DISCARD`` transactions. Other commands
+    get an error reply.
+
+    There is a single database, and only strings are stored. Keys expire
+    when they are read after their time is over.
+
+    Each command is a ``do_`` method (e.g. ``do_GET()``), which gets the
+    arguments as ``bytes`` and returns the encoded reply, so subclasses can
+    add commands. Besides the statistics of ``EchoServer``, the server
+    counts the commands it ran in the ``requests`` attribute of ``stats``.
+    """
+
+    def __init__(
+            self, host='localhost', port=6379, data=None, path=None,
+            stats=True):
+        _StreamServer.__init__(
+            self, host=host, port=port, path=path, stats=stats
+        )
+
+        self.data = {
+            _to_bytes(key): _to_bytes(value)
+            for key, value in (data or {}).items()
+        }
+        self.expires = {}
+        self._data_lock = threading.Lock()
+
+    def finish_request(self, request, client_address):
+        parser = _RESPParser()
+        session = _RedisSession()
+        self._opened(request)
+
+        try:
+            while not session.closed:
+                data = request.recv(_CHUNK_SIZE)
+
+                if not data:
+                    break
+
+                self._received(len(data))
+                reply = self._run(session, parser.feed(data))
+
+                if reply:
+                    request.sendall(reply)
+                    self._sent(len(reply))
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            self._closed(request)
+
+    async def _serve_connection(self, reader, writer):
+        parser = _RESPParser()
+        session = _RedisSession()
+
+        try:
+            while not session.closed:
+                data = await reader.read(_CHUNK_SIZE)
+
+                if not data:
+                    break
+
+                self._received(len(data))
+                reply = self._run(session, parser.feed(data))
+
+                if reply:
+                    writer.write(reply)
+                    await writer.drain()
+                    self._sent(len(reply))
+
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+
+    def _run(self, session, commands):
+        """
+        Runs a batch of commands from a connection, returning their replies.
+        The data is locked once for the whole batch.
+        """
+        replies = []
+
+        with self._data_lock:
+            for command in commands:
+                if command is None:
+                    replies.append(_resp_error('ERR Protocol error'))
+                    session.closed = True
+                else:
+                    replies.append(self._run_command(session, command))
+
+                if session.closed:
+                    break
+
+        self._answered(len(replies))
+
+        return b''.join(replies)
+
+    def _run_command(self, session, command):
+        name = command[0].decode('latin-1').upper()
+        arguments = command[1:]
+
+        if name == 'MULTI':
+            if session.transaction is not None:
+                return _resp_error('ERR MULTI calls can not be nested')
+
+            session.transaction = []
+            session.aborted = False
+
+            return _RESP_OK
+        elif name in ('EXEC', 'DISCARD'):
+            transaction = session.transaction
+            session.transaction = None
+
+            if transaction is None:
+                return _resp_error('ERR {0} without MULTI'.format(name))
+            elif name == 'DISCARD':
+                return _RESP_OK
+            elif session.aborted:
+                return _resp_error(
+                    'EXECABORT Transaction discarded because of previous '
+                    'errors.'
+                )
+
+            return b'*%d\r\n' % len(transaction) + b''.join(
+                self._call(method, arguments)
+                for method, arguments in transaction
+            )
+        elif name == 'QUIT':
+            session.closed = True
+
+            return _RESP_OK
+
+        method = getattr(self, 'do_' + name, None) if name.isalpha() else None
+
+        if method is None:
+            reply = _resp_error(
+                "ERR unknown command '{0}'".format(name.lower())
+            )
+        elif not _accepts(method, arguments):
+            reply = _resp_error(
+                "ERR wrong number of arguments for '{0}' command".format(
+                    name.lower()
+                )
+            )
+        elif session.transaction is not None:
+            session.transaction.append((method, arguments))
+
+            return b'+QUEUED\r\n'
+        else:
+            return self._call(method, arguments)
+
+        if session.transaction is not None:
+            session.aborted = True
+
+        return reply
+
+    def _call(self, method, arguments):
+        try:
+            return method(*arguments)
+        except _RESPError as e:
+            return _resp_error(str(e))
+
+    def do_PING(self, message=None):
+        return b'+PONG\r\n' if message is None else _resp_bulk(message)
+
+    def do_ECHO(self, message):
+        return _resp_bulk(message)
+
+    def do_SELECT(self, index):
+        return _RESP_OK
+
+    def do_GET(self, key):
+        return _resp_bulk(self._get(key))
+
+    def do_MGET(self, key, *keys):
+        return _resp_array(self._get(k) for k in (key,) + keys)
+
+    def do_SET(self, key, value, *options):
+        conditions = set()
+        expires = None
+        i = 0
+
+        while i < len(options):
+            option = options[i].upper()
+
+            if option in (b'EX', b'PX') and i + 1 < len(options):
+                milliseconds = _resp_integer(options[i + 1])
+
+                if option == b'EX':
+                    milliseconds *= 1000
+
+                expires = time.monotonic() + milliseconds / 1000
+                i += 2
+            elif option in (b'NX', b'XX'):
+                conditions.add(option)
+                i += 1
+            else:
+                raise _RESPError('ERR syntax error')
+
+        exists = self._get(key) is not None
+
+        if (b'NX' in conditions and exists) or \
+                (b'XX' in conditions and not exists):
+            return _RESP_NIL
+
+        self.data[key] = value
+        self._set_expiration(key, expires)
+
+        return _RESP_OK
+
+    def do_MSET(self, key, value, *pairs):
+        if len(pairs) % 2:
+            raise _RESPError(
+                "ERR wrong number of arguments for 'mset' command"
+            )
+
+        pairs = (key, value) + pairs
+
+        for i in range(0, len(pairs), 2):
+            self.data[pairs[i]] = pairs[i + 1]
+            self._set_expiration(pairs[i], None)
+
+        return _RESP_OK
+
+    def do_DEL(self, key, *keys):
+        count = 0
+
+        for k in (key,) + keys:
+            if self._get(k) is not None:
+                del self.data[k]
+                self._set_expiration(k, None)
+                count += 1
+
+        return b':%d\r\n' % count
+
+    def do_EXISTS(self, key, *keys):
+        return b':%d\r\n' % sum(
+            self._get(k) is not None for k in (key,) + keys
+        )
+
+    def do_KEYS(self, pattern):
+        pattern = pattern.decode('latin-1')
+
+        return _resp_array(
+            key for key in list(self.data)
+            if self._get(key) is not None
+            and fnmatch.fnmatchcase(key.decode('latin-1'), pattern)
+        )
+
+    def do_DBSIZE(self):
+        return b':%d\r\n' % sum(
+            self._get(key) is not None for key in list(self.data)
+        )
+
+    def do_INCR(self, key):
+        return self._increment(key, 1)
+
+    def do_DECR(self, key):
+        return self._increment(key, -1)
+
+    def do_INCRBY(self, key, increment):
+        return self._increment(key, _resp_integer(increment))
+
+    def do_DECRBY(self, key, decrement):
+        return self._increment(key, -_resp_integer(decrement))
+
+    def do_EXPIRE(self, key, seconds):
+        return self._expire(key, _resp_integer(seconds) * 1000)
+
+    def do_PEXPIRE(self, key, milliseconds):
+        return self._expire(key, _resp_integer(milliseconds))
+
+    def do_TTL(self, key):
+        return self._ttl(key, 1)
+
+    def do_PTTL(self, key):
+        return self._ttl(key, 0.001)
+
+    def do_PERSIST(self, key):
+        persisted = self._get(key) is not None and key in self.expires
+        self._set_expiration(key, None)
+
+        return b':%d\r\n' % persisted
+
+    def do_FLUSHDB(self, *options):
+        self.data.clear()
+        self.expires.clear()
+
+        return _RESP_OK
+
+    do_FLUSHALL = do_FLUSHDB
+
+    def _get(self, key):
+        """
+        Returns the value of the key, or ``None`` if there is none. Expired
+        keys are removed here.
+        """
+        expires = self.expires.get(key)
+
+        if expires is not None and expires <= time.monotonic():
+            del self.expires[key]
+            self.data.pop(key, None)
+
+        return self.data.get(key)
+
+    def _set_expiration(self, key, expires):
+        if expires is None:
+            self.expires.pop(key, None)
+        else:
+            self.expires[key] = expires
+
+    def _increment(self, key, increment):
+        value = self._get(key)
+        value = (_resp_integer(value) if value is not None else 0) + increment
+        self.data[key] = str(value).encode()
+
+        return b':%d\r\n' % value
+
+    def _expire(self, key, milliseconds):
+        if self._get(key) is None:
+            return b':0\r\n'
+
+        self._set_expiration(key, time.monotonic() + milliseconds / 1000)
+
+        return b':1\r\n'
+
+    def _ttl(self, key, unit):
+        if self._get(key) is None:
+            return b':-2\r\n'
+        elif key not in self.expires:
+            return b':-1\r\n'
+
+        return b':%d\r\n' % round(
+            (self.expires[key] - time.monotonic()) / unit
+        )
+
+
+class Proxy(socketserver.ThreadingMixIn, _Listener):
+    """
+    ``Proxy`` is a server that relays connections to another address, making
+    the network look worse than it is. It can delay the data, limit the
+    bandwidth and reset connections, so we can see how a client behaves on a
+    slow network without leaving the machine::
+
+    >>> with Server(port=0, message='My message') as server:
+    ...     with Proxy(('localhost', server.port), latency=0.05) as proxy:
+    ...         start = time.monotonic()
+    ...         with socket.create_connection(('localhost', proxy.port)) as s:
+    ...             s.recv(10)
+    ...         0.05 < time.monotonic() - start < 0.1
+    b'My message'
+    True
+
+    The first argument is the address of the target server: a ``(host,
+    port)`` pair or the path of a Unix socket. As ``Server``, the proxy
+    listens to the ``host`` and ``port`` arguments (or to the ``path``
+    argument, if given). By default, it listens to a port chosen by the
+    system, updating the ``port`` attribute.
+
+    Each connection to the proxy is served in its own thread, which opens a
+    connection to the target and relays the data both ways until both sides
+    close it.
+
+    Latency
+    -------
+
+    The ``latency`` argument is how many seconds each chunk of data is held
+    before being relayed. It is applied in each direction, so a request and
+    its response take twice the latency. If the ``jitter`` argument is
+    given, a random value between ``-jitter`` and ``jitter`` is added to the
+    latency of each chunk. The data is never reordered, though: a chunk is
+    not relayed before the ones read before it.
+
+    Bandwidth
+    ---------
+
+    The ``bandwidth`` argument limits how many bytes per second each
+    connection relays in each direction. It is enforced by a token bucket:
+    up to ``burst`` bytes (by default, 16 KiB) can be sent at once, after
+    which the data flows at the given rate::
+
+    >>> with Server(port=0, message=b'x' * 100000) as server:
+    ...     with Proxy(('localhost', server.port), bandwidth=1000000) as proxy:
+    ...         start = time.monotonic()
+    ...         with socket.create_connection(('localhost', proxy.port)) as s:
+    ...             while s.recv(65536):
+    ...                 pass
+    ...         0.08 < time.monotonic() - start < 0.15
+    True
+
+    Resets
+    ------
+
+    If the ``reset_after`` argument is given, each connection is reset (on
+    both sides) once it has relayed that many bytes::
+
+    >>> with Server(port=0, message=b'My message') as server:
+    ...     with Proxy(('localhost', server.port), reset_after=2) as proxy:
+    ...         with socket.create_connection(('localhost', proxy.port)) as s:
+    ...             s.recv(10)
+    ...             s.recv(10)
+    Traceback (most recent call last):
+     ...
+    ConnectionResetError: [Errno 104] Connection reset by peer
+
+    Connections still open when the proxy is closed are reset as well.
+
+    Statistics
+    ----------
+
+    The proxy records what it saw of each connection in a ``ProxyConnection``
+    object, listed in the ``connections`` attribute. The proxy also sums the
+    bytes relayed by all connections::
+
+    >>> with Server(port=0, message=b'My message') as server:
+    ...     with Proxy(('localhost', server.port)) as proxy:
+    ...         with socket.create_connection(('localhost', proxy.port)) as s:
+    ...             s.sendall(b'Hi')
+    ...             s.recv(10)
+    b'My message'
+    >>> len(proxy.connections)
+    1
+    >>> proxy.upstream_bytes, proxy.downstream_bytes
+    (2, 10)
+
+    Recording
+    ---------
+
+    If an ``inelegant.load.TrafficRecorder`` is given as the ``recorder``
+    argument, the proxy records the data of each connection, as it comes
+    from the client or the target, so the traffic can be replayed later by
+    ``inelegant.load.replay()``. The data is recorded when the proxy reads
+    it, before latency and bandwidth limits are applied.
+    """
+
+    # The connection threads are joined when the proxy is closed, so the
+    # statistics are complete once it is.
+    daemon_threads = False
+
+    def __init__(
+            self, target=('localhost', 9000), host='localhost', port=0,
+            latency=0, jitter=0, bandwidth=None, burst=None,
+            reset_after=None, seed=None, path=None, connect_timeout=1,
+            recorder=None):
+        _Listener.__init__(self, host=host, port=port, path=path)
+
+        self.target = target
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.burst = burst if burst is not None else _PROXY_BURST
+        self.reset_after = reset_after
+        self.connect_timeout = connect_timeout
+        self.random = random.Random(seed)
+        self.recorder = recorder
+
+        self.connections = []
+
+    @property
+    def upstream_bytes(self):
+        """
+        The number of bytes relayed from the clients to the target.
+        """
+        return sum(c.upstream_bytes for c in self.connections)
+
+    @property
+    def downstream_bytes(self):
+        """
+        The number of bytes relayed from the target to the clients.
+        """
+        return sum(c.downstream_bytes for c in self.connections)
+
+    def finish_request(self, request, client_address):
+        connection = ProxyConnection(client_address)
+        self.connections.append(connection)
+
+        if self.recorder is not None:
+            connection.recorded = self.recorder.start_connection()
+
+        try:
+            upstream = self._connect_upstream()
+        except socket.error:
+            connection.reset = True
+            _abort(request)
+        else:
+            connection.connected = time.monotonic()
+
+            try:
+                self._relay(connection, request, upstream)
+            finally:
+                upstream.close()
+        finally:
+            connection.closed = time.monotonic()
+
+            if self.recorder is not None:
+                self.recorder.record(connection.recorded, FRAME_CLOSE)
+
+    def server_close(self):
+        if self._is_initialized():
+            # Never drained, so it wakes up every connection still open.
+            self._closing_writer.send(b'\0')
+            socketserver.ThreadingMixIn.server_close(self)
+            self._closing_reader.close()
+            self._closing_writer.close()
+
+    def _connect_upstream(self):
+        if _is_path(self.target):
+            upstream = socket.socket(socket.AF_UNIX)
+
+            try:
+                upstream.settimeout(self.connect_timeout)
+                upstream.connect(self.target)
+            except socket.error:
+                upstream.close()
+                raise
+        else:
+            upstream = socket.create_connection(
+                self.target, self.connect_timeout
+            )
+
+        return upstream
+
+    def _relay(self, connection, client, upstream):
+        for s in (client, upstream):
+            s.setblocking(False)
+
+        try:
+            finished = self._pump(connection, client, upstream)
+        except socket.error:
+            finished = False
+
+        if not finished:
+            self._reset(connection, client, upstream)
+
+    def _pump(self, connection, client, upstream):
+        """
+        Relays the data between the client and the target from a selector
+        loop. Returns ``True`` once both directions are closed, or ``False``
+        if the connection should be reset.
+        """
+        pipes = [
+            _ProxyPipe(self, client, upstream, self._get_record(
+                connection, FRAME_CLIENT
+            )),
+            _ProxyPipe(self, upstream, client, self._get_record(
+                connection, FRAME_SERVER
+            ))
+        ]
+        readers = {client: pipes[0], upstream: pipes[1]}
+        writers = {client: pipes[1], upstream: pipes[0]}
+        allowance = self.reset_after
+        closing = False
+
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._closing_reader, selectors.EVENT_READ)
+
+            while True:
+                now = time.monotonic()
+                wake_ups = []
+
+                for pipe in pipes:
+                    wake_ups.append(pipe.flush(now, allowance))
+
+                    if allowance is not None:
+                        allowance -= pipe.flushed
+
+                connection.upstream_bytes = pipes[0].bytes
+                connection.downstream_bytes = pipes[1].bytes
+
+                if connection.first_byte is None and pipes[1].bytes:
+                    connection.first_byte = now
+
+                if all(pipe.done for pipe in pipes):
+                    return True
+
+                # When the proxy is closed, the events that came along with
+                # it (e.g. the client closing the connection) still count.
+                if allowance == 0 or closing:
+                    return False
+
+                wake_ups = [w for w in wake_ups if w is not None]
+                timeout = max(min(wake_ups) - now, 0) if wake_ups else None
+
+                for s in (client, upstream):
+                    _watch(selector, s, readers[s], writers[s])
+
+                for key, events in selector.select(timeout):
+                    if key.fileobj is self._closing_reader:
+                        closing = True
+                        continue
+
+                    if events & selectors.EVENT_READ:
+                        readers[key.fileobj].read(time.monotonic())
+
+                    if events & selectors.EVENT_WRITE:
+                        writers[key.fileobj].blocked = False
+
+    def _get_record(self, connection, kind):
+        """
+        Returns the function a pipe calls to record the data it reads, or
+        ``None`` if nothing is recorded.
+        """
+        if self.recorder is not None:
+            return functools.partial(
+                self.recorder.record, connection.recorded, kind
+            )
+
+    def _reset(self, connection, client, upstream):
+        connection.reset = True
+        _abort(client)
+        _abort(upstream)
+
+    def _lazy_init(self):
+        with self.init_lock:
+            if not hasattr(self, '_closing_reader'):
+                self._closing_reader, self._closing_writer = \
+                    socket.socketpair()
+
+        _Listener._lazy_init(self)
+
+
+class ProxyConnection(object):
+    """
+    ``ProxyConnection`` has what a ``Proxy`` observed of a connection: the
+    address of the client, the number of bytes relayed in each direction and
+    when it was opened, connected to the target, got the first byte from the
+    target and was closed, as given by ``time.monotonic()``. Times not
+    reached yet (or ever) are ``None``::
+
+    >>> with Server(port=0, message=b'My message') as server:
+    ...     with Proxy(('localhost', server.port)) as proxy:
+    ...         with socket.create_connection(('localhost', proxy.port)) as s:
+    ...             s.recv(10)
+    b'My message'
+    >>> connection = proxy.connections[0]
+    >>> connection.downstream_bytes
+    10
+    >>> connection.connect_time < connection.time_to_first_byte
+    True
+    >>> connection.time_to_first_byte <= connection.duration
+    True
+    >>> connection.reset
+    False
+    """
+
+    def __init__(self, client_address):
+        self.client_address = client_address
+        self.upstream_bytes = 0
+        self.downstream_bytes = 0
+        self.reset = False
+
+        # The number of the connection in the proxy's recorder, if any.
+        self.recorded = None
+
+        self.opened = time.monotonic()
+        self.connected = None
+        self.first_byte = None
+        self.closed = None
+
+    @property
+    def connect_time(self):
+        """
+        How long the proxy took to connect to the target.
+        """
+        return _elapsed(self.opened, self.connected)
+
+    @property
+    def time_to_first_byte(self):
+        """
+        How long the client waited for the first byte from the target.
+        """
+        return _elapsed(self.opened, self.first_byte)
+
+    @property
+    def duration(self):
+        return _elapsed(self.opened, self.closed)
+
+
+class ServerPool(object):
+    """
+    ``ServerPool`` keeps servers running so they can be reused by many tests.
+    Starting and stopping a server for each test takes time, and its port
+    may stay busy for a while after it stops. With a pool, a test leases a
+    server with the message it needs and returns it at the end::
+
+    >>> pool = ServerPool()
+    >>> with pool.lease(message='My message') as server:
+    ...     with contextlib.closing(socket.socket()) as s:
+    ...         s.connect(('localhost', server.port))
+    ...         s.recv(10)
+    b'My message'
+
+    The server is not stopped once returned. The next lease will get it
+    again, with the new message::
+
+    >>> with pool.lease(message='Other message') as other_server:
+    ...     other_server is server
+    ...     with contextlib.closing(socket.socket()) as s:
+    ...         s.connect(('localhost', other_server.port))
+    ...         s.recv(13)
+    True
+    b'Other message'
+
+    Each server listens to a port chosen by the system, so the pool can be
+    shared by tests running in parallel. If all servers are leased, a new one
+    is started. To have servers ready before the first lease, give their
+    number as the ``size`` argument. The ``server_class`` argument sets the
+    class of the servers (by default, ``Server``).
+
+    The servers are stopped when the pool is closed::
+
+    >>> pool.close()
+    >>> wait_server_down('localhost', server.port)
+
+    ``ServerPool`` is a context manager as well, closing itself at the end of
+    the block. Usually, though, a pool is kept for the whole test session,
+    e.g. in a module-level variable.
+
+    Releasing
+    ---------
+
+    Only servers leased from the pool can be released, and only once::
+
+    >>> pool = ServerPool()
+    >>> server = pool.acquire()
+    >>> pool.release(server)
+    >>> pool.release(server)
+    Traceback (most recent call last):
+     ...
+    ValueError: The server is not leased from this pool.
+    >>> pool.close()
+
+    Leased servers are stopped with the pool as well. They can still be
+    released after that, but the pool leases no more servers::
+
+    >>> pool = ServerPool()
+    >>> server = pool.acquire()
+    >>> pool.close()
+    >>> pool.release(server)
+    >>> pool.acquire()
+    Traceback (most recent call last):
+     ...
+    RuntimeError: Cannot lease servers from a closed pool.
+    """
+
+    def __init__(self, size=0, server_class=None, host='localhost'):
+        self.server_class = server_class if server_class else Server
+        self.host = host
+
+        self.servers = []
+        self._idle = []
+        self._leased = set()
+        self._closed = False
+        self._lock = threading.Lock()
+
+        for i in range(size):
+            self._idle.append(self._start_server())
+
+    def acquire(self, message='Message sent'):
+        """
+        Leases a server from the pool, setting its message. The server should
+        be given back with ``release()``. It fails if the pool is closed.
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Cannot lease servers from a closed pool.')
+
+            server = self._idle.pop() if self._idle else None
+
+        if server is None:
+            server = self._start_server()
+
+        server.message = message
+
+        with self._lock:
+            self._leased.add(server)
+
+        return server
+
+    def release(self, server):
+        """
+        Gives a leased server back to the pool. If the pool was closed since
+        the server was leased, the server was stopped, and is dropped.
+        """
+        with self._lock:
+            if server not in self._leased:
+                raise ValueError('The server is not leased from this pool.')
+
+            self._leased.remove(server)
+
+            if server in self.servers:
+                self._idle.append(server)
+
+    @contextlib.contextmanager
+    def lease(self, message='Message sent'):
+        """
+        Leases a server during the ``with`` block.
+        """
+        server = self.acquire(message)
+
+        try:
+            yield server
+        finally:
+            self.release(server)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            servers, self.servers, self._idle = self.servers, [], []
+
+        for server in servers:
+            server.__exit__(None, None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _start_server(self):
+        server = self.server_class(host=self.host, port=0).__enter__()
+
+        with self._lock:
+            closed = self._closed
+
+            if not closed:
+                self.servers.append(server)
+
+        # The pool may have been closed while the server was starting.
+        if closed:
+            server.__exit__(None, None, None)
+            raise RuntimeError('Cannot lease servers from a closed pool.')
+
+        return server
+
+
+def get_listening_addresses():
+    """
+    Returns a set of ``(address, port)`` pairs of all TCP sockets listening in
+    the machine. The information is read from ``/proc/net/tcp`` and
+    ``/proc/net/tcp6``, so it only works on Linux::
+
+    >>> with Server('localhost', 9000):
+    ...     ('127.0.0.1', 9000) in get_listening_addresses()
+    True
+    >>> ('127.0.0.1', 9000) in get_listening_addresses()
+    False
+
+    Sockets listening on all interfaces have the wildcard address (``0.0.0.0``
+    or ``::``).
+    """
+    listening = set()
+
+    for path, family in _TCP_TABLES:
+        try:
+            with open(path) as table:
+                lines = table.readlines()[1:]
+        except IOError:
+            if family == socket.AF_INET6:
+                continue  # IPv6 may be disabled.
+            raise
+
+        for line in lines:
+            fields = line.split()
+            address, port = fields[1].split(':')
+
+            if fields[3] == _TCP_LISTEN:
+                address = _decode_address(family, address)
+                listening.add((address, int(port, 16)))
+
+    return listening
+
+
+def reserve_port(host='localhost'):
+    """
+    Returns a free port from the given host, reserved to the current process.
+    The port is chosen by the operating system, as if a server was bound to
+    port ``0``::
+
+    >>> port = reserve_port()
+    >>> with Server(port=port, message='My message'):
+    ...     with contextlib.closing(socket.socket()) as s:
+    ...         s.connect(('localhost', port))
+    ...         s.recv(10)
+    b'My message'
+
+    Different from the port chosen by a server, this one is known before the
+    server starts. Also, no other call to ``reserve_port()`` will return it
+    while it is reserved, even from other processes::
+
+    >>> other_port = reserve_port()
+    >>> port == other_port
+    False
+
+    So, tests running in parallel processes can start servers in the reserved
+    ports without colliding.
+
+    The reservation is a lock on a file under the temporary directory, so it
+    is released when the process finishes, even if killed. It can also be
+    released with ``release_port()``::
+
+    >>> release_port(port)
+    >>> release_port(other_port)
+
+    ``fcntl`` locks are not available in every platform (notably, Windows).
+    """
+    for i in range(_MAXIMUM_RESERVATION_ATTEMPTS):
+        with contextlib.closing(socket.socket()) as s:
+            s.bind((host, 0))
+            port = s.getsockname()[1]
+
+        lock_file = open(os.path.join(_get_port_registry(), str(port)), 'a')
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()  # Reserved by someone else, let's try again.
+            continue
+
+        with _reservations_lock:
+            _reservations[port] = lock_file
+
+        return port
+
+    raise Exception(
+        'No free port could be reserved after {0} attempts'.format(
+            _MAXIMUM_RESERVATION_ATTEMPTS
+        )
+    )
+
+
+def release_port(port):
+    """
+    Releases a port reserved by ``reserve_port()``, so it can be reserved
+    again. Releasing a port not reserved by the current process does nothing.
+    """
+    with _reservations_lock:
+        lock_file = _reservations.pop(port, None)
+
+    if lock_file is not None:
+        lock_file.close()
+
+
+@contextlib.contextmanager
+def reserved_port(host='localhost'):
+    """
+    ``reserved_port()`` is a context manager that reserves a port with
+    ``reserve_port()`` and releases it at the end of the block::
+
+    >>> with reserved_port() as port:
+    ...     with Server(port=port):
+    ...         wait_server_up('localhost', port)
+    """
+    port = reserve_port(host)
+
+    try:
+        yield port
+    finally:
+        release_port(port)
+
+
+@contextlib.contextmanager
+def temp_hosts(hosts):
+    """
+    ``temp_hosts()`` is a context manager that makes host names resolve to
+    the given IP addresses, without asking the system resolver::
+
+    >>> with temp_hosts({'db.test': '127.0.0.1'}):
+    ...     socket.gethostbyname('db.test')
+    '127.0.0.1'
+
+    So tests can use meaningful names for their servers, and connect to them
+    as usual::
+
+    >>> with Server(host='127.0.0.1', port=9001, message='My message'):
+    ...     with temp_hosts({'db.test': '127.0.0.1'}):
+    ...         wait_server_up('db.test', 9001)
+    ...         with socket.create_connection(('db.test', 9001)) as s:
+    ...             s.recv(10)
+    b'My message'
+
+    A name can be mapped to many addresses, which are returned in order::
+
+    >>> with temp_hosts({'db.test': ['::1', '127.0.0.1']}):
+    ...     [info[4] for info in socket.getaddrinfo('db.test', 80, 0,
+    ...                                             socket.SOCK_STREAM)]
+    [('::1', 80, 0, 0), ('127.0.0.1', 80)]
+
+    Names are case insensitive, and names not in the table are resolved as
+    before::
+
+    >>> with temp_hosts({'db.test': '127.0.0.1'}):
+    ...     socket.gethostbyname('DB.Test')
+    ...     socket.gethostbyname('localhost')
+    '127.0.0.1'
+    '127.0.0.1'
+
+    The table replaces ``socket.getaddrinfo()`` and ``socket.gethostbyname()``
+    during the context, so it works for anything that calls them (e.g.
+    ``socket.create_connection()``, asyncio and the waiters of this module).
+    Sockets given a host name directly (e.g. ``socket.connect()`` or
+    ``socket.bind()``) still resolve it in the system, so servers should bind
+    to the IP addresses themselves.
+    """
+    table = {
+        name.lower(): [addresses] if isinstance(addresses, str)
+        else list(addresses)
+        for name, addresses in hosts.items()
+    }
+    getaddrinfo = socket.getaddrinfo
+    gethostbyname = socket.gethostbyname
+
+    def temp_getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+        addresses = _get_table_addresses(table, host)
+
+        if addresses is None:
+            return getaddrinfo(host, port, family, type, proto, flags)
+
+        infos = []
+        error = None
+
+        for address in addresses:
+            try:
+                infos.extend(getaddrinfo(
+                    address, port, family, type, proto,
+                    flags | socket.AI_NUMERICHOST
+                ))
+            except socket.gaierror as e:
+                error = e  # Probably not from the requested family.
+
+        if not infos:
+            raise error
+
+        return infos
+
+    def temp_gethostbyname(host):
+        addresses = _get_table_addresses(table, host)
+
+        if addresses is None:
+            return gethostbyname(host)
+
+        for address in addresses:
+            if _is_ip(address, socket.AF_INET):
+                return address
+
+        raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+
+    with temp_attr(socket, 'getaddrinfo', temp_getaddrinfo), \
+            temp_attr(socket, 'gethostbyname', temp_gethostbyname):
+        yield
+
+
+def get_listening_paths():
+    """
+    Returns a set with the paths of all Unix sockets listening in the
+    machine. Paths from the abstract namespace start with a null character,
+    as given to ``socket.bind()``. As ``get_listening_addresses()``, it reads
+    a kernel table (``/proc/net/unix``) and only works on Linux::
+
+    >>> with Server(path='\\0inelegant-example'):
+    ...     '\\0inelegant-example' in get_listening_paths()
+    True
+    >>> '\\0inelegant-example' in get_listening_paths()
+    False
+    """
+    listening = set()
+
+    with open(_UNIX_TABLE) as table:
+        lines = table.readlines()[1:]
+
+    for line in lines:
+        fields = line.split(None, 7)
+
+        if len(fields) == 8 and int(fields[3], 16) & _UNIX_ACCEPTING:
+            path = fields[7].rstrip('\n')
+            listening.add('\0' + path[1:] if path.startswith('@') else path)
+
+    return listening
+
+
+def get_socket(timeout=None, family=socket.AF_INET):
+    """
+    This function creates sockets. Its main appeal is that one can give the
+    timeout as an argument::
+
+    >>> import socket
+    >>> s = get_socket(timeout=3.0)
+    >>> isinstance(s, socket.socket)
+    True
+    >>> s.gettimeout()
+    3.0
+    >>> s.close()
+
+    By default, it creates TCP sockets, but the family can be given too::
+
+    >>> s = get_socket(family=socket.AF_UNIX)
+    >>> s.family
+    <AddressFamily.AF_UNIX: 1>
+    >>> s.close()
+    """
+    s = socket.socket(family)
+    s.settimeout(timeout)
+
+    return s
+
+
+# Kernel tables of TCP sockets, and the state code of the listening sockets.
+_TCP_TABLES = [
+    ('/proc/net/tcp', socket.AF_INET), ('/proc/net/tcp6', socket.AF_INET6)
+]
+_TCP_LISTEN = '0A'
+
+# Kernel table of Unix sockets, and the flag of the listening sockets.
+_UNIX_TABLE = '/proc/net/unix'
+_UNIX_ACCEPTING = 0x10000
+
+# Ports reserved by ``reserve_port()``, mapped to the locked files that
+# reserve them.
+_reservations = {}
+_reservations_lock = threading.Lock()
+_MAXIMUM_RESERVATION_ATTEMPTS = 100
+
+# Connection errors meaning that nobody is listening to an address. Some of
+# them happen when the address is from a disabled protocol (e.g. IPv6) or, in
+# the case of Unix sockets, before the server creates the socket file.
+_NOT_LISTENING = (
+    errno.ECONNREFUSED, errno.ECONNRESET, errno.ENOENT, errno.EADDRNOTAVAIL,
+    errno.ENETUNREACH, errno.EAFNOSUPPORT
+)
+
+# Size of the chunks relayed by ``Proxy``, its default burst and how much
+# data it keeps in the queue of each direction before it stops reading.
+_CHUNK_SIZE = 64 * 1024
+_PROXY_BURST = 16 * 1024
+_PROXY_BUFFER_SIZE = 1024 * 1024
+
+# Requests to ``HTTPServer`` whose head is larger than this are refused.
+_MAXIMUM_HTTP_HEAD = 64 * 1024
+
+# How much of ``TCP_INFO`` is read to get the accept queue of a listening
+# socket, and where its length is (the ``tcpi_unacked`` field).
+_TCP_INFO_SIZE = 32
+_TCP_INFO_UNACKED = 24
+
+# Expected states for the servers probed by ``_wait_servers()``.
+_UP = 'up'
+_DOWN = 'down'
+
+
+def _wait_servers(addresses, timeout, tries, expected):
+    """
+    Probes all given addresses concurrently until each one of them is in the
+    expected state (``_UP`` or ``_DOWN``) or the timeout is reached. Returns
+    the probes of the addresses that did not reach the state in time.
+
+    All connection attempts are made with non-blocking sockets watched by a
+    single selector. The addresses are resolved only once, before the first
+    attempt.
+    """
+    interval = _get_retry_interval(timeout, tries)
+    deadline = time.monotonic() + timeout
+    pending = [
+        _Probe(address, expected, _resolve(address)) for address in addresses
+    ]
+    missed = []
+
+    with selectors.DefaultSelector() as selector:
+        try:
+            while pending:
+                now = time.monotonic()
+
+                for probe in pending:
+                    if probe.is_due(now):
+                        probe.start(selector, now, interval)
+
+                for key, events in selector.select(0):
+                    probe, candidate = key.data
+                    probe.finish(selector, key.fileobj, candidate)
+
+                now = time.monotonic()
+
+                for probe in list(pending):
+                    if probe.is_expired(now):
+                        probe.abandon(selector)
+
+                    if probe.done:
+                        pending.remove(probe)
+                    elif probe.wake_up_time is None and now >= deadline:
+                        pending.remove(probe)
+                        missed.append(probe)
+                    elif probe.wake_up_time is None:
+                        probe.schedule(now, deadline, interval)
+
+                if pending:
+                    wait = min(probe.wake_up_time for probe in pending) - now
+                    _select(selector, max(wait, 0))
+        finally:
+            for probe in pending:
+                probe.close(selector)
+
+    return missed
+
+
+def _wait_servers_down(addresses, timeout, tries, probe):
+    """
+    Waits for the servers to go down using the given probe method.
+    """
+    if probe == 'connect':
+        return _wait_servers(addresses, timeout, tries, _DOWN)
+    elif probe == 'proc':
+        return _wait_servers_unlisted(addresses, timeout, tries)
+    else:
+        raise ValueError('Unknown probe: {0}'.format(probe))
+
+
+def _wait_servers_unlisted(addresses, timeout, tries):
+    """
+    Waits until none of the given addresses is in the table of listening
+    sockets, reading the table once for all addresses at each attempt.
+    Returns the probes of the addresses still listening after the timeout.
+    """
+    interval = _get_retry_interval(timeout, tries)
+    deadline = time.monotonic() + timeout
+    delay = _FIRST_RETRY_DELAY
+    pending = [
+        _Probe(address, _DOWN, _resolve(address)) for address in addresses
+    ]
+    listened = {
+        probe.address: _get_listened_addresses(probe) for probe in pending
+    }
+    check_tcp = any(not _is_path(address) for address in listened)
+    check_unix = any(_is_path(address) for address in listened)
+
+    while True:
+        listening = set()
+
+        if check_tcp:
+            listening.update(get_listening_addresses())
+        if check_unix:
+            listening.update(get_listening_paths())
+
+        for probe in pending:
+            probe.attempts += 1
+            probe.done = not any(
+                address in listening for address in listened[probe.address]
+            )
+
+        pending = [probe for probe in pending if not probe.done]
+
+        now = time.monotonic()
+        if not pending or now >= deadline:
+            return pending
+
+        time.sleep(min(delay, deadline - now))
+        delay = min(delay * 2, interval)
+
+
+def _get_port_registry():
+    """
+    Returns the directory of the lock files used by ``reserve_port()``,
+    creating it if needed. The files are never removed: removing a file
+    someone is about to lock would make the lock useless.
+    """
+    path = os.path.join(tempfile.gettempdir(), 'inelegant-ports')
+    os.makedirs(path, exist_ok=True)
+
+    return path
+
+
+def _get_listened_addresses(probe):
+    """
+    Returns the addresses, as listed by ``get_listening_addresses()`` or
+    ``get_listening_paths()``, a server listening to the probed address may
+    be bound to, including the wildcard ones.
+    """
+    if _is_path(probe.address):
+        return {os.fsdecode(probe.address)}
+
+    port = probe.address[1]
+    ips = {'0.0.0.0', '::'}
+
+    for family, sockaddr in probe.candidates:
+        ips.add(sockaddr[0])
+
+        if family == socket.AF_INET:
+            ips.add('::ffff:' + sockaddr[0])
+
+    return {(ip, port) for ip in ips}
+
+
+def _resolve(address):
+    """
+    Returns the ``(family, sockaddr)`` pairs a connection to the address
+    should try. Paths and IP addresses are used as they are; only host names
+    are looked up.
+    """
+    candidates = _get_literal_candidates(address)
+
+    if candidates is None:
+        candidates = _get_candidates(
+            socket.getaddrinfo(address[0], address[1], 0, socket.SOCK_STREAM)
+        )
+
+    return candidates
+
+
+async def _async_resolve(address):
+    """
+    Coroutine version of ``_resolve()``.
+    """
+    candidates = _get_literal_candidates(address)
+
+    if candidates is None:
+        loop = asyncio.get_running_loop()
+        candidates = _get_candidates(
+            await loop.getaddrinfo(
+                address[0], address[1], type=socket.SOCK_STREAM
+            )
+        )
+
+    return candidates
+
+
+def _get_literal_candidates(address):
+    """
+    Returns the connection candidates of an address that needs no lookup: a
+    path or a socket address with an IP address. Returns ``None`` otherwise.
+    """
+    if _is_path(address):
+        return [(socket.AF_UNIX, address)]
+
+    for family in (socket.AF_INET, socket.AF_INET6):
+        if _is_ip(address[0], family):
+            return [(family, tuple(address))]
+
+    return None
+
+
+def _is_ip(host, family):
+    try:
+        socket.inet_pton(family, host)
+    except (socket.error, TypeError, ValueError):
+        return False
+
+    return True
+
+
+def _get_table_addresses(table, host):
+    """
+    Returns the addresses of the host in a ``temp_hosts()`` table, or
+    ``None`` if the host is not there.
+    """
+    if isinstance(host, bytes):
+        host = host.decode('idna')
+
+    if isinstance(host, str):
+        return table.get(host.lower())
+
+    return None
+
+
+def _get_candidates(infos):
+    candidates = []
+
+    for family, type, proto, name, sockaddr in infos:
+        if (family, sockaddr) not in candidates:
+            candidates.append((family, sockaddr))
+
+    return candidates
+
+
+def _get_address(host, port, path):
+    """
+    Returns the address the waiters should probe: the path, if given, or
+    the host and the port.
+    """
+    if path is not None:
+        return path
+    elif host is None or port is None:
+        raise ValueError('Either host and port or path should be given.')
+    else:
+        return (host, port)
+
+
+def _is_path(address):
+    """
+    Checks whether the address is a Unix socket path (instead of a host and
+    port pair).
+    """
+    return isinstance(address, (str, bytes))
+
+
+def _describe_address(address):
+    """
+    Returns a readable form of the address. Paths from the abstract namespace
+    start with ``@``, as in ``/proc/net/unix``.
+    """
+    if _is_path(address):
+        path = os.fsdecode(address)
+        return '@' + path[1:] if path.startswith('\0') else path
+    else:
+        return '{0}:{1}'.format(*address)
+
+
+def _decode_address(family, address):
+    """
+    Converts an address from the kernel TCP tables to its usual text form.
+    The tables show the address as a sequence of 32-bit words in
+    hexadecimal, each one in the host byte order.
+    """
+    packed = b''.join(
+        struct.pack('=I', int(address[i:i+8], 16))
+        for i in range(0, len(address), 8)
+    )
+
+    return socket.inet_ntop(family, packed)
+
+
+class _Probe(object):
+    """
+    Keeps the state of the connection attempts to a single address made by
+    ``_wait_servers()``.
+
+    An address may be resolved to many socket addresses (e.g. ``localhost``
+    may be both ``127.0.0.1`` and ``::1``), given as the ``candidates``
+    argument. Each attempt connects to all of them in parallel, and succeeds
+    if any of them accepts the connection (or, if waiting for the server to
+    go down, if all of them refuse it).
+
+    ``wake_up_time`` is the moment the probe needs attention: when the next
+    attempt should start or when the current one should be abandoned. It is
+    ``None`` right after a failed attempt, until the next one is scheduled.
+    """
+
+    def __init__(self, address, expected, candidates):
+        self.address = address if _is_path(address) else tuple(address)
+        self.expected = expected
+        self.candidates = candidates
+
+        self.sockets = []
+        self.errors = {}
+        self.done = False
+        self.attempts = 0
+        self.delay = _FIRST_RETRY_DELAY
+        self.wake_up_time = 0
+
+    def is_due(self, now):
+        return (
+            not self.sockets and self.wake_up_time is not None and
+            now >= self.wake_up_time
+        )
+
+    def is_expired(self, now):
+        return bool(self.sockets) and now >= self.wake_up_time
+
+    def start(self, selector, now, interval):
+        self.attempts += 1
+        self.errors = {}
+        self.wake_up_time = now + interval
+
+        for candidate in self.candidates:
+            family, sockaddr = candidate
+
+            try:
+                s = _get_probe_socket(family)
+            except socket.error as e:
+                self.errors[candidate] = e.errno
+                continue
+
+            error = s.connect_ex(sockaddr)
+
+            if error in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY):
+                selector.register(
+                    s, selectors.EVENT_WRITE, (self, candidate)
+                )
+                self.sockets.append(s)
+            else:
+                s.close()
+                self.errors[candidate] = error
+
+        self.check(selector)
+
+    def finish(self, selector, s, candidate):
+        self.errors[candidate] = s.getsockopt(
+            socket.SOL_SOCKET, socket.SO_ERROR
+        )
+        selector.unregister(s)
+        self.sockets.remove(s)
+        s.close()
+
+        self.check(selector)
+
+    def abandon(self, selector):
+        """
+        Gives up an attempt that took too long to be established.
+        """
+        self.close(selector)
+        self.evaluate(list(self.errors.values()) + [None])
+
+    def check(self, selector):
+        """
+        Evaluates the current attempt if it already has an outcome: if all
+        candidates answered or, when waiting for the server to be up, any of
+        them accepted the connection.
+        """
+        errors = list(self.errors.values())
+
+        if len(errors) == len(self.candidates) or \
+                (self.expected == _UP and 0 in errors):
+            self.close(selector)
+            self.evaluate(errors)
+
+    def evaluate(self, errors):
+        """
+        Checks the outcome of an attempt, given as the error numbers from the
+        connections to each candidate (zero for success, ``None`` if
+        inconclusive).
+        """
+        if self.expected == _UP:
+            self.done = 0 in errors
+            tolerated = (None,) + _NOT_LISTENING
+        else:
+            self.done = all(error in _NOT_LISTENING for error in errors)
+            tolerated = (None, 0, errno.ETIMEDOUT) + _NOT_LISTENING
+
+        for error in errors:
+            if not self.done and error not in tolerated:
+                raise socket.error(error, os.strerror(error))
+
+        self.wake_up_time = None
+
+    def schedule(self, now, deadline, interval):
+        self.wake_up_time = min(now + self.delay, deadline)
+        self.delay = min(self.delay * 2, interval)
+
+    def close(self, selector):
+        for s in self.sockets:
+            if s in selector.get_map():
+                selector.unregister(s)
+
+            s.close()
+
+        self.sockets = []
+
+    def __str__(self):
+        return '{0} ({1} attempts)'.format(
+            _describe_address(self.address), self.attempts
+        )
+
+
+class _FileRegion(object):
+    """
+    The part of a file ``SelectorServer`` still has to send to a connection.
+    As the ``memoryview`` objects it sends otherwise, it can be sliced to
+    drop what was already sent and is false once empty.
+    """
+
+    def __init__(self, file, offset, size):
+        self.file = file
+        self.offset = offset
+        self.size = size
+
+    def __getitem__(self, index):
+        start, stop, step = index.indices(self.size)
+
+        return _FileRegion(self.file, self.offset+start, max(stop-start, 0))
+
+    def __len__(self):
+        return self.size
+
+
+class _ProxyPipe(object):
+    """
+    One direction of a connection relayed by ``Proxy``. The data read from
+    the source waits in a queue until its latency has passed and the token
+    bucket has enough tokens, and then it is sent to the destination.
+
+    If given, ``record`` is called with each chunk read, including the
+    empty one.
+    """
+
+    def __init__(self, proxy, source, destination, record=None):
+        self.proxy = proxy
+        self.source = source
+        self.destination = destination
+        self.record = record
+
+        self.chunks = collections.deque()
+        self.buffered = 0
+        self.last_due = 0
+        self.tokens = proxy.burst
+        self.refilled = time.monotonic()
+
+        self.eof = False
+        self.done = False
+        self.blocked = False
+        self.bytes = 0
+        self.flushed = 0
+
+    def read(self, now):
+        """
+        Reads a chunk from the source, scheduling it to be relayed. An empty
+        chunk means the source will not send anything else.
+        """
+        try:
+            data = self.source.recv(_CHUNK_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+
+        if self.record is not None:
+            self.record(data)
+
+        delay = self.proxy.latency
+
+        if self.proxy.jitter:
+            delay += self.proxy.random.uniform(
+                -self.proxy.jitter, self.proxy.jitter
+            )
+
+        # A chunk is never relayed before the ones read before it.
+        self.last_due = max(now + max(delay, 0), self.last_due)
+        self.chunks.append((self.last_due, memoryview(data)))
+        self.buffered += len(data)
+
+        if not data:
+            self.eof = True
+
+    def flush(self, now, allowance=None):
+        """
+        Sends the chunks that are due, as long as the destination takes them
+        and the bandwidth and the allowance (the bytes the connection can
+        still relay) allow it. Returns when it should be called again, or
+        ``None`` if it is waiting for the sockets.
+        """
+        self.flushed = 0
+
+        while self.chunks and not self.blocked:
+            due, chunk = self.chunks[0]
+
+            if due > now:
+                return due
+
+            if not chunk:
+                self.chunks.popleft()
+                self.destination.shutdown(socket.SHUT_WR)
+                self.done = True
+                return None
+
+            size = len(chunk)
+
+            if allowance is not None:
+                size = min(size, allowance - self.flushed)
+
+                if not size:
+                    return None
+
+            if self.proxy.bandwidth:
+                size = min(size, self.proxy.burst)
+                self._refill(now)
+
+                if self.tokens < size:
+                    return now + (size - self.tokens) / self.proxy.bandwidth
+
+            try:
+                sent = self.destination.send(chunk[:size])
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+
+            if sent < size:
+                self.blocked = True
+
+            if sent < len(chunk):
+                self.chunks[0] = (due, chunk[sent:])
+            else:
+                self.chunks.popleft()
+
+            self.tokens -= sent
+            self.buffered -= sent
+            self.bytes += sent
+            self.flushed += sent
+
+        return None
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.tokens + (now - self.refilled) * self.proxy.bandwidth,
+            self.proxy.burst
+        )
+        self.refilled = now
+
+
+class _HTTPParser(object):
+    """
+    Splits the data read from a connection to ``HTTPServer`` into requests.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.failed = False
+
+    def feed(self, data):
+        """
+        Returns the ``(method, target, connection)`` tuples of the requests
+        completed by the data. ``connection`` is ``'close'`` if the
+        connection should be closed after the response, ``'keep-alive'`` if
+        an HTTP/1.0 client asked to keep it open, and ``None`` otherwise. A
+        malformed request is returned as ``None``, and ends the list.
+        """
+        if self.failed:
+            return []
+
+        self.buffer += data
+        requests = []
+
+        while True:
+            end = self.buffer.find(b'\r\n\r\n')
+
+            if end < 0:
+                if len(self.buffer) > _MAXIMUM_HTTP_HEAD:
+                    self.failed = True
+                    requests.append(None)
+
+                return requests
+
+            try:
+                method, target, connection, length = self._parse_head(
+                    bytes(self.buffer[:end]).decode('latin-1')
+                )
+            except ValueError:
+                self.failed = True
+                requests.append(None)
+
+                return requests
+
+            size = end + 4 + length
+
+            if len(self.buffer) < size:
+                return requests
+
+            del self.buffer[:size]
+            requests.append((method, target, connection))
+
+    def _parse_head(self, head):
+        lines = head.split('\r\n')
+        method, target, version = lines[0].split(' ')
+        headers = {}
+
+        for line in lines[1:]:
+            name, colon, value = line.partition(':')
+
+            if not colon:
+                raise ValueError('Malformed header: ' + line)
+
+            headers[name.strip().lower()] = value.strip().lower()
+
+        if 'chunked' in headers.get('transfer-encoding', ''):
+            raise ValueError('Chunked requests are not supported.')
+
+        length = int(headers.get('content-length', '0'))
+        connection = headers.get('connection', '')
+
+        if version == 'HTTP/1.1':
+            connection = 'close' if 'close' in connection else None
+        elif version == 'HTTP/1.0':
+            connection = 'keep-alive' if 'keep-alive' in connection \
+                else 'close'
+        else:
+            raise ValueError('Unsupported version: ' + version)
+
+        return method, target, connection, max(length, 0)
+
+
+class _HTTPResponse(object):
+    """
+    A canned response of ``HTTPServer``. All variants of it (to ``HEAD``
+    requests, and with each ``Connection`` header) are computed at once.
+    """
+
+    def __init__(self, status, headers, body):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+            content_type = 'text/plain; charset=utf-8'
+        else:
+            body = bytes(body)
+            content_type = 'application/octet-stream'
+
+        headers = dict(headers or {})
+        names = {name.lower() for name in headers}
+
+        if 'content-type' not in names:
+            headers['Content-Type'] = content_type
+
+        if 'content-length' not in names:
+            headers['Content-Length'] = str(len(body))
+
+        try:
+            reason = HTTPStatus(status).phrase
+        except ValueError:
+            reason = ''  # Statuses not in the standard have no known phrase.
+
+        lines = ['HTTP/1.1 {0} {1}'.format(status, reason)]
+        lines.extend('{0}: {1}'.format(*header) for header in headers.items())
+
+        self.variants = {}
+
+        for connection in (None, 'close', 'keep-alive'):
+            head = lines[:]
+
+            if connection is not None:
+                head.append('Connection: ' + connection)
+
+            head = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1')
+            self.variants[True, connection] = head
+            self.variants[False, connection] = head + body
+
+    def get(self, head, connection):
+        return self.variants[head, connection]
+
+
+_NOT_FOUND = _HTTPResponse(404, None, 'Not Found')
+_BAD_REQUEST = _HTTPResponse(400, None, 'Bad Request')
+
+
+class _RESPParser(object):
+    """
+    Splits the data read from a connection to ``RedisServer`` into commands,
+    each one a list of ``bytes`` arguments.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.failed = False
+
+    def feed(self, data):
+        """
+        Returns the commands completed by the data. A malformed command is
+        returned as ``None``, and ends the list.
+        """
+        if self.failed:
+            return []
+
+        self.buffer += data
+        commands = []
+        position = 0
+
+        try:
+            while position < len(self.buffer):
+                if self.buffer[position] == ord('*'):
+                    command, position_after = self._parse_array(position)
+                else:
+                    command, position_after = self._parse_inline(position)
+
+                if position_after is None:
+                    break
+
+                position = position_after
+
+                if command:
+                    commands.append(command)
+        except ValueError:
+            self.failed = True
+            commands.append(None)
+
+        del self.buffer[:position]
+
+        return commands
+
+    def _parse_array(self, position):
+        """
+        Parses an array of bulk strings starting at the position. Returns the
+        strings and the position after them, or ``(None, None)`` if the array
+        is not complete yet.
+        """
+        count, position = self._parse_number(position)
+        items = []
+
+        for i in range(count if position is not None else 0):
+            if position >= len(self.buffer):
+                return None, None
+            elif self.buffer[position] != ord('$'):
+                raise ValueError('Expected a bulk string.')
+
+            length, start = self._parse_number(position)
+
+            if start is None or len(self.buffer) < start + length + 2:
+                return None, None
+
+            items.append(bytes(self.buffer[start:start + length]))
+            position = start + length + 2
+
+        return items, position
+
+    def _parse_inline(self, position):
+        end = self.buffer.find(b'\n', position)
+
+        if end < 0:
+            return None, None
+
+        return bytes(self.buffer[position:end]).split(), end + 1
+
+    def _parse_number(self, position):
+        """
+        Parses the number after a type character (e.g. the ``3`` in
+        ``*3\\r\\n``), returning it and the position after the line.
+        """
+        end = self.buffer.find(b'\r\n', position)
+
+        if end < 0:
+            return None, None
+
+        number = int(self.buffer[position + 1:end])
+
+        if number < 0:
+            raise ValueError('Negative length.')
+
+        return number, end + 2
+
+
+class _RedisSession(object):
+    """
+    The state of a connection to ``RedisServer``: the commands queued since
+    ``MULTI`` (or ``None`` out of transactions), whether one of them was
+    invalid, and whether the connection should be closed.
+    """
+
+    def __init__(self):
+        self.transaction = None
+        self.aborted = False
+        self.closed = False
+
+
+class _RESPError(Exception):
+    """
+    Raised by the commands of ``RedisServer`` to reply with an error.
+    """
+
+
+def _resp_error(message):
+    return '-{0}\r\n'.format(message).encode('utf-8')
+
+
+def _resp_bulk(value):
+    if value is None:
+        return _RESP_NIL
+
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def _resp_array(values):
+    values = [_resp_bulk(value) for value in values]
+
+    return b'*%d\r\n' % len(values) + b''.join(values)
+
+
+def _resp_integer(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise _RESPError('ERR value is not an integer or out of range')
+
+
+def _accepts(method, arguments):
+    """
+    Checks whether the command method can be called with the arguments.
+    """
+    try:
+        _get_signature(method.__func__).bind(None, *arguments)
+    except TypeError:
+        return False
+
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def _get_signature(function):
+    return inspect.signature(function)
+
+
+def _to_bytes(value):
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    elif isinstance(value, int):
+        return str(value).encode()
+
+    return bytes(value)
+
+
+_RESP_OK = b'+OK\r\n'
+_RESP_NIL = b'$-1\r\n'
+
+
+async def _async_wait_server(address, timeout, tries, expected):
+    """
+    Coroutine version of ``_wait_servers()``, for a single address. Returns
+    the probe if the server did not reach the expected state in time, ``None``
+    otherwise.
+    """
+    interval = _get_retry_interval(timeout, tries)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    probe = _Probe(address, expected, await _async_resolve(address))
+
+    while True:
+        probe.attempts += 1
+        probe.evaluate(await asyncio.gather(*(
+            _async_connect(family, sockaddr, interval)
+            for family, sockaddr in probe.candidates
+        )))
+
+        if probe.done:
+            return None
+
+        now = loop.time()
+        if now >= deadline:
+            return probe
+
+        probe.schedule(now, deadline, interval)
+        await asyncio.sleep(probe.wake_up_time - now)
+
+
+async def _async_connect(family, sockaddr, timeout):
+    """
+    Coroutine version of a connection attempt from a ``_Probe``. Returns the
+    resulting error number (zero if the connection succeeded) or ``None`` if
+    the connection could not be established in time.
+    """
+    loop = asyncio.get_running_loop()
+
+    try:
+        s = _get_probe_socket(family)
+    except socket.error as e:
+        return e.errno
+
+    with contextlib.closing(s):
+        try:
+            await asyncio.wait_for(loop.sock_connect(s, sockaddr), timeout)
+        except asyncio.TimeoutError:
+            return None
+        except socket.error as e:
+            return e.errno
+
+    return 0
+
+
+def _watch(selector, s, reader, writer):
+    """
+    Watches a socket relayed by ``Proxy`` for the events its pipes wait for:
+    the one reading from it, if its queue is not full, and the one writing to
+    it, if the socket buffer was full.
+    """
+    events = 0
+
+    if not reader.eof and reader.buffered < _PROXY_BUFFER_SIZE:
+        events |= selectors.EVENT_READ
+
+    if writer.blocked:
+        events |= selectors.EVENT_WRITE
+
+    try:
+        key = selector.get_key(s)
+    except KeyError:
+        if events:
+            selector.register(s, events)
+    else:
+        if not events:
+            selector.unregister(s)
+        elif events != key.events:
+            selector.modify(s, events)
+
+
+def _abort(s):
+    """
+    Closes the socket, resetting the connection if it is a TCP one.
+    """
+    with contextlib.suppress(socket.error):
+        if s.family != socket.AF_UNIX:
+            s.setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0)
+            )
+
+    s.close()
+
+
+def _elapsed(start, end):
+    if end is not None:
+        return end - start
+
+
+def _get_backlog(listening_socket):
+    """
+    Returns how many connections are waiting to be accepted by the listening
+    socket, or ``None`` if it cannot be known. On Linux, the ``TCP_INFO`` of
+    a listening socket has the length of its accept queue in the
+    ``tcpi_unacked`` field.
+    """
+    if listening_socket is None or not hasattr(socket, 'TCP_INFO') or \
+            listening_socket.family == socket.AF_UNIX:
+        return None
+
+    try:
+        info = listening_socket.getsockopt(
+            socket.IPPROTO_TCP, socket.TCP_INFO, _TCP_INFO_SIZE
+        )
+    except socket.error:
+        return None
+
+    return struct.unpack_from('I', info, _TCP_INFO_UNACKED)[0]
+
+
+def _get_probe_socket(family):
+    """
+    Returns a non-blocking socket for connection attempts. TCP sockets reset
+    the connection when closed, instead of shutting it down gracefully, so
+    the probes leave no connection in ``TIME_WAIT`` on either side: the port
+    is free as soon as the server stops listening.
+    """
+    s = socket.socket(family)
+
+    if family != socket.AF_UNIX:
+        s.setsockopt(
+            socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0)
+        )
+
+    s.setblocking(False)
+
+    return s
+
+
+def _select(selector, timeout):
+    """
+    Waits for events in the selector for at most ``timeout`` seconds. If there
+    is no registered file, just sleeps: some selectors do not accept to wait on
+    empty sets.
+    """
+    if selector.get_map():
+        selector.select(timeout)
+    else:
+        time.sleep(timeout)
+
+
+def _describe_probes(probes):
+    return ', '.join(str(probe) for probe in probes)
+
+
+def _get_retry_interval(timeout, tries):
+    """
+    Returns the longest time a waiter function should wait between two
+    connection attempts.
+    """
+    return max(float(timeout) / tries, _MINIMUM_RETRY_INTERVAL)
@@ -17,7 +17,22 @@
 # along with Inelegant.  If not, see <http://www.gnu.org/licenses/>.
 
 import multiprocessing
+import multiprocessing.connection
 import inspect
+import pickle
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import functools
+import itertools
+import io
+import os
+import queue
+import threading
+import time
+import weakref
+
+from multiprocessing import resource_tracker, shared_memory
 
 
 class Process(multiprocessing.Process):
@@ -123,6 +138,56 @@ class Process(multiprocessing.Process):
     2
     5
 
+    Streaming
+    ---------
+
+    Talking to the target at each ``yield`` means a round trip between the
+    processes for each value, which is slow if the target only produces
+    values. For such targets, give the ``window`` argument: the target then
+    keeps running, sending the values it yields (and getting ``None`` back
+    from each ``yield``), up to ``window`` values ahead of the ones read.
+    The values can be read by iterating over the process, or in lists by
+    ``Process.get_many()``::
+
+    >>> def produce(count):
+    ...     for i in range(count):
+    ...         yield i
+    >>> with Process(target=produce, args=(5,), window=2) as pc:
+    ...     list(pc)
+    [0, 1, 2, 3, 4]
+    >>> with Process(target=produce, args=(5,), window=2) as pc:
+    ...     pc.get_many(2)
+    ...     pc.get_many(10)
+    [0, 1]
+    [2, 3, 4]
+
+    Once ``window`` values are waiting to be read, the target blocks at the
+    next ``yield`` until some of them are read. See ``Conversation`` for
+    more.
+
+    Large values
+    ------------
+
+    Results and yielded values are pickled to be sent between the
+    processes. Large buffers among them (``bytes``, ``bytearray`` and
+    ``memoryview`` objects, or anything pickled with out-of-band buffers,
+    such as NumPy arrays) do not go through the pipe, though: they are put
+    in shared memory, and only its name is sent. Memory views and
+    out-of-band buffers are then received as views of the shared memory,
+    without any copy::
+
+    >>> def serve():
+    ...     return memoryview(bytearray(b'x' * 2 ** 20))
+    >>> with Process(target=serve) as pc:
+    ...     pass
+    >>> pc.result.nbytes
+    1048576
+    >>> bytes(pc.result[:3])
+    b'xxx'
+
+    ``bytes`` and ``bytearray`` objects own their memory, so they are copied
+    from the shared memory once received.
+
     Forcing termination
     -------------------
 
@@ -153,7 +218,7 @@ class Process(multiprocessing.Process):
     def __init__(
             self, group=None, target=None, name=None, args=None, kwargs=None,
             timeout=1, terminate=False, reraise=False,
-            daemon=True):
+            daemon=True, window=None):
         self.timeout = timeout
         self._terminate = terminate
         self.reraise = reraise
@@ -161,15 +226,20 @@ class Process(multiprocessing.Process):
         self.result = None
         self.exception = None
 
-        try:
-            self.conversation = Conversation(target)
-            self.target = self.conversation.start
-        except:
-            self.conversation = None
-            self.target = target
+        self.target = target
+        self.window = window
+        self._converses = inspect.isgeneratorfunction(target)
+
+        if self._converses:
+            _check_window(window)
+
+        # The conversation with a generator target is created by ``start()``,
+        # along with its pipe.
+        self.conversation = None
 
-        self.error_queue = multiprocessing.Queue()
-        self.result_queue = multiprocessing.Queue()
+        # Created by ``start()``, and closed once the outcome is received.
+        self._outcome_reader = None
+        self._outcome_writer = None
 
         self.args = args if args is not None else ()
         self.kwargs = kwargs if kwargs is not None else {}
@@ -179,15 +249,40 @@ class Process(multiprocessing.Process):
 
         self.daemon = daemon
 
-    def run(self):
+    def start(self):
+        if self._converses:
+            self.conversation = Conversation(self.target, window=self.window)
+
+        # This is as late as the pipe can be created: only the child knows
+        # whether there will be an outcome, but it can only write to a pipe
+        # it inherits, so the pipe has to exist before the child is forked.
+        self._outcome_reader, self._outcome_writer = multiprocessing.Pipe(
+            duplex=False
+        )
+
         try:
-            result = self.target(*self.args, **self.kwargs)
+            multiprocessing.Process.start(self)
+        finally:
+            # Only the child writes, so the pipe is at its end once the child
+            # exits.
+            self._outcome_writer.close()
+
+            if self.conversation is not None:
+                self.conversation.child_connection.close()
 
-            self.result_queue.put(result)
-            self.error_queue.put(None)
+    def run(self):
+        try:
+            if self.conversation is not None:
+                result = self.conversation.start(*self.args, **self.kwargs)
+            else:
+                result = self.target(*self.args, **self.kwargs)
         except Exception as e:
-            self.result_queue.put(None)
-            self.error_queue.put(e)
+            _send_outcome(self._outcome_writer, _EXCEPTION, e)
+        else:
+            if result is not None:
+                _send_outcome(self._outcome_writer, _RESULT, result)
+        finally:
+            self._outcome_writer.close()
 
     def join(self, timeout=None):
         """
@@ -217,13 +312,37 @@ class Process(multiprocessing.Process):
         >>> process.join()
         >>> process.exception
         Exception('error',)
+
+        The result, or the exception, comes through a pipe created when the
+        process starts; nothing is sent if the target returns ``None``. The
+        pipe is read while waiting for the process, so a large result does
+        not keep the process from finishing. Once the process finishes, the
+        conversation with a generator target is closed as well, so values in
+        shared memory that were never read are freed.
         """
-        multiprocessing.Process.join(self, timeout)
+        deadline = _get_deadline(timeout)
+
+        if self._outcome_reader is not None:
+            ready = multiprocessing.connection.wait(
+                [self._outcome_reader, self.sentinel], timeout
+            )
+
+            if self._outcome_reader in ready:
+                self._receive_outcome()
+
+        multiprocessing.Process.join(self, _get_timeout(deadline))
 
-        if not self.error_queue.empty():
-            self.exception = self.error_queue.get()
-        if not self.result_queue.empty():
-            self.result = self.result_queue.get()
+        # Something that inherited the pipe from the child may still keep it
+        # open, so it is only read if there is something to read.
+        if self._outcome_reader is not None and self.exitcode is not None:
+            if self._outcome_reader.poll():
+                self._receive_outcome()
+            else:
+                self._outcome_reader.close()
+                self._outcome_reader = None
+
+        if self.conversation is not None and self.exitcode is not None:
+            self.conversation.close()
 
         if self.reraise and self.exception is not None:
             raise self.exception
@@ -253,7 +372,7 @@ class Process(multiprocessing.Process):
         ValueError: cannot_send_anything is not a generator function and so ca\
 nnot send values back before returning.
         """
-        if self.conversation is None:
+        if not self._converses:
             raise ValueError(
                 '{0} is not a generator function and so cannot send values '
                 'back before returning.'.format(self.target.__name__)
@@ -291,7 +410,7 @@ nnot send values back before returning.
         ValueError: cannot_receive_anything is not a generator function and so\
  cannot receive values after starting up.
         """
-        if self.conversation is None:
+        if not self._converses:
             raise ValueError(
                 '{0} is not a generator function and so cannot receive values '
                 'after starting up.'.format(self.target.__name__)
@@ -317,7 +436,7 @@ nnot send values back before returning.
         ValueError: cannot_go is not a generator function. It cannot be stoppe\
 d - much less go ahead after stopping.
         """
-        if self.conversation is None:
+        if not self._converses:
             raise ValueError(
                 '{0} is not a generator function. It cannot be stopped - much '
                 'less go ahead after stopping.'.format(self.target.__name__)
@@ -325,6 +444,41 @@ d - much less go ahead after stopping.
 
         self.conversation.send_to_child(None)
 
+    def get_many(self, count):
+        """
+        Retrieves up to ``count`` values yielded by a target streaming its
+        values (see the ``window`` argument). Fewer values are returned only
+        if the target finished::
+
+        >>> def produce():
+        ...     yield 1
+        ...     yield 2
+        >>> with Process(target=produce, window=10) as pc:
+        ...     pc.get_many(3)
+        ...     pc.get_many(3)
+        [1, 2]
+        []
+
+        It fails if the ``Process`` target does not stream values::
+
+        >>> with Process(target=produce) as pc:
+        ...     values = pc.get_many(3)
+        Traceback (most recent call last):
+          ...
+        ValueError: produce does not stream values. Give the window argument \
+to stream them.
+        """
+        return list(itertools.islice(self, count))
+
+    def __iter__(self):
+        if not self._converses or self.window is None:
+            raise ValueError(
+                '{0} does not stream values. Give the window argument to '
+                'stream them.'.format(self.target.__name__)
+            )
+
+        return self.conversation.iterate()
+
     def __enter__(self):
         self.start()
 
@@ -336,6 +490,25 @@ d - much less go ahead after stopping.
 
         self.join(self.timeout)
 
+    def _receive_outcome(self):
+        """
+        Reads the outcome of the target, if any. It only blocks while the
+        child is writing it: once the child exits, the pipe is at its end.
+        """
+        try:
+            kind, value = _receive(self._outcome_reader)
+        except (EOFError, OSError):
+            # The child may have been killed while writing the outcome.
+            pass
+        else:
+            if kind == _RESULT:
+                self.result = value
+            else:
+                self.exception = value
+        finally:
+            self._outcome_reader.close()
+            self._outcome_reader = None
+
 
 class Conversation(object):
     """
@@ -380,34 +553,1061 @@ class Conversation(object):
     statement.** You may note that we send a ``None`` value to the child
     process before joining the process. If we do not do that, the joined
     process will be blocked - and the main process as well.
+
+    Transport
+    ---------
+
+    The values go through a duplex ``multiprocessing.Pipe``, pickled and
+    written directly by the process that sends them, so each step costs a
+    single write and a single read on each side. Since no thread is left
+    writing in the background, sending a value larger than the pipe buffer
+    blocks until the other side reads it. So, if a value is sent to the child
+    before the last yielded one is retrieved, ``send_to_child()`` reads the
+    yielded value first, and keeps it to be returned by the next call to
+    ``get_from_child()``::
+
+    >>> def echo():
+    ...     value = yield b'x' * 600000
+    ...     yield len(value)
+    >>> conversation = Conversation(function=echo)
+    >>> process = multiprocessing.Process(target=conversation.start)
+    >>> process.start()
+    >>> conversation.send_to_child(b'y' * 600000)
+    >>> len(conversation.get_from_child())
+    600000
+    >>> conversation.get_from_child()
+    600000
+    >>> conversation.send_to_child(None)
+    >>> process.join()
+
+    Once the generator finishes, an empty message marks the end of the
+    conversation: ``get_from_child()`` raises ``EOFError`` and values sent
+    afterwards are discarded.
+
+    Large buffers are sent in shared memory (see ``Process``), which the
+    receiving process frees as it reads them. Once the child finishes,
+    ``close()`` closes the pipe and frees the values never read on either
+    side. ``Process.join()`` calls it, but it should be called after joining
+    a ``multiprocessing.Process``::
+
+    >>> conversation = Conversation(function=f)
+    >>> process = multiprocessing.Process(target=conversation.start)
+    >>> process.start()
+    >>> process.terminate()
+    >>> process.join()
+    >>> conversation.close()
+
+    Streaming
+    ---------
+
+    If the ``window`` argument is given, the child does not wait for the
+    main process at each ``yield``: it sends the values as they are yielded,
+    and ``None`` is returned by the ``yield`` statements. To keep the child
+    from running too far ahead, it starts with ``window`` credits, and each
+    value sent costs a credit. Once out of credits, the child blocks until
+    the main process reads some values: credits are sent back in batches,
+    once half the window was read. The values can be read one by one with
+    ``get_from_child()`` or by iterating over ``iterate()``::
+
+    >>> def produce():
+    ...     for i in range(10):
+    ...         yield i
+    >>> conversation = Conversation(function=produce, window=4)
+    >>> process = multiprocessing.Process(target=conversation.start)
+    >>> process.start()
+    >>> conversation.get_from_child()
+    0
+    >>> list(conversation.iterate())
+    [1, 2, 3, 4, 5, 6, 7, 8, 9]
+    >>> process.join()
+
+    Once the child finishes (even due to an exception), the end of the
+    stream is sent: ``iterate()`` stops, and ``get_from_child()`` raises
+    ``EOFError``::
+
+    >>> conversation.get_from_child()
+    Traceback (most recent call last):
+      ...
+    EOFError: The child finished sending values.
+
+    Values cannot be sent to a streaming child, and the window should hold
+    at least one value::
+
+    >>> conversation = Conversation(function=produce, window=0)
+    Traceback (most recent call last):
+      ...
+    ValueError: The window should hold at least one value, not 0.
     """
-    def __init__(self, function):
+    def __init__(self, function, window=None):
         if not inspect.isgeneratorfunction(function):
             raise TypeError('Conversations require generator functions.')
 
+        _check_window(window)
+
         self.function = function
-        self.child_to_parent = multiprocessing.Queue()
-        self.parent_to_child = multiprocessing.Queue()
+        self.window = window
+        self.parent_connection, self.child_connection = \
+            multiprocessing.Pipe()
+
+        # In the main process: values read since credits were last sent
+        # back, when streaming; values read ahead of a send, and how many
+        # values the child is waiting for an answer to, when not; and whether
+        # the child finished.
+        self._read = 0
+        self._pending = collections.deque()
+        self._unanswered = 0
+        self._ended = False
+        # Segments of the values sent to the child, unlinked by ``close()``
+        # if the child did not read them.
+        self._segments = []
 
     def start(self, *args, **kwargs):
         generator = self.function(*args, **kwargs)
         try:
-            self.converse(generator)
+            if self.window is None:
+                self.converse(generator)
+            else:
+                self.stream(generator)
         except Exception as e:
             generator.throw(e)
 
     def get_from_child(self):
-        return self.child_to_parent.get()
+        if self.window is None and self._pending:
+            return _loads(self._pending.popleft())
+
+        data = self._read_from_child()
+
+        if data is None:
+            raise EOFError('The child finished sending values.')
+
+        if self.window is None:
+            self._unanswered += 1
+
+            return _loads(data)
+
+        self._read += 1
+
+        if self._read >= max(self.window // 2, 1):
+            try:
+                _send(self.parent_connection, self._read)
+            except BrokenPipeError:
+                pass  # The child finished, so it needs no more credits.
+
+            self._read = 0
+
+        return _loads(data)
+
+    def iterate(self):
+        """
+        Yields the values streamed by the child until it finishes.
+        """
+        while True:
+            try:
+                yield self.get_from_child()
+            except EOFError:
+                return
 
     def send_to_child(self, value):
-        self.parent_to_child.put(value)
+        if self.window is not None:
+            raise ValueError('Values cannot be sent to a streaming child.')
+
+        # The child may be blocked sending a value, so it is read before the
+        # child is sent anything.
+        if not self._unanswered:
+            data = self._read_from_child()
+
+            if data is None:
+                return
+
+            self._pending.append(data)
+            self._unanswered += 1
+
+        _send(self.parent_connection, value, self._segments)
+        self._unanswered -= 1
 
     def converse(self, generator):
-        to_parent = next(generator)
-        while True:
+        """
+        Sends each value yielded by the generator and waits for the answer,
+        followed by an empty message marking the end of the conversation.
+        """
+        try:
+            to_parent = next(generator)
+            while True:
+                try:
+                    _send(self.child_connection, to_parent)
+                    from_parent = _receive(self.child_connection)
+                    to_parent = generator.send(from_parent)
+                except StopIteration:
+                    break
+        finally:
+            self.child_connection.send_bytes(b'')
+
+    def stream(self, generator):
+        """
+        Sends the values yielded by the generator as long as there are
+        credits, followed by an empty message marking the end of the stream.
+        """
+        credits = self.window
+
+        try:
+            for value in generator:
+                while not credits:
+                    credits += _receive(self.child_connection)
+
+                _send(self.child_connection, value)
+                credits -= 1
+        finally:
+            self.child_connection.send_bytes(b'')
+
+    def close(self):
+        """
+        Closes the connections once the child finished, unlinking the shared
+        memory segments of the values neither process read.
+        """
+        self._ended = True
+
+        _unlink_segments(
+            name for data in self._pending for name in _get_segments(data)
+        )
+        self._pending.clear()
+
+        _discard(self.parent_connection)
+        _discard(self.child_connection)
+
+        _unlink_segments(self._segments)
+        self._segments.clear()
+
+    def _read_from_child(self):
+        """
+        Reads the next message sent by the child, or returns ``None`` if the
+        child finished.
+        """
+        if not self._ended:
             try:
-                self.child_to_parent.put(to_parent)
-                from_parent = self.parent_to_child.get()
-                to_parent = generator.send(from_parent)
-            except StopIteration:
-                break
+                data = self.parent_connection.recv_bytes()
+            except EOFError:
+                data = b''
+
+            self._ended = not data
+
+        if self._ended:
+            return None
+
+        # The child only sends a value after reading the ones sent to it.
+        if self.window is None:
+            self._segments.clear()
+
+        return data
+
+
+class ProcessPool(concurrent.futures.Executor):
+    """
+    ``ProcessPool`` keeps worker processes alive and runs targets on them,
+    so that running many short targets does not mean starting as many
+    processes. ``ProcessPool.process()`` takes the same arguments as
+    ``Process`` and returns an object used the same way, but whose target
+    runs in one of the workers::
+
+    >>> import operator
+    >>> with ProcessPool(workers=2) as pool:
+    ...     with pool.process(target=operator.add, args=(1, 2)) as pc:
+    ...         pass
+    ...     pc.result
+    3
+
+    Exceptions are available as well, and ``reraise`` works as in
+    ``Process``::
+
+    >>> with ProcessPool(workers=2) as pool:
+    ...     with pool.process(target=int, args=('a',)) as pc:
+    ...         pass
+    ...     pc.exception
+    ValueError("invalid literal for int() with base 10: 'a'")
+
+    If the target is a generator function, ``get()``, ``send()`` and
+    ``go()`` talk to it as they would to the target of a ``Process``.
+
+    By default, the pool has a worker for each CPU. The workers are started
+    along with the pool, and are stopped by ``shutdown()``, called at the
+    end of the ``with`` block. If a worker dies, or is terminated, the pool
+    starts another one.
+
+    Since the workers are already running, the targets (and their
+    arguments, values and results) are sent to them pickled. So, they
+    should be defined at the top level of a module, unlike the targets of
+    ``Process``, which are copied by forking.
+
+    Forking
+    -------
+
+    Only the thread that forks survives in the child processes, so a worker
+    forked while another thread holds a lock (e.g. the one from the
+    ``logging`` module) may block forever on that lock. So, the workers are
+    forked before the pool starts its threads. By the time a worker has to
+    be replaced, though, the threads are running, so replacements are
+    started by the ``forkserver`` method of ``multiprocessing``, which forks
+    them from a process of its own, without threads. That process is only
+    started when the first worker is replaced, which takes longer than the
+    others. As with any process started that way, the main module of a
+    script using the pool should start the pool inside an
+    ``if __name__ == '__main__':`` block.
+
+    Executor
+    --------
+
+    ``ProcessPool`` is a ``concurrent.futures.Executor`` as well, so the
+    workers can run functions through ``submit()`` and ``map()``::
+
+    >>> with ProcessPool(workers=2) as pool:
+    ...     future = pool.submit(pow, 2, 10)
+    ...     future.result()
+    ...     list(pool.map(pow, [1, 2, 3], [2, 2, 2]))
+    1024
+    [1, 4, 9]
+
+    Sending each call to a worker would make ``map()`` slower than running
+    it in the current process, so calls are sent in chunks. If the
+    ``chunksize`` argument is not given, the calls are split so that each
+    worker gets about four chunks.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers if workers is not None else os.cpu_count()
+
+        self._queue = queue.Queue()
+        self._shutdown = False
+        self._shutdown_lock = threading.Lock()
+        self._threads = []
+
+        workers = [_Worker() for i in range(self.workers)]
+
+        for worker in workers:
+            thread = threading.Thread(
+                target=self._feed, args=(worker,), daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def process(
+            self, target=None, args=None, kwargs=None, timeout=1,
+            terminate=False, reraise=False):
+        """
+        Returns a ``PoolProcess`` that will run the target in a worker once
+        started.
+        """
+        return PoolProcess(
+            self, target=target, args=args, kwargs=kwargs, timeout=timeout,
+            terminate=terminate, reraise=reraise
+        )
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        self._put(_Call(future, fn, args, kwargs))
+
+        return future
+
+    def map(self, fn, *iterables, timeout=None, chunksize=None):
+        calls = list(zip(*iterables))
+
+        if chunksize is None:
+            chunksize = _get_chunk_size(len(calls), self.workers)
+
+        chunks = [
+            calls[i:i+chunksize] for i in range(0, len(calls), chunksize)
+        ]
+        results = concurrent.futures.Executor.map(
+            self, functools.partial(_run_chunk, fn), chunks, timeout=timeout
+        )
+
+        return itertools.chain.from_iterable(results)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._shutdown_lock:
+            if self._shutdown:
+                return
+
+            self._shutdown = True
+
+            if cancel_futures:
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+
+                    item.cancel()
+
+            for thread in self._threads:
+                self._queue.put(None)
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _put(self, item):
+        with self._shutdown_lock:
+            if self._shutdown:
+                raise RuntimeError('Cannot run targets after shutdown.')
+
+            self._queue.put(item)
+
+    def _feed(self, worker):
+        """
+        Gives the queued items, one at a time, to a worker, which is stopped
+        once the pool is shut down.
+        """
+        try:
+            while True:
+                item = self._queue.get()
+
+                if item is None:
+                    break
+
+                item.run(worker)
+
+                if not worker.is_alive():
+                    worker.close()
+                    worker = _Worker(_REPLACEMENT_CONTEXT)
+        finally:
+            worker.stop()
+
+
+class PoolProcess(object):
+    """
+    ``PoolProcess`` runs a target in a worker of a ``ProcessPool``, with the
+    same interface as ``Process``: it can be started and joined, or used in
+    a ``with`` block, and has the ``result`` and ``exception`` of the target
+    afterwards.
+
+    ``start()`` only queues the target, which runs once a worker is free.
+    The pool reads what the target yields and its outcome as they come, and
+    takes the worker back once the target finishes, even if the process is
+    never joined. If the target is still running after the ``with`` block
+    (or if ``terminate`` is true) the worker is terminated, and replaced by
+    a new one.
+    """
+
+    def __init__(
+            self, pool, target=None, args=None, kwargs=None, timeout=1,
+            terminate=False, reraise=False):
+        self.pool = pool
+        self.target = target
+        self.args = args if args is not None else ()
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.timeout = timeout
+        self._terminate = terminate
+        self.reraise = reraise
+
+        self.result = None
+        self.exception = None
+
+        self.worker = None
+        self._yielded = collections.deque()
+        self._started = False
+        self._finished = False
+        self._lock = threading.Lock()
+        # Notified when a value is yielded, and when the target finishes.
+        self._changed = threading.Condition()
+        # Values yielded by the target that were not answered yet.
+        self._unanswered = 0
+
+    def start(self):
+        if self._started:
+            raise RuntimeError('Processes can only be started once.')
+
+        self.pool._put(self)
+        self._started = True
+
+    def is_alive(self):
+        return self._started and not self._finished
+
+    def join(self, timeout=None):
+        """
+        Waits until the target finishes or the timeout is reached. As in
+        ``Process.join()``, the result and the exception are available
+        afterwards, and the exception is raised if ``reraise`` is true.
+        """
+        if not self._started:
+            raise RuntimeError('Processes can only be joined once started.')
+
+        with self._changed:
+            self._changed.wait_for(lambda: self._finished, timeout)
+
+        if self.reraise and self.exception is not None:
+            raise self.exception
+
+    def terminate(self):
+        """
+        Terminates the worker running the target. If no worker runs it yet,
+        it will not run at all.
+        """
+        with self._lock:
+            if not self._finished:
+                if self.worker is not None:
+                    self.worker.terminate()
+
+                self._finish()
+
+    def get(self):
+        """
+        Retrieves a value yielded by the target function. It fails if the
+        target is not a generator function, or if it finished without
+        yielding another value.
+        """
+        if not inspect.isgeneratorfunction(self.target):
+            raise ValueError(
+                '{0} is not a generator function and so cannot send values '
+                'back before returning.'.format(self.target.__name__)
+            )
+
+        with self._changed:
+            self._changed.wait_for(lambda: self._yielded or self._finished)
+
+            if not self._yielded:
+                raise EOFError(
+                    '{0} finished without yielding a value.'.format(
+                        self.target.__name__
+                    )
+                )
+
+            return self._yielded.popleft()
+
+    def send(self, value):
+        """
+        Sends a value to be returned by the ``yield`` statement at the target
+        function, waiting for the target to reach it. The value is discarded
+        if the target finishes instead. It fails if the target is not a
+        generator function.
+        """
+        if not inspect.isgeneratorfunction(self.target):
+            raise ValueError(
+                '{0} is not a generator function and so cannot receive values '
+                'after starting up.'.format(self.target.__name__)
+            )
+
+        # The worker reads anything else than the answer to a yield as its
+        # next task, so nothing is sent unless the target waits for it.
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self._unanswered or self._finished
+            )
+
+            if self._finished:
+                return
+
+            self._unanswered -= 1
+
+        _send(self.worker.connection, value, self.worker.segments)
+
+    def go(self):
+        """
+        Makes a target blocked by a ``yield`` statement proceed with its
+        execution. It is equivalent to ``PoolProcess.send(None)``.
+        """
+        if not inspect.isgeneratorfunction(self.target):
+            raise ValueError(
+                '{0} is not a generator function. It cannot be stopped - much '
+                'less go ahead after stopping.'.format(self.target.__name__)
+            )
+
+        self.send(None)
+
+    def run(self, worker):
+        """
+        Called by the pool to run the target in the given worker. It reads
+        the values yielded by the target until its outcome, so the worker is
+        released as soon as the target finishes.
+        """
+        converse = inspect.isgeneratorfunction(self.target)
+
+        with self._lock:
+            if self._finished:
+                return
+
+            self.worker = worker
+
+            try:
+                _send(
+                    worker.connection,
+                    (self.target, self.args, self.kwargs, converse),
+                    worker.segments
+                )
+            except Exception as e:
+                self.exception = e
+                self._finish()
+
+        while not self._finished:
+            self._receive()
+
+        # If the worker is being terminated, waits until it is done so the
+        # pool knows it should be replaced.
+        with self._lock:
+            pass
+
+    def cancel(self):
+        """
+        Called by the pool if it is shut down before the target runs.
+        """
+        with self._lock:
+            self._finish()
+
+    def __enter__(self):
+        self.start()
+
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if value is not None or self._terminate:
+            self.terminate()
+
+        try:
+            self.join(self.timeout)
+        finally:
+            if not self._finished:
+                self.terminate()
+
+    def _receive(self):
+        try:
+            kind, value = _receive(self.worker.connection)
+        except (EOFError, OSError):
+            # Unless ``terminate()`` killed it (and so holds the lock until
+            # the process is finished), the worker died running the target.
+            with self._lock:
+                if not self._finished:
+                    self.worker.terminate()
+                    self.exception = \
+                        concurrent.futures.process.BrokenProcessPool(
+                            'A worker died while running the target.'
+                        )
+                    self._finish()
+
+            return
+
+        if kind == _YIELD:
+            with self._changed:
+                self._yielded.append(value)
+                self._unanswered += 1
+                self._changed.notify_all()
+        else:
+            if kind == _RESULT:
+                self.result = value
+            else:
+                self.exception = value
+
+            self.worker.segments.clear()
+            self._finish()
+
+    def _finish(self):
+        with self._changed:
+            self._finished = True
+            self._changed.notify_all()
+
+
+class _Worker(object):
+    """
+    A process kept by ``ProcessPool``, and the parent's end of the pipe to
+    it. It is started by the given ``multiprocessing`` context, or forked
+    from the current process by default.
+    """
+
+    def __init__(self, context=multiprocessing):
+        self.connection, child_connection = context.Pipe()
+        # Segments of the values sent to the current target, unlinked by
+        # ``close()`` if the worker dies before reading them.
+        self.segments = []
+        self.process = context.Process(
+            target=_work, args=(child_connection,), daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def terminate(self):
+        self.process.terminate()
+        self.process.join()
+
+    def stop(self):
+        if self.is_alive():
+            try:
+                _send(self.connection, None)
+            except OSError:
+                pass
+
+            self.process.join()
+
+        self.close()
+
+    def close(self):
+        _discard(self.connection)
+        _unlink_segments(self.segments)
+        self.segments.clear()
+
+
+class _Call(object):
+    """
+    A function submitted to ``ProcessPool``, to be run by a worker.
+    """
+
+    def __init__(self, future, fn, args, kwargs):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self, worker):
+        if not self.future.set_running_or_notify_cancel():
+            return
+
+        try:
+            _send(
+                worker.connection, (self.fn, self.args, self.kwargs, False),
+                worker.segments
+            )
+            kind, value = _receive(worker.connection)
+            worker.segments.clear()
+        except (EOFError, OSError):
+            worker.terminate()
+            self.future.set_exception(
+                concurrent.futures.process.BrokenProcessPool(
+                    'A worker died while running the function.'
+                )
+            )
+        except Exception as e:
+            self.future.set_exception(e)
+        else:
+            if kind == _RESULT:
+                self.future.set_result(value)
+            else:
+                self.future.set_exception(value)
+
+    def cancel(self):
+        self.future.cancel()
+
+
+def _work(connection):
+    """
+    The loop of a ``ProcessPool`` worker: it runs each target it receives,
+    sending back what it yields, if it is a generator function, and then
+    what it returns or raises.
+    """
+    while True:
+        try:
+            task = _receive(connection)
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        if task is None:
+            break
+
+        target, args, kwargs, converse = task
+
+        try:
+            if converse:
+                _converse(connection, target(*args, **kwargs))
+                result = None
+            else:
+                result = target(*args, **kwargs)
+        except Exception as e:
+            _send_outcome(connection, _EXCEPTION, e)
+        else:
+            _send_outcome(connection, _RESULT, result)
+
+    connection.close()
+
+
+def _converse(connection, generator):
+    """
+    Sends each value yielded by the generator to the parent, sending back to
+    the generator the value the parent answers with.
+    """
+    try:
+        value = next(generator)
+
+        while True:
+            _send(connection, (_YIELD, value))
+            value = generator.send(_receive(connection))
+    except StopIteration:
+        pass
+
+
+def _send_outcome(connection, kind, value):
+    try:
+        _send(connection, (kind, value))
+    except Exception as e:
+        _send(connection, (_EXCEPTION, RuntimeError(
+            'Cannot send {0!r} back: {1}'.format(value, e)
+        )))
+
+
+def _send(connection, value, segments=None):
+    connection.send_bytes(_dumps(value, segments))
+
+
+def _receive(connection):
+    return _loads(connection.recv_bytes())
+
+
+def _dumps(value, segments=None):
+    """
+    Pickles a value to be sent to another process. Buffers larger than
+    ``_SHARED_MEMORY_THRESHOLD`` are copied to shared memory segments, and
+    only their names and sizes are pickled, before the value itself. The
+    names are added to the ``segments`` list, if given, so the segments can
+    be unlinked if the message is never received.
+
+    Most values are small, so they are pickled as usual first, and only
+    pickled again with their buffers out of band if that was too large (or
+    failed, e.g. because of a memory view).
+    """
+    if not _has_large_buffer(value):
+        f = io.BytesIO()
+        f.write(bytes([_IN_BAND]))
+
+        try:
+            pickle.dump(value, f, _PICKLE_PROTOCOL)
+        except TypeError:
+            f = None
+
+        if f is not None and f.tell() <= _SHARED_MEMORY_THRESHOLD:
+            return f.getbuffer()
+
+    created = []
+
+    def put(buffer):
+        raw = buffer.raw()
+
+        if raw.nbytes < _SHARED_MEMORY_THRESHOLD:
+            return True
+
+        segment = _create_segment(raw.nbytes)
+        created.append((segment, raw.nbytes))
+        segment.buf[:raw.nbytes] = raw
+
+        return False
+
+    f = io.BytesIO()
+
+    try:
+        _Pickler(f, _PICKLE_PROTOCOL, buffer_callback=put).dump(value)
+    except BaseException:
+        for segment, size in created:
+            segment.close()
+            segment.unlink()
+
+        raise
+
+    header = pickle.dumps(
+        [(segment.name, size) for segment, size in created],
+        _PICKLE_PROTOCOL
+    )
+
+    for segment, size in created:
+        segment.close()
+
+        if segments is not None:
+            segments.append(segment.name)
+
+    return bytes([_OUT_OF_BAND]) + header + f.getbuffer()
+
+
+def _loads(data):
+    """
+    Unpickles a value pickled by ``_dumps()``. The buffers in shared memory
+    are not copied, unless they were ``bytes`` or ``bytearray`` objects,
+    which own their memory: memory views (and values such as NumPy arrays,
+    pickled with out-of-band buffers) are given views of the segments.
+    """
+    if data[0] == _IN_BAND:
+        return pickle.loads(memoryview(data)[1:])
+
+    f = io.BytesIO(data)
+    f.seek(1)
+    buffers = [_attach_segment(name, size) for name, size in pickle.load(f)]
+
+    return _Unpickler(f, buffers=buffers).load()
+
+
+def _get_segments(data):
+    """
+    Returns the names of the segments of a message pickled by ``_dumps()``,
+    without unpickling the value.
+    """
+    if not data or data[0] == _IN_BAND:
+        return []
+
+    f = io.BytesIO(data)
+    f.seek(1)
+
+    return [name for name, size in pickle.load(f)]
+
+
+def _discard(connection):
+    """
+    Closes a connection whose other end is gone, unlinking the segments of
+    the messages left unread.
+    """
+    if connection.closed:
+        return
+
+    try:
+        while connection.poll():
+            _unlink_segments(_get_segments(connection.recv_bytes()))
+    except (EOFError, OSError):
+        pass
+    finally:
+        connection.close()
+
+
+def _unlink_segments(names):
+    """
+    Unlinks the segments that still exist among the given ones.
+    """
+    for name in names:
+        try:
+            segment = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+
+        segment.close()
+        segment.unlink()
+
+
+def _has_large_buffer(value):
+    """
+    Checks whether the value (or, if it is a tuple, one of its items, as
+    in the messages of ``ProcessPool``) is a buffer to be put in shared
+    memory, so it does not need to be pickled in band first.
+    """
+    values = value if type(value) is tuple else (value,)
+
+    return any(
+        type(v) in _BUFFER_TYPES and
+        memoryview(v).nbytes >= _SHARED_MEMORY_THRESHOLD
+        for v in values
+    )
+
+
+class _Pickler(pickle.Pickler):
+    """
+    Pickles large ``bytes`` and ``bytearray`` objects, and all contiguous
+    ``memoryview`` objects, as out-of-band buffers, so that ``_dumps()`` can
+    put them in shared memory.
+
+    ``bytes`` objects are always pickled by the pickler itself, so they
+    are replaced by persistent IDs (with the buffers inside) instead of
+    reduced.
+    """
+
+    def persistent_id(self, obj):
+        kind = type(obj)
+
+        if kind is memoryview and obj.c_contiguous:
+            return (kind, pickle.PickleBuffer(obj), obj.format, obj.shape)
+        elif kind in (bytes, bytearray) and \
+                len(obj) >= _SHARED_MEMORY_THRESHOLD:
+            return (kind, pickle.PickleBuffer(obj), 'B', None)
+
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    """
+    Rebuilds the buffers pickled by ``_Pickler``. Memory views are views of
+    the received buffers; ``bytes`` and ``bytearray`` objects are copies.
+    """
+
+    def persistent_load(self, pid):
+        kind, buffer, format, shape = pid
+
+        if kind is memoryview:
+            return memoryview(buffer).cast('B').cast(format, shape)
+
+        return kind(buffer)
+
+
+def _create_segment(size):
+    """
+    Creates a shared memory segment to be unlinked by the process receiving
+    it, so it is not tracked by the resource tracker of this process.
+    """
+    try:
+        return shared_memory.SharedMemory(create=True, size=size, track=False)
+    except TypeError:
+        # Python 3.12 and older always track the segments.
+        segment = shared_memory.SharedMemory(create=True, size=size)
+        resource_tracker.unregister('/' + segment.name, 'shared_memory')
+
+        return segment
+
+
+def _attach_segment(name, size):
+    """
+    Maps a segment received from another process, returning a buffer of it.
+    The segment is unlinked at once, and closed once nothing uses the buffer
+    (or views made from it) anymore.
+    """
+    segment = shared_memory.SharedMemory(name=name)
+    segment.unlink()
+
+    # ``SharedMemory.close()`` fails while there are views of the segment,
+    # so it is called once the view below, which all the others come from,
+    # is released.
+    view = segment.buf[:size]
+    weakref.finalize(view, segment.close).atexit = False
+
+    return pickle.PickleBuffer(view)
+
+
+def _check_window(window):
+    if window is not None and window < 1:
+        raise ValueError(
+            'The window should hold at least one value, not {0}.'.format(
+                window
+            )
+        )
+
+
+def _run_chunk(fn, calls):
+    return [fn(*args) for args in calls]
+
+
+def _get_chunk_size(calls, workers):
+    """
+    Splits the calls of ``ProcessPool.map()`` in about four chunks for each
+    worker.
+    """
+    chunksize, extra = divmod(calls, workers * 4)
+
+    return max(chunksize + bool(extra), 1)
+
+
+def _get_deadline(timeout):
+    return time.monotonic() + timeout if timeout is not None else None
+
+
+def _get_timeout(deadline):
+    return max(deadline - time.monotonic(), 0) if deadline is not None \
+        else None
+
+
+# Buffers at least this large are sent to other processes in shared memory,
+# pickled with this protocol (the first one with out-of-band buffers). Each
+# message starts with a byte telling how it was pickled: ``_IN_BAND`` is
+# followed by the pickled value, and ``_OUT_OF_BAND`` by the list of
+# segments and then the value, pickled by ``_Pickler``.
+_SHARED_MEMORY_THRESHOLD = 1024 * 1024
+_PICKLE_PROTOCOL = 5
+_IN_BAND = 0
+_OUT_OF_BAND = 1
+_BUFFER_TYPES = (bytes, bytearray, memoryview)
+
+# Replacements of ``ProcessPool`` workers are started by this context, since
+# the pool threads are running by then (see ``ProcessPool``).
+_REPLACEMENT_CONTEXT = multiprocessing.get_context('forkserver')
+
+# Kinds of messages a ``ProcessPool`` worker sends to the parent.
+_YIELD = 'yield'
+_RESULT = 'result'
+_EXCEPTION = 'exception'
@@ -0,0 +1,162 @@
+#
+# Copyright 2015, 2016 Adam Victor Brandizzi
+#
+# This file is part of Inelegant.
+#
+# Inelegant is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Inelegant is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Inelegant.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+
+
+# Kinds of the frames written by ``inelegant.load.TrafficRecorder``.
+FRAME_OPEN = 0
+FRAME_CLIENT = 1
+FRAME_SERVER = 2
+FRAME_CLOSE = 3
+
+
+class Histogram(object):
+    """
+    ``Histogram`` records values (such as latencies, in seconds) and tells
+    their percentiles::
+
+    >>> histogram = Histogram()
+    >>> for i in range(1, 101):
+    ...     histogram.record(i / 100000)
+    >>> histogram.count
+    100
+    >>> histogram.percentile(50)
+    0.0005
+    >>> histogram.percentile(99)
+    0.00099
+
+    As in HdrHistogram, values are not stored one by one. Instead, each one
+    is counted in a bucket, and buckets get wider as the values grow, so that
+    the values in a bucket differ by at most the given number of
+    ``significant_figures`` (by default, three). So, recording many values
+    takes little memory, and the percentiles are still precise to that many
+    digits::
+
+    >>> histogram = Histogram(significant_figures=2)
+    >>> histogram.record(0.123456)
+    >>> histogram.percentile(100)
+    0.123456
+    >>> histogram.record(0.123456)
+    >>> histogram.record(1)
+    >>> histogram.percentile(50)
+    0.123903
+
+    Values are counted in multiples of ``unit`` (by default, a microsecond).
+    Values smaller than that are recorded as zero.
+
+    Histograms with the same precision and unit can be merged::
+
+    >>> other = Histogram(significant_figures=2)
+    >>> other.record(2)
+    >>> histogram.merge(other)
+    >>> histogram.count
+    4
+    >>> histogram.max
+    2.0
+    """
+
+    def __init__(self, significant_figures=3, unit=0.000001):
+        self.significant_figures = significant_figures
+        self.unit = unit
+
+        # Up to 2**_bits, each value has its own bucket. Above that, the
+        # buckets double their width whenever the values double.
+        self._bits = (2 * 10 ** significant_figures).bit_length()
+        self._counts = {}
+        self._min = None
+        self._max = None
+        self._total = 0
+
+        self.count = 0
+
+    def record(self, value, count=1):
+        units = max(int(round(value / self.unit)), 0)
+        bucket = self._get_bucket(units)
+
+        self._counts[bucket] = self._counts.get(bucket, 0) + count
+        self.count += count
+        self._total += units * count
+        self._min = units if self._min is None else min(self._min, units)
+        self._max = units if self._max is None else max(self._max, units)
+
+    def merge(self, other):
+        if (self.significant_figures, self.unit) != \
+                (other.significant_figures, other.unit):
+            raise ValueError(
+                'Cannot merge histograms with different precisions or units.'
+            )
+
+        for bucket, count in other._counts.items():
+            self._counts[bucket] = self._counts.get(bucket, 0) + count
+
+        if other.count:
+            self._min = other._min if self._min is None \
+                else min(self._min, other._min)
+            self._max = other._max if self._max is None \
+                else max(self._max, other._max)
+
+        self.count += other.count
+        self._total += other._total
+
+    def percentile(self, percent):
+        """
+        Returns the smallest value that is greater than or equal to the given
+        percentage of the recorded values, or ``None`` if there are no
+        values.
+        """
+        if not self.count:
+            return None
+
+        rank = max(math.ceil(percent / 100 * self.count), 1)
+        seen = 0
+
+        for bucket in sorted(self._counts):
+            seen += self._counts[bucket]
+
+            if seen >= rank:
+                highest = bucket + self._get_bucket_width(bucket) - 1
+                return self._to_value(min(max(highest, self._min), self._max))
+
+    @property
+    def min(self):
+        return self._to_value(self._min)
+
+    @property
+    def max(self):
+        return self._to_value(self._max)
+
+    @property
+    def mean(self):
+        if self.count:
+            return self._to_value(self._total / self.count)
+
+    def _get_bucket(self, units):
+        """
+        Returns the bucket of the value, represented by its lowest value.
+        """
+        shift = max(units.bit_length() - self._bits, 0)
+
+        return (units >> shift) << shift
+
+    def _get_bucket_width(self, bucket):
+        return 1 << max(bucket.bit_length() - self._bits, 0)
+
+    def _to_value(self, units):
+        if units is not None:
+            return round(units * self.unit, 9)
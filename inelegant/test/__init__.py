@@ -37,9 +37,11 @@ load_tests = TestFinder(
     'inelegant.test.finder',
     'inelegant.test.fs',
     'inelegant.test.io',
+    'inelegant.test.load',
     'inelegant.test.module',
     'inelegant.test.net',
     'inelegant.test.object',
     'inelegant.test.process',
+    'inelegant.test.record',
     'inelegant.test.toggle'
 ).load_tests
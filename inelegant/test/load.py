@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+#
+# Copyright 2015, 2016 Adam Victor Brandizzi
+#
+# This file is part of Inelegant.
+#
+# Inelegant is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Inelegant is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Inelegant.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import io
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+
+from inelegant.load import generate_load, TrafficRecorder, read_traffic, \
+    replay
+from inelegant.record import FRAME_OPEN, FRAME_CLIENT, FRAME_SERVER, \
+    FRAME_CLOSE
+from inelegant.net import Server, ThreadingServer, EchoServer, Proxy
+
+from inelegant.finder import TestFinder
+
+
+class TestGenerateLoad(unittest.TestCase):
+
+    def test_closed_loop(self):
+        """
+        ``generate_load()`` should send requests from all connections until
+        the given duration.
+        """
+        with ThreadingServer(port=9010, message='Server is up'):
+            report = generate_load(
+                'localhost', 9010, connections=8, duration=0.2
+            )
+
+        self.assertGreater(report.requests, 8)
+        self.assertEqual(0, report.errors)
+        self.assertGreaterEqual(report.elapsed, 0.2)
+        self.assertLessEqual(report.percentile(50), report.percentile(99))
+
+    def test_rate(self):
+        """
+        If the rate is given, the requests should be sent at that rate.
+        """
+        with Server(port=9010, message='Server is up'):
+            report = generate_load(
+                'localhost', 9010, connections=4, duration=0.5, rate=200
+            )
+
+        self.assertAlmostEqual(100, report.requests, delta=10)
+
+    def test_payload_and_response_size(self):
+        """
+        With ``response_size``, connections should be kept open and the
+        payload sent again after each response.
+        """
+        class EchoHandler(socketserver.BaseRequestHandler):
+
+            def handle(self):
+                connections.append(self.request)
+
+                while True:
+                    data = self.request.recv(1024)
+                    if not data:
+                        break
+                    self.request.sendall(data)
+
+        connections = []
+        server = socketserver.ThreadingTCPServer(('localhost', 0), EchoHandler)
+        server.daemon_threads = True
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        try:
+            report = generate_load(
+                'localhost', server.server_address[1], connections=2,
+                duration=0.2, payload=b'ping', response_size=4
+            )
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.assertGreater(report.requests, 2)
+        self.assertEqual(0, report.errors)
+        self.assertEqual(2, len(connections))
+
+    def test_errors(self):
+        """
+        Failed requests should be counted as errors.
+        """
+        report = generate_load('localhost', 9010, duration=0.05, rate=100)
+
+        self.assertEqual(0, report.requests)
+        self.assertAlmostEqual(5, report.errors, delta=1)
+
+
+class TestTrafficRecorder(unittest.TestCase):
+
+    def test_record_connections(self):
+        """
+        Each connection through the proxy should be recorded with its own
+        number, with the data sent in each direction.
+        """
+        log = io.BytesIO()
+
+        with EchoServer(port=0) as server:
+            with TrafficRecorder(log) as recorder:
+                target = ('localhost', server.port)
+
+                with Proxy(target, recorder=recorder) as proxy:
+                    for message in (b'first', b'second'):
+                        record_exchanges(proxy.port, [message])
+
+        log.seek(0)
+        frames = [
+            (connection, kind, data)
+            for time, connection, kind, data in read_traffic(log)
+        ]
+
+        for connection, message in ((0, b'first'), (1, b'second')):
+            self.assertEqual(
+                [
+                    (FRAME_OPEN, b''), (FRAME_CLIENT, message),
+                    (FRAME_SERVER, message), (FRAME_CLIENT, b''),
+                    (FRAME_SERVER, b''), (FRAME_CLOSE, b'')
+                ],
+                [(k, d) for c, k, d in frames if c == connection]
+            )
+
+    def test_timestamps(self):
+        """
+        Frames should have the time they were recorded, in seconds since the
+        recorder was created.
+        """
+        log = io.BytesIO()
+
+        with EchoServer(port=0) as server:
+            with TrafficRecorder(log) as recorder:
+                time.sleep(0.1)
+
+                target = ('localhost', server.port)
+
+                with Proxy(target, recorder=recorder) as proxy:
+                    record_exchanges(proxy.port, [b'a', b'b'], interval=0.1)
+
+        log.seek(0)
+        times = [
+            time for time, connection, kind, data in read_traffic(log)
+            if kind == FRAME_CLIENT and data
+        ]
+
+        self.assertEqual(2, len(times))
+        self.assertGreaterEqual(times[0], 0.1)
+        self.assertAlmostEqual(0.1, times[1] - times[0], delta=0.05)
+
+    def test_path(self):
+        """
+        The log can be given as a path, in which case the recorder opens and
+        closes the file.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'traffic.log')
+
+            with EchoServer(port=0) as server:
+                with TrafficRecorder(path) as recorder:
+                    with Proxy(
+                            ('localhost', server.port),
+                            recorder=recorder) as proxy:
+                        record_exchanges(proxy.port, [b'message'])
+
+            self.assertTrue(recorder.file.closed)
+            self.assertIn(
+                b'message', [data for t, c, k, data in read_traffic(path)]
+            )
+
+    def test_truncated_log(self):
+        """
+        Reading a truncated log should fail.
+        """
+        log = io.BytesIO()
+
+        with TrafficRecorder(log) as recorder:
+            recorder.record(recorder.start_connection(), FRAME_CLIENT, b'abc')
+
+        log = io.BytesIO(log.getvalue()[:-1])
+
+        with self.assertRaises(ValueError):
+            list(read_traffic(log))
+
+
+class TestReplay(unittest.TestCase):
+
+    def test_replay(self):
+        """
+        ``replay()`` should send again what each connection sent, waiting for
+        each response before sending the next request.
+        """
+        log = record([b'ping', b'pong', b'done'])
+
+        with EchoServer(port=0) as server:
+            report = replay(log, 'localhost', server.port)
+
+        self.assertEqual(3, report.requests)
+        self.assertEqual(0, report.errors)
+        self.assertEqual(1, server.stats.connections)
+        self.assertEqual(12, server.stats.bytes_received)
+
+    def test_copies(self):
+        """
+        ``copies`` should replay that many copies of the traffic at once.
+        """
+        log = record([b'ping', b'pong'])
+
+        with EchoServer(port=0) as server:
+            report = replay(
+                log, 'localhost', server.port, speed=None, copies=20
+            )
+
+        self.assertEqual(40, report.requests)
+        self.assertEqual(0, report.errors)
+        self.assertEqual(20, server.stats.connections)
+        self.assertEqual(160, server.stats.bytes_received)
+
+    def test_speed(self):
+        """
+        The traffic should be replayed at the recorded pace, multiplied by
+        ``speed``; if it is ``None``, as fast as possible.
+        """
+        log = record([b'a', b'b', b'c'], interval=0.1)
+
+        with EchoServer(port=0) as server:
+            for speed, expected in ((1, 0.2), (4, 0.05), (None, 0)):
+                log.seek(0)
+                report = replay(log, 'localhost', server.port, speed=speed)
+
+                self.assertEqual(0, report.errors)
+                self.assertAlmostEqual(expected, report.elapsed, delta=0.04)
+
+    def test_short_response(self):
+        """
+        If the server does not send as much as it did in the recording, the
+        connection should be counted as an error.
+        """
+        log = record([b'ping'])
+
+        with Server(port=0, message=b'p') as server:
+            report = replay(log, 'localhost', server.port, timeout=0.1)
+
+        self.assertEqual(0, report.requests)
+        self.assertEqual(1, report.errors)
+
+    def test_errors(self):
+        """
+        Connections that cannot be opened should be counted as errors.
+        """
+        log = record([b'ping'])
+
+        with Server(port=0) as server:
+            port = server.port
+
+        report = replay(log, 'localhost', port, copies=3)
+
+        self.assertEqual(0, report.requests)
+        self.assertEqual(3, report.errors)
+
+
+def record(messages, interval=0):
+    """
+    Returns a log of a connection to an echo server sending the messages.
+    """
+    log = io.BytesIO()
+
+    with EchoServer(port=0) as server:
+        with TrafficRecorder(log) as recorder:
+            with Proxy(
+                    ('localhost', server.port), recorder=recorder) as proxy:
+                record_exchanges(proxy.port, messages, interval)
+
+    log.seek(0)
+
+    return log
+
+
+def record_exchanges(port, messages, interval=0):
+    """
+    Sends each message to an echo server, waiting for it to come back, and
+    then closes the connection.
+    """
+    with socket.create_connection(('localhost', port)) as s:
+        for i, message in enumerate(messages):
+            if i:
+                time.sleep(interval)
+
+            s.sendall(message)
+            received = b''
+
+            while len(received) < len(message):
+                received += s.recv(1024)
+
+        s.shutdown(socket.SHUT_WR)
+
+        while s.recv(1024):
+            pass
+
+
+load_tests = TestFinder(__name__, 'inelegant.load').load_tests
+
+if __name__ == "__main__":
+    unittest.main()
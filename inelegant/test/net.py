@@ -19,15 +19,26 @@
 
 import unittest
 
+import asyncio
 import multiprocessing
 import threading
 import socket
 import contextlib
 import time
 import errno
+import os.path
+import tempfile
+import http.client
 
-from inelegant.net import Server, wait_server_up, wait_server_down, get_socket
+from inelegant.net import Server, ThreadingServer, SelectorServer, \
+    PreforkServer, EchoServer, SinkServer, HTTPServer, RedisServer, Proxy, \
+    ServerPool, wait_server_up, wait_server_down, wait_servers_up, \
+    wait_servers_down, async_wait_server_up, async_wait_server_down, \
+    get_listening_addresses, get_listening_paths, get_socket, reserve_port, \
+    release_port, reserved_port, temp_hosts
 from inelegant.process import Process
+from inelegant.load import generate_load
+from inelegant.object import temp_attr
 
 from inelegant.finder import TestFinder
 
@@ -75,6 +86,1585 @@ class TestServer(unittest.TestCase):
                 s.connect(('localhost', 9000))
                 msg = s.recv(len(b'Server is up'))
 
+    def test_with_is_ready(self):
+        """
+        The ``with`` statement only enters the block once the server is
+        listening, so one can connect right away, with no sleeps or waiters.
+        """
+        for i in range(20):
+            with Server(message='Server is up'):
+                with contextlib.closing(get_socket(timeout=1)) as s:
+                    s.connect(('localhost', 9000))
+                    msg = s.recv(len(b'Server is up'))
+
+                    self.assertEqual(b'Server is up', msg)
+
+    def test_with_fails_to_bind(self):
+        """
+        If the server cannot bind to the port, the error is raised by the
+        ``with`` statement.
+        """
+        with Server(port=9001):
+            with self.assertRaises(socket.error) as a:
+                with Server(port=9001):
+                    self.fail('Should not enter the block.')
+
+            self.assertEqual(errno.EADDRINUSE, a.exception.errno)
+
+    def test_with_fails_to_serve(self):
+        """
+        If the server fails before it starts serving (e.g. a prefork server
+        cannot fork), the ``with`` statement should raise the error instead
+        of waiting forever.
+        """
+        class FailingServer(Server):
+            def serve_forever(self, poll_interval=None):
+                raise OSError(errno.EAGAIN, 'Cannot fork')
+
+        server = FailingServer(port=9001)
+
+        with self.assertRaises(OSError) as a:
+            with server:
+                self.fail('Should not enter the block.')
+
+        self.assertEqual(errno.EAGAIN, a.exception.errno)
+        self.assertFalse(server.thread.is_alive())
+
+        with Server(port=9001):
+            pass  # The port was released.
+
+    def test_idle_server_does_not_poll(self):
+        """
+        An idle server should block until something happens, instead of
+        waking up periodically.
+        """
+        class LoopCounter(object):
+            loops = 0
+
+            def service_actions(self):
+                self.loops += 1
+
+        for server_class in (Server, SelectorServer):
+            counting_class = type('Counting', (LoopCounter, server_class), {})
+
+            with counting_class(port=0) as server:
+                server.loops = 0
+                time.sleep(0.1)
+
+            self.assertLessEqual(server.loops, 1)
+
+    def test_shutdown_does_not_wait_poll_interval(self):
+        """
+        ``shutdown()`` should stop the server at once, even if it polls with
+        a long interval.
+        """
+        for server_class in (Server, SelectorServer):
+            server = server_class(port=9010)
+            thread = threading.Thread(
+                target=server.serve_forever, kwargs={'poll_interval': 10}
+            )
+            thread.start()
+            wait_server_up('localhost', 9010)
+
+            start = time.time()
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+            self.assertLess(time.time() - start, 1)
+
+
+class TestMessages(unittest.TestCase):
+
+    server_classes = (Server, ThreadingServer, SelectorServer, PreforkServer)
+
+    def read(self, port):
+        chunks = []
+
+        with contextlib.closing(get_socket(timeout=5)) as s:
+            s.connect(('localhost', port))
+
+            while True:
+                chunk = s.recv(1024 * 1024)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+
+        return b''.join(chunks)
+
+    def test_bytes_message(self):
+        """
+        ``bytes`` and ``memoryview`` messages should be sent as they are.
+        """
+        message = os.urandom(5 * 1024 * 1024)
+
+        for server_class in self.server_classes:
+            for payload in (message, memoryview(message)):
+                with server_class(port=9010, message=payload):
+                    self.assertEqual(message, self.read(9010))
+                    self.assertEqual(message, self.read(9010))
+
+    def test_file_message(self):
+        """
+        If the message is a file, its whole content should be sent to each
+        connection.
+        """
+        content = os.urandom(5 * 1024 * 1024)
+
+        with tempfile.TemporaryFile() as f:
+            f.write(content)
+            f.flush()
+
+            for server_class in self.server_classes:
+                with server_class(port=9010, message=f):
+                    self.assertEqual(content, self.read(9010))
+                    self.assertEqual(content, self.read(9010))
+
+    def test_async_bytes_and_file_messages(self):
+        """
+        The ``async with`` form should also send ``bytes`` and file messages.
+        """
+        async def read(message):
+            async with Server(port=9010, message=message):
+                reader, writer = await asyncio.open_connection(
+                    'localhost', 9010
+                )
+                content = await reader.read()
+                writer.close()
+                await writer.wait_closed()
+
+            return content
+
+        content = os.urandom(1024 * 1024)
+
+        with tempfile.TemporaryFile() as f:
+            f.write(content)
+            f.flush()
+
+            self.assertEqual(content, asyncio.run(read(content)))
+            self.assertEqual(content, asyncio.run(read(f)))
+
+    def test_replaced_message(self):
+        """
+        If the message is replaced, the new one should be sent.
+        """
+        with Server(port=9010, message='first') as server:
+            self.assertEqual(b'first\0', self.read(9010))
+            server.message = 'second'
+            self.assertEqual(b'second\0', self.read(9010))
+
+
+class TestConcurrentServers(unittest.TestCase):
+
+    def test_many_connections(self):
+        """
+        All concurrent servers should serve many parallel connections.
+        """
+        def read(results):
+            with contextlib.closing(get_socket(timeout=5)) as s:
+                s.connect(('localhost', 9010))
+                results.append(s.recv(len(b'Server is up')))
+
+        for server_class in (ThreadingServer, SelectorServer, PreforkServer):
+            results = []
+
+            with server_class(port=9010, message='Server is up'):
+                threads = [
+                    threading.Thread(target=read, args=(results,))
+                    for i in range(50)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            self.assertEqual([b'Server is up'] * 50, results)
+
+    def test_slow_client_does_not_block(self):
+        """
+        A client that does not read its message should not prevent the
+        threading and selector servers from serving other clients.
+        """
+        message = 'x' * (10 * 1024 * 1024)
+
+        for server_class in (ThreadingServer, SelectorServer):
+            with server_class(port=9010, message=message):
+                slow = get_socket()
+                slow.connect(('localhost', 9010))
+
+                with contextlib.closing(slow):
+                    with contextlib.closing(get_socket(timeout=2)) as s:
+                        s.connect(('localhost', 9010))
+                        received = 0
+                        while True:
+                            data = s.recv(1024 * 1024)
+                            if not data:
+                                break
+                            received += len(data)
+
+                    self.assertEqual(len(message) + 1, received)
+
+    def test_prefork_workers(self):
+        """
+        ``PreforkServer`` should start ``workers - 1`` processes, and stop
+        them once shut down.
+        """
+        with PreforkServer(port=9010, workers=3) as server:
+            self.assertEqual(2, len(server.processes))
+            self.assertTrue(
+                all(process.is_alive() for process in server.processes)
+            )
+
+        self.assertFalse(
+            any(process.is_alive() for process in server.processes)
+        )
+
+    def test_prefork_forks_before_serving_thread(self):
+        """
+        With the ``with`` statement, ``PreforkServer`` should fork its
+        workers from the entering thread, before starting the serving one.
+        """
+        class RecordingServer(PreforkServer):
+            def _fork_workers(self, poll_interval=None):
+                self.forking_thread = threading.current_thread()
+                self.forking_threads = threading.active_count()
+                PreforkServer._fork_workers(self, poll_interval)
+
+        threads = threading.active_count()
+
+        with RecordingServer(port=9010, workers=2) as server:
+            with contextlib.closing(get_socket(timeout=1)) as s:
+                s.connect(('localhost', 9010))
+                self.assertEqual(b'Message sent\x00', s.recv(20))
+
+        self.assertIs(threading.current_thread(), server.forking_thread)
+        self.assertEqual(threads, server.forking_threads)
+
+    def test_selector_handle_request(self):
+        """
+        ``SelectorServer.handle_request()`` should serve the pending
+        connections and return once their messages are sent.
+        """
+        class ListeningServer(SelectorServer):
+            listening = threading.Event()
+
+            def server_activate(self):
+                SelectorServer.server_activate(self)
+                self.listening.set()
+
+        server = ListeningServer(port=9010, message=b'x' * (1024 * 1024))
+        thread = threading.Thread(target=server.handle_request)
+        thread.start()
+
+        try:
+            self.assertTrue(server.listening.wait(1))
+            with contextlib.closing(get_socket(timeout=2)) as s:
+                s.connect(('localhost', 9010))
+                self.assertEqual(1024 * 1024, len(receive_all(s)))
+
+            thread.join(1)
+            self.assertFalse(thread.is_alive())
+        finally:
+            server.server_close()
+
+    def test_selector_handle_request_timeout(self):
+        """
+        ``SelectorServer.handle_request()`` should give up after the
+        ``timeout`` attribute, calling ``handle_timeout()``.
+        """
+        class TimingOutServer(SelectorServer):
+            timeout = 0.01
+            timed_out = False
+
+            def handle_timeout(self):
+                self.timed_out = True
+
+        server = TimingOutServer(port=9010)
+
+        try:
+            server.handle_request()
+        finally:
+            server.server_close()
+
+        self.assertTrue(server.timed_out)
+
+
+class TestUnixSockets(unittest.TestCase):
+
+    def read(self, path, size=len(b'Server is up')):
+        with contextlib.closing(get_socket(1, socket.AF_UNIX)) as s:
+            s.connect(path)
+            return s.recv(size)
+
+    def test_path(self):
+        """
+        Servers should listen to Unix sockets in the given paths, and remove
+        the socket files once closed.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'server.sock')
+
+            for server_class in (Server, ThreadingServer, SelectorServer):
+                with server_class(path=path, message='Server is up'):
+                    self.assertEqual(b'Server is up', self.read(path))
+
+                self.assertFalse(os.path.exists(path))
+
+    def test_abstract_path(self):
+        """
+        Paths starting with a null character should be from the abstract
+        namespace.
+        """
+        path = '\0inelegant-test-{0}'.format(os.getpid())
+
+        with Server(path=path, message='Server is up'):
+            self.assertEqual(b'Server is up', self.read(path))
+
+    def test_path_in_use(self):
+        """
+        If the path is being used, the server should fail without removing
+        the socket file from the other server.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'server.sock')
+
+            with Server(path=path, message='Server is up'):
+                with self.assertRaises(socket.error):
+                    with Server(path=path):
+                        pass
+
+                self.assertEqual(b'Server is up', self.read(path))
+
+    def test_async_path(self):
+        """
+        The ``async with`` statement should also support Unix sockets.
+        """
+        async def main(path):
+            async with Server(path=path, message='Server is up'):
+                await async_wait_server_up(path=path)
+                reader, writer = await asyncio.open_unix_connection(path)
+                msg = await reader.read(len(b'Server is up'))
+                writer.close()
+                await writer.wait_closed()
+
+            await async_wait_server_down(path=path)
+
+            return msg
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'server.sock')
+
+            self.assertEqual(b'Server is up', asyncio.run(main(path)))
+            self.assertFalse(os.path.exists(path))
+
+    def test_waiters(self):
+        """
+        The waiters should accept Unix socket paths.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'server.sock')
+            server = Server(path=path, message='Server is up')
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+
+            try:
+                wait_server_up(path=path)
+                self.assertEqual(b'Server is up', self.read(path))
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+
+            wait_server_down(path=path)
+
+            with self.assertRaises(Exception):
+                wait_server_up(path=path, timeout=0.05)
+
+    def test_batch_waiters(self):
+        """
+        The batch waiters should accept paths among ``(host, port)`` pairs,
+        and report them if they fail.
+        """
+        path = '\0inelegant-test-{0}'.format(os.getpid())
+        addresses = [('localhost', 9010), path]
+
+        with Server(port=9010), Server(path=path):
+            wait_servers_up(addresses)
+
+            for probe in ('connect', 'proc'):
+                with self.assertRaises(Exception) as a:
+                    wait_servers_down(addresses, timeout=0.05, probe=probe)
+
+                self.assertIn('@inelegant-test-', str(a.exception))
+
+        wait_servers_down(addresses)
+        wait_servers_down(addresses, probe='proc')
+
+    def test_get_listening_paths(self):
+        """
+        ``get_listening_paths()`` should list filesystem and abstract paths.
+        """
+        abstract_path = '\0inelegant-test-{0}'.format(os.getpid())
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'server.sock')
+
+            with Server(path=path), Server(path=abstract_path):
+                listening = get_listening_paths()
+
+                self.assertIn(path, listening)
+                self.assertIn(abstract_path, listening)
+
+            listening = get_listening_paths()
+
+            self.assertNotIn(path, listening)
+            self.assertNotIn(abstract_path, listening)
+
+    def test_socketpair(self):
+        """
+        ``Server.socketpair()`` should return a socket that receives the
+        message, even if the server is not serving.
+        """
+        server = Server(message='Server is up')
+
+        with contextlib.closing(server.socketpair()) as s:
+            self.assertEqual(b'Server is up\0', s.recv(1024))
+            self.assertEqual(b'', s.recv(1024))
+
+    def test_socketpair_large_messages(self):
+        """
+        Messages larger than the socket buffer should be sent entirely.
+        """
+        content = os.urandom(5 * 1024 * 1024)
+
+        with tempfile.TemporaryFile() as f:
+            f.write(content)
+            f.flush()
+
+            for message in (content, f):
+                server = Server(message=message)
+
+                with contextlib.closing(server.socketpair()) as s:
+                    chunks = []
+                    while True:
+                        chunk = s.recv(1024 * 1024)
+                        if not chunk:
+                            break
+                        chunks.append(chunk)
+
+                self.assertEqual(content, b''.join(chunks))
+
+
+class TestServerStats(unittest.TestCase):
+
+    def test_disabled_by_default(self):
+        """
+        Statistics should only be kept if asked.
+        """
+        self.assertIsNone(Server().stats)
+
+    def test_server_classes(self):
+        """
+        All server classes should keep statistics.
+        """
+        for server_class in (Server, ThreadingServer, SelectorServer):
+            server = server_class(port=0, message=b'x' * 100000, stats=True)
+
+            with server:
+                for i in range(3):
+                    with socket.create_connection(
+                            ('localhost', server.port)) as s:
+                        receive_all(s)
+
+            stats = server.stats
+            self.assertEqual(3, stats.connections, server_class)
+            self.assertEqual(0, stats.active_connections, server_class)
+            self.assertEqual(300000, stats.bytes_sent, server_class)
+            self.assertEqual(3, stats.handle_time.count, server_class)
+            self.assertEqual(3, stats.backlog.count, server_class)
+
+    def test_file_message(self):
+        """
+        The bytes sent from files should be counted.
+        """
+        with tempfile.TemporaryFile() as f:
+            f.write(b'My file content')
+            f.flush()
+
+            with Server(port=0, message=f, stats=True) as server:
+                with socket.create_connection(('localhost', server.port)) as s:
+                    receive_all(s)
+
+        self.assertEqual(15, server.stats.bytes_sent)
+
+    def test_backlog(self):
+        """
+        The backlog should count the connections waiting to be accepted while
+        the server is busy.
+        """
+        with Server(port=0, message=b'x' * 10000000, stats=True) as server:
+            first = socket.create_connection(('localhost', server.port))
+            wait_until(lambda: server.stats.connections == 1)
+
+            others = [
+                socket.create_connection(('localhost', server.port))
+                for i in range(3)
+            ]
+
+            for s in [first] + others:
+                with s:
+                    receive_all(s)
+
+        self.assertEqual(4, server.stats.connections)
+        self.assertEqual(2, server.stats.backlog.max)
+        self.assertEqual(0, server.stats.backlog.min)
+        self.assertTrue(
+            server.stats.handle_time.max > server.stats.handle_time.min
+        )
+
+    def test_unix_sockets(self):
+        """
+        Servers listening to Unix sockets should keep statistics, except for
+        the backlog.
+        """
+        with Server(path='\0inelegant-test', message=b'abc', stats=True) \
+                as server:
+            with socket.socket(socket.AF_UNIX) as s:
+                s.connect('\0inelegant-test')
+                receive_all(s)
+
+        self.assertEqual(1, server.stats.connections)
+        self.assertEqual(3, server.stats.bytes_sent)
+        self.assertEqual(0, server.stats.backlog.count)
+
+    def test_socketpair(self):
+        """
+        Connections made through ``Server.socketpair()`` should be counted,
+        whether the message fits the socket buffer or not.
+        """
+        for message in (b'abc', b'x' * 10000000):
+            server = Server(message=message, stats=True)
+
+            with server.socketpair() as s:
+                receive_all(s)
+
+            wait_until(lambda: server.stats.active_connections == 0)
+
+            self.assertEqual(1, server.stats.connections)
+            self.assertEqual(len(message), server.stats.bytes_sent)
+            self.assertEqual(1, server.stats.handle_time.count)
+            self.assertEqual(0, server.stats.backlog.count)
+
+    def test_async(self):
+        """
+        Servers in ``async with`` statements should keep statistics too.
+        """
+        async def get(server):
+            async with server:
+                reader, writer = await asyncio.open_connection(
+                    'localhost', server.port
+                )
+                await reader.read()
+                writer.close()
+                await writer.wait_closed()
+
+        server = Server(port=0, message=b'abc', stats=True)
+        asyncio.run(get(server))
+
+        self.assertEqual(1, server.stats.connections)
+        self.assertEqual(3, server.stats.bytes_sent)
+        self.assertEqual(1, server.stats.handle_time.count)
+
+    def test_reset(self):
+        """
+        ``reset()`` should set the statistics back to zero.
+        """
+        with Server(port=0, message=b'abc', stats=True) as server:
+            with socket.create_connection(('localhost', server.port)) as s:
+                receive_all(s)
+
+            server.stats.reset()
+
+        self.assertEqual(0, server.stats.connections)
+        self.assertEqual(0, server.stats.bytes_sent)
+        self.assertEqual(0, server.stats.handle_time.count)
+        self.assertEqual(0, server.stats.backlog.count)
+
+
+class TestStreamServers(unittest.TestCase):
+
+    def test_echo(self):
+        """
+        ``EchoServer`` should send back everything, even if it is more than
+        the socket buffers can take at once.
+        """
+        message = os.urandom(1000000)
+
+        with EchoServer(port=0) as server:
+            with socket.create_connection(('localhost', server.port)) as s:
+                def send():
+                    s.sendall(message)
+                    s.shutdown(socket.SHUT_WR)
+
+                thread = threading.Thread(target=send)
+                thread.start()
+                received = receive_all(s)
+                thread.join()
+
+        self.assertEqual(message, received)
+        self.assertEqual(len(message), server.stats.bytes_received)
+        self.assertEqual(len(message), server.stats.bytes_sent)
+
+    def test_sink(self):
+        """
+        ``SinkServer`` should count the bytes of all connections.
+        """
+        def send(port):
+            with socket.create_connection(('localhost', port)) as s:
+                s.sendall(b'x' * 100000)
+                s.shutdown(socket.SHUT_WR)
+                receive_all(s)
+
+        with SinkServer(port=0) as server:
+            threads = [
+                threading.Thread(target=send, args=(server.port,))
+                for i in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(4, server.stats.connections)
+            self.assertEqual(400000, server.stats.bytes_received)
+            self.assertEqual(0, server.stats.bytes_sent)
+            self.assertTrue(server.stats.throughput > 0)
+
+    def test_active_connections(self):
+        """
+        Open connections should be counted as active, and closing the server
+        should close them instead of waiting for them.
+        """
+        server = SinkServer(port=0).__enter__()
+
+        with socket.create_connection(('localhost', server.port)) as s:
+            s.sendall(b'x')
+            wait_until(lambda: server.stats.bytes_received == 1)
+
+            self.assertEqual(1, server.stats.active_connections)
+
+            start = time.monotonic()
+            server.__exit__(None, None, None)
+
+            self.assertTrue(time.monotonic() - start < 0.5)
+            self.assertEqual(0, server.stats.active_connections)
+            self.assertEqual(b'', s.recv(10))
+
+    def test_stats(self):
+        """
+        The stream servers should keep the same ``ServerStats`` as the other
+        servers, unless ``stats`` is false.
+        """
+        for server_class in (EchoServer, SinkServer, HTTPServer, RedisServer):
+            with server_class(port=0) as server:
+                with socket.create_connection(('localhost', server.port)):
+                    pass
+
+            self.assertEqual(1, server.stats.connections, server_class)
+            self.assertEqual(1, server.stats.handle_time.count, server_class)
+            self.assertEqual(1, server.stats.backlog.count, server_class)
+
+            self.assertIsNone(server_class(stats=False).stats)
+
+        with EchoServer(port=0, stats=False) as server:
+            with socket.create_connection(('localhost', server.port)) as s:
+                s.sendall(b'My message')
+
+                self.assertEqual(b'My message', s.recv(10))
+
+    def test_reset_stats(self):
+        """
+        ``reset()`` should set all statistics to zero.
+        """
+        with EchoServer(port=0) as server:
+            with socket.create_connection(('localhost', server.port)) as s:
+                s.sendall(b'My message')
+                s.recv(10)
+
+            server.stats.reset()
+
+            self.assertEqual(0, server.stats.connections)
+            self.assertEqual(0, server.stats.bytes_received)
+            self.assertEqual(0, server.stats.bytes_sent)
+            self.assertIsNone(server.stats.throughput)
+
+    def test_socketpair(self):
+        """
+        The stream servers should serve socket pairs as well.
+        """
+        server = EchoServer()
+
+        with server.socketpair() as s:
+            s.sendall(b'My message')
+
+            self.assertEqual(b'My message', s.recv(10))
+
+        wait_until(lambda: server.stats.active_connections == 0)
+        self.assertEqual(1, server.stats.connections)
+
+    def test_async(self):
+        """
+        The stream servers should work in ``async with`` statements.
+        """
+        async def echo():
+            async with EchoServer(port=0) as server:
+                reader, writer = await asyncio.open_connection(
+                    'localhost', server.port
+                )
+                writer.write(b'My message')
+                writer.write_eof()
+                message = await reader.read()
+                writer.close()
+                await writer.wait_closed()
+
+                return message
+
+        self.assertEqual(b'My message', asyncio.run(echo()))
+
+    def test_unix_sockets(self):
+        """
+        The stream servers should listen to Unix sockets as well.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'sink.sock')
+
+            with SinkServer(path=path) as server:
+                with socket.socket(socket.AF_UNIX) as s:
+                    s.connect(path)
+                    s.sendall(b'My message')
+                    s.shutdown(socket.SHUT_WR)
+                    receive_all(s)
+
+            self.assertEqual(10, server.stats.bytes_received)
+
+
+class TestHTTPServer(unittest.TestCase):
+
+    def test_routes(self):
+        """
+        Each route can be a body, a ``(status, body)`` tuple or a ``(status,
+        headers, body)`` tuple.
+        """
+        routes = {
+            '/text': 'My message',
+            '/bytes': (202, b'\x00\x01'),
+            '/json': (200, {'Content-Type': 'application/json'}, '{}'),
+        }
+
+        with HTTPServer(port=0, routes=routes) as server:
+            client = http.client.HTTPConnection('localhost', server.port)
+
+            try:
+                client.request('GET', '/text')
+                response = client.getresponse()
+                self.assertEqual(200, response.status)
+                self.assertEqual(
+                    'text/plain; charset=utf-8',
+                    response.getheader('Content-Type')
+                )
+                self.assertEqual(b'My message', response.read())
+
+                client.request('GET', '/bytes')
+                response = client.getresponse()
+                self.assertEqual(202, response.status)
+                self.assertEqual(b'\x00\x01', response.read())
+
+                client.request('GET', '/json?pretty=1')
+                response = client.getresponse()
+                self.assertEqual(
+                    'application/json', response.getheader('Content-Type')
+                )
+                self.assertEqual(b'{}', response.read())
+
+                client.request('GET', '/none')
+                response = client.getresponse()
+                self.assertEqual(404, response.status)
+                response.read()
+
+                client.request('HEAD', '/text')
+                response = client.getresponse()
+                self.assertEqual('10', response.getheader('Content-Length'))
+                self.assertEqual(b'', response.read())
+            finally:
+                client.close()
+
+        self.assertEqual(1, server.stats.connections)
+        self.assertEqual(5, server.stats.requests)
+
+    def test_non_standard_status(self):
+        """
+        Status codes not in the standard should be sent as they are, with an
+        empty reason phrase.
+        """
+        routes = {'/custom': (299, 'Custom'), '/error': (599, 'Error')}
+
+        with HTTPServer(port=0, routes=routes) as server:
+            client = http.client.HTTPConnection('localhost', server.port)
+
+            try:
+                client.request('GET', '/custom')
+                response = client.getresponse()
+                self.assertEqual(299, response.status)
+                self.assertEqual('', response.reason)
+                self.assertEqual(b'Custom', response.read())
+
+                client.request('GET', '/error')
+                response = client.getresponse()
+                self.assertEqual(599, response.status)
+                self.assertEqual(b'Error', response.read())
+            finally:
+                client.close()
+
+    def test_pipelining(self):
+        """
+        Requests sent at once should be answered in order, skipping their
+        bodies.
+        """
+        server = HTTPServer(port=0)
+        for i in range(10):
+            server.route('/{0}'.format(i), str(i))
+
+        requests = b''.join(
+            b'POST /%d HTTP/1.1\r\nContent-Length: 4\r\n\r\nbody' % i
+            for i in range(10)
+        )
+
+        with server:
+            with socket.create_connection(('localhost', server.port)) as s:
+                s.sendall(requests + b'GET /9 HTTP/1.1\r\nConnection: close'
+                                     b'\r\n\r\n')
+                response = receive_all(s)
+
+        bodies = [
+            part.split(b'\r\n\r\n')[1]
+            for part in response.split(b'HTTP/1.1 200 OK')[1:]
+        ]
+        self.assertEqual(
+            [str(i).encode() for i in list(range(10)) + [9]], bodies
+        )
+        self.assertEqual(11, server.stats.requests)
+
+    def test_http_1_0(self):
+        """
+        HTTP/1.0 connections should be closed, unless the client asks to
+        keep them alive.
+        """
+        with HTTPServer(port=0, routes={'/': 'OK'}) as server:
+            with socket.create_connection(('localhost', server.port)) as s:
+                s.sendall(b'GET / HTTP/1.0\r\n\r\n')
+                response = receive_all(s)
+
+            self.assertIn(b'Connection: close\r\n', response)
+
+            with socket.create_connection(('localhost', server.port)) as s:
+                s.sendall(b'GET / HTTP/1.0\r\nConnection: Keep-Alive\r\n\r\n')
+                response = s.recv(1024)
+                s.sendall(b'GET / HTTP/1.0\r\n\r\n')
+                response += receive_all(s)
+
+            self.assertIn(b'Connection: keep-alive\r\n', response)
+            self.assertEqual(2, response.count(b'HTTP/1.1 200 OK'))
+
+    def test_bad_request(self):
+        """
+        Malformed requests should be answered with ``400 Bad Request``, and
+        the connection closed.
+        """
+        with HTTPServer(port=0, routes={'/': 'OK'}) as server:
+            with socket.create_connection(('localhost', server.port)) as s:
+                s.sendall(b'GET / HTTP/1.1\r\n\r\nNonsense\r\n\r\n')
+                response = receive_all(s)
+
+        self.assertTrue(response.startswith(b'HTTP/1.1 200 OK'))
+        self.assertIn(b'HTTP/1.1 400 Bad Request', response)
+
+    def test_close_idle_connections(self):
+        """
+        Closing the server should not wait for idle persistent connections.
+        """
+        server = HTTPServer(port=0, routes={'/': 'OK'}).__enter__()
+
+        with socket.create_connection(('localhost', server.port)) as s:
+            s.sendall(b'GET / HTTP/1.1\r\n\r\n')
+            s.recv(1024)
+
+            start = time.monotonic()
+            server.__exit__(None, None, None)
+
+            self.assertTrue(time.monotonic() - start < 0.5)
+
+    def test_async(self):
+        """
+        ``HTTPServer`` should work in ``async with`` statements.
+        """
+        async def get():
+            async with HTTPServer(port=0, routes={'/': 'OK'}) as server:
+                reader, writer = await asyncio.open_connection(
+                    'localhost', server.port
+                )
+                writer.write(b'GET / HTTP/1.1\r\nConnection: close\r\n\r\n')
+                response = await reader.read()
+                writer.close()
+                await writer.wait_closed()
+
+                return response
+
+        self.assertTrue(asyncio.run(get()).endswith(b'\r\n\r\nOK'))
+
+    def test_load(self):
+        """
+        ``HTTPServer`` should take the load of persistent connections from
+        ``inelegant.load.generate_load()``.
+        """
+        with HTTPServer(port=0, routes={'/': 'OK'}) as server:
+            report = generate_load(
+                'localhost', server.port, connections=2, duration=0.1,
+                payload=b'GET / HTTP/1.1\r\n\r\n',
+                response_size=len(server.routes['/'].get(False, None))
+            )
+
+        self.assertEqual(0, report.errors)
+        self.assertEqual(2, server.stats.connections)
+        self.assertEqual(report.requests, server.stats.requests)
+
+
+class TestRedisServer(unittest.TestCase):
+
+    def test_strings(self):
+        """
+        ``RedisServer`` should store, read and delete values.
+        """
+        with RedisServer(port=0, data={'a': 'b'}) as server:
+            with RESPClient(server.port) as client:
+                self.assertEqual(b'b', client.call('GET', 'a'))
+                self.assertEqual('OK', client.call('SET', 'key', 'value'))
+                self.assertEqual(b'value', client.call('GET', 'key'))
+                self.assertEqual('OK', client.call('MSET', 'c', '1', 'd', '2'))
+                self.assertEqual(
+                    [b'1', None, b'2'], client.call('MGET', 'c', 'e', 'd')
+                )
+                self.assertEqual(2, client.call('EXISTS', 'a', 'c', 'e'))
+                self.assertEqual(
+                    [b'c', b'd'], sorted(client.call('KEYS', '[cd]'))
+                )
+                self.assertEqual(4, client.call('DBSIZE'))
+                self.assertEqual(2, client.call('DEL', 'a', 'c', 'e'))
+                self.assertIsNone(client.call('GET', 'a'))
+                self.assertEqual('PONG', client.call('PING'))
+                self.assertEqual(b'hi', client.call('ECHO', 'hi'))
+
+        self.assertEqual({b'key': b'value', b'd': b'2'}, server.data)
+
+    def test_set_options(self):
+        """
+        ``SET`` should support the ``NX``, ``XX``, ``EX`` and ``PX`` options.
+        """
+        with RedisServer(port=0) as server:
+            with RESPClient(server.port) as client:
+                self.assertIsNone(client.call('SET', 'key', 'a', 'XX'))
+                self.assertEqual('OK', client.call('SET', 'key', 'a', 'NX'))
+                self.assertIsNone(client.call('SET', 'key', 'b', 'NX'))
+                self.assertEqual('OK', client.call('SET', 'key', 'b', 'XX'))
+                self.assertEqual(b'b', client.call('GET', 'key'))
+
+                self.assertEqual(-1, client.call('TTL', 'key'))
+                self.assertEqual(
+                    'OK', client.call('SET', 'key', 'c', 'EX', 10)
+                )
+                self.assertEqual(10, client.call('TTL', 'key'))
+                self.assertEqual(
+                    'OK', client.call('SET', 'key', 'c', 'px', 20000)
+                )
+                self.assertTrue(19000 < client.call('PTTL', 'key') <= 20000)
+
+                self.assertIsInstance(
+                    client.call('SET', 'key', 'c', 'EX'), RESPError
+                )
+                self.assertIsInstance(
+                    client.call('SET', 'key', 'c', 'EX', 'soon'), RESPError
+                )
+
+    def test_expiration(self):
+        """
+        Keys should expire after the given time.
+        """
+        with RedisServer(port=0) as server:
+            with RESPClient(server.port) as client:
+                client.call('SET', 'key', 'value')
+                self.assertEqual(0, client.call('EXPIRE', 'none', 10))
+                self.assertEqual(1, client.call('EXPIRE', 'key', 10))
+                self.assertEqual(1, client.call('PERSIST', 'key'))
+                self.assertEqual(-1, client.call('TTL', 'key'))
+
+                self.assertEqual(1, client.call('PEXPIRE', 'key', 10))
+                time.sleep(0.02)
+
+                self.assertIsNone(client.call('GET', 'key'))
+                self.assertEqual(-2, client.call('TTL', 'key'))
+
+        self.assertEqual({}, server.data)
+
+    def test_counters(self):
+        """
+        Counters should be incremented atomically by many clients.
+        """
+        def increment(port):
+            with RESPClient(port) as client:
+                client.send(*[('INCR', 'counter')] * 250)
+                client.read(250)
+
+        with RedisServer(port=0) as server:
+            threads = [
+                threading.Thread(target=increment, args=(server.port,))
+                for i in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            with RESPClient(server.port) as client:
+                self.assertEqual(990, client.call('DECRBY', 'counter', 10))
+                self.assertEqual(989, client.call('DECR', 'counter'))
+                self.assertEqual(999, client.call('INCRBY', 'counter', 10))
+
+                client.call('SET', 'key', 'value')
+                self.assertIsInstance(client.call('INCR', 'key'), RESPError)
+
+    def test_pipeline(self):
+        """
+        Commands sent at once should be answered in order.
+        """
+        with RedisServer(port=0) as server:
+            with RESPClient(server.port) as client:
+                client.send(*[('SET', i, i * 2) for i in range(1000)])
+                client.send(*[('GET', i) for i in range(1000)])
+
+                replies = client.read(2000)
+
+        self.assertEqual(['OK'] * 1000, replies[:1000])
+        self.assertEqual([str(i * 2).encode() for i in range(1000)],
+                         replies[1000:])
+        self.assertEqual(2000, server.stats.requests)
+
+    def test_transactions(self):
+        """
+        ``MULTI`` should queue the commands until ``EXEC`` or ``DISCARD``.
+        """
+        with RedisServer(port=0) as server:
+            with RESPClient(server.port) as client:
+                self.assertEqual('OK', client.call('MULTI'))
+                self.assertEqual('QUEUED', client.call('INCR', 'a'))
+                self.assertEqual('QUEUED', client.call('GET', 'a'))
+                self.assertEqual([1, b'1'], client.call('EXEC'))
+
+                client.call('MULTI')
+                client.call('INCR', 'a')
+                self.assertEqual('OK', client.call('DISCARD'))
+                self.assertEqual(b'1', client.call('GET', 'a'))
+
+                client.call('MULTI')
+                client.call('INCR', 'a')
+                self.assertIsInstance(client.call('GET'), RESPError)
+                self.assertIn('EXECABORT', str(client.call('EXEC')))
+                self.assertEqual(b'1', client.call('GET', 'a'))
+
+                self.assertIsInstance(client.call('EXEC'), RESPError)
+
+    def test_errors(self):
+        """
+        Unknown commands and wrong arguments should get errors, but malformed
+        commands should close the connection.
+        """
+        with RedisServer(port=0) as server:
+            with RESPClient(server.port) as client:
+                self.assertIn('unknown command', str(client.call('NOPE')))
+                self.assertIn(
+                    'wrong number of arguments', str(client.call('GET'))
+                )
+                self.assertIn('unknown command', str(client.call('_GET', 1)))
+
+                client.socket.sendall(b'*1\r\n:1\r\n')
+                self.assertIn('Protocol error', str(client.read()))
+                self.assertEqual(b'', client.socket.recv(10))
+
+    def test_inline_commands(self):
+        """
+        Inline commands should be accepted, and ``QUIT`` should close the
+        connection.
+        """
+        with RedisServer(port=0) as server:
+            with socket.create_connection(('localhost', server.port)) as s:
+                s.sendall(b'SET key value\r\n\r\nGET key\r\nQUIT\r\nGET key\n')
+
+                self.assertEqual(
+                    b'+OK\r\n$5\r\nvalue\r\n+OK\r\n', receive_all(s)
+                )
+
+    def test_new_commands(self):
+        """
+        Subclasses should be able to add commands.
+        """
+        class AppendingServer(RedisServer):
+            def do_APPEND(self, key, value):
+                self.data[key] = self.data.get(key, b'') + value
+
+                return b':%d\r\n' % len(self.data[key])
+
+        with AppendingServer(port=0) as server:
+            with RESPClient(server.port) as client:
+                self.assertEqual(2, client.call('APPEND', 'key', 'ab'))
+                self.assertEqual(3, client.call('append', 'key', 'c'))
+                self.assertEqual(b'abc', client.call('GET', 'key'))
+
+
+class RESPError(Exception):
+    pass
+
+
+class RESPClient(object):
+    """
+    A minimal client of the Redis protocol, to test ``RedisServer``.
+    """
+
+    def __init__(self, port):
+        self.socket = socket.create_connection(('localhost', port))
+        self.buffer = b''
+
+    def send(self, *commands):
+        self.socket.sendall(b''.join(
+            b'*%d\r\n' % len(command) + b''.join(
+                b'$%d\r\n%s\r\n' % (len(argument), argument)
+                for argument in (str(a).encode() for a in command)
+            )
+            for command in commands
+        ))
+
+    def call(self, *command):
+        self.send(command)
+
+        return self.read()
+
+    def read(self, count=None):
+        if count is not None:
+            return [self.read() for i in range(count)]
+
+        line = self._read_line()
+        kind, value = line[:1], line[1:]
+
+        if kind == b'+':
+            return value.decode()
+        elif kind == b'-':
+            return RESPError(value.decode())
+        elif kind == b':':
+            return int(value)
+        elif kind == b'$':
+            if int(value) < 0:
+                return None
+
+            return self._read_line()
+        elif kind == b'*':
+            return self.read(int(value))
+
+    def _read_line(self):
+        while b'\r\n' not in self.buffer:
+            self.buffer += self.socket.recv(65536)
+
+        line, self.buffer = self.buffer.split(b'\r\n', 1)
+
+        return line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.socket.close()
+
+
+class TestProxy(unittest.TestCase):
+
+    def test_relay(self):
+        """
+        ``Proxy`` should relay the data both ways, and count the bytes.
+        """
+        with EchoServer(port=0) as echo:
+            with Proxy(('localhost', echo.port)) as proxy:
+                with socket.create_connection(('localhost', proxy.port)) as s:
+                    s.sendall(b'My message')
+                    s.shutdown(socket.SHUT_WR)
+
+                    self.assertEqual(b'My message', receive_all(s))
+
+        self.assertEqual(10, proxy.upstream_bytes)
+        self.assertEqual(10, proxy.downstream_bytes)
+        self.assertFalse(proxy.connections[0].reset)
+
+    def test_latency(self):
+        """
+        The latency should be added to each direction.
+        """
+        latency = 0.05
+
+        with EchoServer(port=0) as echo:
+            with Proxy(('localhost', echo.port), latency=latency) as proxy:
+                with socket.create_connection(('localhost', proxy.port)) as s:
+                    start = time.monotonic()
+                    s.sendall(b'My message')
+                    s.shutdown(socket.SHUT_WR)
+                    receive_all(s)
+
+                    self.assertTrue(
+                        2 * latency < time.monotonic() - start < 4 * latency
+                    )
+
+    def test_jitter_does_not_reorder(self):
+        """
+        Even with jitter, data should arrive in the order it was sent.
+        """
+        message = b''.join(b'%04d' % i for i in range(100))
+
+        with EchoServer(port=0) as echo:
+            with Proxy(('localhost', echo.port), latency=0.01, jitter=0.01,
+                       seed=0) as proxy:
+                with socket.create_connection(('localhost', proxy.port)) as s:
+                    for i in range(0, len(message), 4):
+                        s.sendall(message[i:i+4])
+
+                    s.shutdown(socket.SHUT_WR)
+
+                    self.assertEqual(message, receive_all(s))
+
+    def test_bandwidth(self):
+        """
+        Each direction should be limited to the given bandwidth.
+        """
+        size = 200000
+
+        with EchoServer(port=0) as echo:
+            with Proxy(('localhost', echo.port), bandwidth=2000000) as proxy:
+                with socket.create_connection(('localhost', proxy.port)) as s:
+                    start = time.monotonic()
+                    s.sendall(b'x' * size)
+                    s.shutdown(socket.SHUT_WR)
+                    received = receive_all(s)
+                    elapsed = time.monotonic() - start
+
+        self.assertEqual(size, len(received))
+        # Each direction takes a tenth of a second, but they overlap, since
+        # the data is echoed while it is sent.
+        self.assertTrue(0.09 < elapsed < 0.2)
+        self.assertEqual(size, proxy.upstream_bytes)
+
+    def test_reset_after(self):
+        """
+        Connections should be reset after relaying the given number of bytes.
+        """
+        with Server(port=0, message=b'My message') as server:
+            with Proxy(('localhost', server.port), reset_after=4) as proxy:
+                with socket.create_connection(('localhost', proxy.port)) as s:
+                    received = b''
+
+                    with self.assertRaises(ConnectionResetError):
+                        while True:
+                            received += s.recv(10)
+
+        self.assertEqual(b'My m', received)
+        self.assertEqual(4, proxy.downstream_bytes)
+        self.assertTrue(proxy.connections[0].reset)
+
+    def test_target_down(self):
+        """
+        If the target refuses the connection, the client connection should be
+        reset.
+        """
+        with reserved_port() as port:
+            with Proxy(('localhost', port)) as proxy:
+                with socket.create_connection(('localhost', proxy.port)) as s:
+                    with self.assertRaises(ConnectionResetError):
+                        s.recv(10)
+
+        connection = proxy.connections[0]
+        self.assertTrue(connection.reset)
+        self.assertIsNone(connection.connected)
+        self.assertIsNone(connection.connect_time)
+
+    def test_close_resets_connections(self):
+        """
+        Closing the proxy should reset the connections still open, instead of
+        waiting for them.
+        """
+        with EchoServer(port=0) as echo:
+            with socket.socket() as s:
+                with Proxy(('localhost', echo.port)) as proxy:
+                    s.connect(('localhost', proxy.port))
+                    s.sendall(b'My message')
+                    start = time.monotonic()
+
+                self.assertTrue(time.monotonic() - start < 0.5)
+
+                with self.assertRaises(ConnectionResetError):
+                    receive_all(s)
+
+        self.assertTrue(proxy.connections[0].reset)
+
+    def test_handle_request(self):
+        """
+        As any server, the proxy should be able to serve a single request
+        with ``handle_request()``.
+        """
+        with Server(port=0, message=b'My message') as server:
+            proxy = Proxy(('localhost', server.port), port=9010)
+            thread = threading.Thread(target=proxy.handle_request)
+            thread.start()
+
+            try:
+                wait_until(lambda: ('127.0.0.1', 9010) in
+                           get_listening_addresses())
+
+                with socket.create_connection(('localhost', 9010)) as s:
+                    self.assertEqual(b'My message', receive_all(s))
+
+                thread.join()
+            finally:
+                proxy.server_close()
+
+        self.assertEqual(10, proxy.downstream_bytes)
+
+    def test_unix_sockets(self):
+        """
+        The proxy should relay to a Unix socket, and listen to one.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            target = os.path.join(directory, 'target.sock')
+            path = os.path.join(directory, 'proxy.sock')
+
+            with Server(path=target, message='My message'):
+                with Proxy(target, path=path):
+                    with socket.socket(socket.AF_UNIX) as s:
+                        s.connect(path)
+
+                        self.assertEqual(b'My message\0', receive_all(s))
+
+
+def wait_until(condition, timeout=1):
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('Condition not met in time')
+
+        time.sleep(0.001)
+
+
+def receive_all(s):
+    chunks = []
+
+    while True:
+        chunk = s.recv(65536)
+
+        if not chunk:
+            return b''.join(chunks)
+
+        chunks.append(chunk)
+
+
+class TestServerPool(unittest.TestCase):
+
+    def read(self, server):
+        with contextlib.closing(get_socket(timeout=1)) as s:
+            s.connect(('localhost', server.port))
+            return s.recv(1024)
+
+    def test_lease(self):
+        """
+        A leased server should be serving the given message, and be reused
+        once released.
+        """
+        with ServerPool(size=1) as pool:
+            with pool.lease(message='first') as server:
+                self.assertEqual(b'first\0', self.read(server))
+
+            with pool.lease(message='second') as server2:
+                self.assertIs(server, server2)
+                self.assertEqual(b'second\0', self.read(server2))
+
+            self.assertEqual([server], pool.servers)
+
+    def test_concurrent_leases(self):
+        """
+        Servers leased at the same time should be different, and new servers
+        should be started when no one is idle.
+        """
+        with ServerPool(size=1) as pool:
+            server1 = pool.acquire(message='first')
+            server2 = pool.acquire(message='second')
+
+            self.assertIsNot(server1, server2)
+            self.assertNotEqual(server1.port, server2.port)
+            self.assertEqual(b'first\0', self.read(server1))
+            self.assertEqual(b'second\0', self.read(server2))
+            self.assertEqual(2, len(pool.servers))
+
+            pool.release(server1)
+            pool.release(server2)
+
+    def test_close(self):
+        """
+        Closing the pool should stop all servers, even the leased ones.
+        """
+        pool = ServerPool(size=2, server_class=SelectorServer)
+        ports = [server.port for server in pool.servers]
+        leased = pool.acquire()
+
+        pool.close()
+
+        wait_servers_down([('localhost', port) for port in ports])
+        self.assertEqual([], pool.servers)
+        self.assertIn(leased.port, ports)
+
+    def test_release_after_close(self):
+        """
+        A server released after the pool was closed should be dropped, since
+        it was stopped with the pool.
+        """
+        pool = ServerPool(size=1)
+        leased = pool.acquire()
+        pool.close()
+
+        pool.release(leased)
+
+        self.assertEqual([], pool.servers)
+
+    def test_acquire_after_close(self):
+        """
+        A closed pool should not lease servers, since it would not stop them.
+        """
+        pool = ServerPool(size=1)
+        pool.close()
+
+        with self.assertRaises(RuntimeError):
+            pool.acquire()
+
+        with self.assertRaises(RuntimeError):
+            with pool.lease():
+                pass
+
+        self.assertEqual([], pool.servers)
+
+    def test_invalid_release(self):
+        """
+        Releasing a server twice, or one not leased from the pool, should
+        fail, so two leases never share a server.
+        """
+        with ServerPool(size=1) as pool:
+            server = pool.acquire()
+            pool.release(server)
+
+            with self.assertRaises(ValueError):
+                pool.release(server)
+
+            with self.assertRaises(ValueError):
+                pool.release(Server(port=0))
+
+            server1 = pool.acquire()
+            server2 = pool.acquire()
+
+            self.assertIsNot(server1, server2)
+
+            pool.release(server1)
+            pool.release(server2)
+
+
+class TestPorts(unittest.TestCase):
+
+    def test_port_zero(self):
+        """
+        If the port is zero, the server should listen to a free port, which
+        is stored in the ``port`` attribute.
+        """
+        with Server(port=0, message='Server is up') as server1, \
+                Server(port=0, message='Server is up') as server2:
+            self.assertNotEqual(0, server1.port)
+            self.assertNotEqual(server1.port, server2.port)
+
+            for server in (server1, server2):
+                with contextlib.closing(get_socket()) as s:
+                    s.connect(('localhost', server.port))
+                    msg = s.recv(len(b'Server is up'))
+
+                    self.assertEqual(b'Server is up', msg)
+
+    def test_async_port_zero(self):
+        """
+        The port zero also works with the ``async with`` statement.
+        """
+        async def main():
+            async with Server(port=0, message='Server is up') as server:
+                reader, writer = await asyncio.open_connection(
+                    'localhost', server.port
+                )
+                msg = await reader.read(len(b'Server is up'))
+                writer.close()
+                await writer.wait_closed()
+
+            self.assertNotEqual(0, server.port)
+            self.assertEqual(b'Server is up', msg)
+
+        asyncio.run(main())
+
+    def test_reserve_port(self):
+        """
+        ``reserve_port()`` should return a port free to be bound, and should
+        not return it again until it is released.
+        """
+        port = reserve_port()
+        others = [reserve_port() for i in range(20)]
+
+        try:
+            self.assertNotIn(port, others)
+
+            with Server(port=port):
+                wait_server_up('localhost', port)
+        finally:
+            release_port(port)
+            for other in others:
+                release_port(other)
+
+    def test_reserve_port_across_processes(self):
+        """
+        A port reserved by a process should not be reserved by another one.
+        """
+        def reserve():
+            yield [reserve_port() for i in range(50)]
+
+        with Process(target=reserve) as pc1, Process(target=reserve) as pc2:
+            ports1 = pc1.get()
+            ports2 = pc2.get()
+            pc1.go()
+            pc2.go()
+
+        self.assertFalse(set(ports1) & set(ports2))
+
+    def test_reserved_port(self):
+        """
+        ``reserved_port()`` should release the port at the end of the block.
+        """
+        with reserved_port() as port:
+            with Server(port=port):
+                wait_server_up('localhost', port)
+
+        release_port(port)  # Should do nothing.
+
 
 class TestWaiters(unittest.TestCase):
 
@@ -230,6 +1820,32 @@ class TestWaiters(unittest.TestCase):
 
         self.assertTrue(now - start < timeout)
 
+    def test_wait_server_up_retries_quickly(self):
+        """
+        ``wait_server_up()`` should start retrying with short intervals, so
+        that it notices a server that starts fast way before the longest
+        interval (``timeout/tries``) elapses.
+        """
+        delay = 0.01
+        server = Server(message='Server is up')
+
+        def serve():
+            time.sleep(delay)
+            server.serve_forever()
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+
+        try:
+            start = time.time()
+            wait_server_up('localhost', 9000, timeout=10, tries=10)
+
+            self.assertTrue(time.time() - start < 0.5)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
     def test_wait_server_up_timeout_unmet(self):
         """
         ``wait_server_up()`` should not wait for the full timeout if the port
@@ -244,6 +1860,424 @@ class TestWaiters(unittest.TestCase):
         self.assertTrue(now - start < timeout)
 
 
+class TestBatchWaiters(unittest.TestCase):
+
+    def test_wait_servers_up(self):
+        """
+        ``wait_servers_up()`` should probe all addresses at the same time, so
+        waiting for many servers takes as long as the slowest one to start -
+        not the sum of the time all of them take.
+        """
+        delay = 0.1
+        ports = [9000, 9001, 9002]
+        servers = [Server(port=port) for port in ports]
+
+        def serve(server):
+            time.sleep(delay)
+            server.serve_forever()
+
+        threads = [
+            threading.Thread(target=serve, args=(server,))
+            for server in servers
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            start = time.time()
+            wait_servers_up([('localhost', port) for port in ports])
+
+            self.assertTrue(time.time() - start < 2 * delay)
+        finally:
+            for server, thread in zip(servers, threads):
+                server.shutdown()
+                server.server_close()
+                thread.join()
+
+    def test_wait_servers_up_reports_missing_servers(self):
+        """
+        If some servers are not up before the timeout, the exception raised by
+        ``wait_servers_up()`` should list them.
+        """
+        timeout = 0.1
+        addresses = [('localhost', 9000), ('localhost', 9001)]
+
+        with Server(port=9001):
+            start = time.time()
+
+            with self.assertRaises(Exception) as a:
+                wait_servers_up(addresses, timeout=timeout)
+
+            self.assertTrue(timeout < time.time() - start < 2 * timeout)
+
+        message = str(a.exception)
+        self.assertIn('localhost:9000', message)
+        self.assertNotIn('localhost:9001', message)
+
+    def test_wait_servers_down(self):
+        """
+        ``wait_servers_down()`` should block until all servers are down.
+        """
+        delay = 0.01
+        ports = [9000, 9001]
+
+        def serve():
+            servers = [Server(port=port) for port in ports]
+            for server in servers:
+                server.__enter__()
+            yield
+
+            for server in servers:
+                time.sleep(delay)
+                server.__exit__(None, None, None)
+
+        with Process(target=serve) as pc:
+            addresses = [('localhost', port) for port in ports]
+            wait_servers_up(addresses)
+            start = time.time()
+
+            pc.go()
+            wait_servers_down(addresses)
+
+            self.assertTrue(time.time() - start > len(ports) * delay)
+
+    def test_wait_servers_down_reports_running_servers(self):
+        """
+        If some servers stay up after the timeout, the exception raised by
+        ``wait_servers_down()`` should list them.
+        """
+        addresses = [('localhost', 9000), ('localhost', 9001)]
+
+        with Server(port=9000):
+            with self.assertRaises(Exception) as a:
+                wait_servers_down(addresses, timeout=0.05)
+
+        message = str(a.exception)
+        self.assertIn('localhost:9000', message)
+        self.assertNotIn('localhost:9001', message)
+
+
+class TestResolution(unittest.TestCase):
+
+    def test_resolve_once_per_wait(self):
+        """
+        The waiters should resolve the host once per call, not once per try.
+        """
+        calls = []
+        getaddrinfo = socket.getaddrinfo
+
+        def counting_getaddrinfo(*args, **kwargs):
+            calls.append(args)
+            return getaddrinfo(*args, **kwargs)
+
+        with temp_attr(socket, 'getaddrinfo', counting_getaddrinfo):
+            with self.assertRaises(Exception):
+                wait_server_up('localhost', 9000, timeout=0.05)
+
+        self.assertEqual(1, len(calls))
+
+    def test_sockaddrs_are_not_resolved(self):
+        """
+        IP addresses, as the ones returned by ``socket.getaddrinfo()``, should
+        be probed without calling the resolver.
+        """
+        def failing_getaddrinfo(*args, **kwargs):
+            raise socket.gaierror('Should not be called')
+
+        with Server(host='127.0.0.1', port=9000):
+            with temp_attr(socket, 'getaddrinfo', failing_getaddrinfo):
+                wait_server_up('127.0.0.1', 9000)
+                wait_servers_up([('127.0.0.1', 9000)])
+
+        with temp_attr(socket, 'getaddrinfo', failing_getaddrinfo):
+            wait_server_down('127.0.0.1', 9000)
+
+    def test_probe_all_candidates(self):
+        """
+        If the host resolves to many addresses, the server should be up once
+        any of them accepts connections, and down only when none does.
+        """
+        def dual_stack_getaddrinfo(host, port, *args, **kwargs):
+            return [
+                (socket.AF_INET6, socket.SOCK_STREAM, 6, '',
+                    ('::1', port, 0, 0)),
+                (socket.AF_INET, socket.SOCK_STREAM, 6, '',
+                    ('127.0.0.1', port)),
+            ]
+
+        with temp_attr(socket, 'getaddrinfo', dual_stack_getaddrinfo):
+            with Server(host='127.0.0.1', port=9000):
+                wait_server_up('localhost', 9000)
+
+                with self.assertRaises(Exception):
+                    wait_server_down('localhost', 9000, timeout=0.05)
+
+            wait_server_down('localhost', 9000)
+
+
+class TestTempHosts(unittest.TestCase):
+
+    def test_restore_resolver(self):
+        """
+        The original resolver functions should be back after the context.
+        """
+        getaddrinfo = socket.getaddrinfo
+        gethostbyname = socket.gethostbyname
+
+        with temp_hosts({'db.test': '127.0.0.1'}):
+            self.assertIsNot(getaddrinfo, socket.getaddrinfo)
+            self.assertIsNot(gethostbyname, socket.gethostbyname)
+
+        self.assertIs(getaddrinfo, socket.getaddrinfo)
+        self.assertIs(gethostbyname, socket.gethostbyname)
+
+        with self.assertRaises(socket.gaierror):
+            socket.getaddrinfo('db.test', 80, flags=socket.AI_NUMERICHOST)
+
+    def test_no_system_lookup(self):
+        """
+        Names in the table should not reach the system resolver.
+        """
+        def failing_getaddrinfo(host, *args, **kwargs):
+            raise socket.gaierror('{0} should not be resolved'.format(host))
+
+        with temp_attr(socket, 'getaddrinfo', failing_getaddrinfo):
+            with temp_hosts({'db.test': '127.0.0.1'}):
+                with self.assertRaises(socket.gaierror):
+                    socket.getaddrinfo('cache.test', 80)
+
+                with self.assertRaises(socket.gaierror):
+                    socket.getaddrinfo('db.test', 80)
+
+        with temp_hosts({'db.test': '127.0.0.1'}):
+            infos = socket.getaddrinfo('db.test', 80, 0, socket.SOCK_STREAM)
+
+        self.assertEqual([('127.0.0.1', 80)], [info[4] for info in infos])
+
+    def test_family(self):
+        """
+        Only addresses of the requested family should be returned.
+        """
+        with temp_hosts({'db.test': ['::1', '127.0.0.1']}):
+            infos = socket.getaddrinfo(
+                'db.test', 80, socket.AF_INET6, socket.SOCK_STREAM
+            )
+            self.assertEqual([('::1', 80, 0, 0)], [info[4] for info in infos])
+
+            self.assertEqual('127.0.0.1', socket.gethostbyname('db.test'))
+
+        with temp_hosts({'db.test': '::1'}):
+            with self.assertRaises(socket.gaierror):
+                socket.getaddrinfo('db.test', 80, socket.AF_INET)
+
+            with self.assertRaises(socket.gaierror):
+                socket.gethostbyname('db.test')
+
+    def test_nested(self):
+        """
+        Nested tables should fall through to the outer ones.
+        """
+        with temp_hosts({'db.test': '127.0.0.1'}):
+            with temp_hosts({'cache.test': '127.0.0.2'}):
+                self.assertEqual('127.0.0.1', socket.gethostbyname('db.test'))
+                self.assertEqual(
+                    '127.0.0.2', socket.gethostbyname('cache.test')
+                )
+
+            self.assertEqual('127.0.0.1', socket.gethostbyname('db.test'))
+
+    def test_async(self):
+        """
+        The table should be used by asyncio as well.
+        """
+        async def connect():
+            await async_wait_server_up('db.test', 9001)
+            reader, writer = await asyncio.open_connection('db.test', 9001)
+            message = await reader.read()
+            writer.close()
+
+            return message
+
+        with Server(host='127.0.0.1', port=9001, message='My message'):
+            with temp_hosts({'db.test': '127.0.0.1'}):
+                self.assertEqual(b'My message\0', asyncio.run(connect()))
+
+
+class TestAsync(unittest.TestCase):
+
+    def test_async_server(self):
+        """
+        ``inelegant.net.Server`` can be used with ``async with``. The server
+        runs in the event loop while the block is executed.
+        """
+        async def main():
+            async with Server(port=9001, message='Server is up'):
+                reader, writer = await asyncio.open_connection(
+                    'localhost', 9001
+                )
+                msg = await reader.read(len(b'Server is up'))
+                writer.close()
+                await writer.wait_closed()
+
+            self.assertEqual(b'Server is up', msg)
+
+            with self.assertRaises(socket.error):
+                await asyncio.open_connection('localhost', 9001)
+
+        asyncio.run(main())
+
+    def test_many_async_servers(self):
+        """
+        Many servers can be started and waited concurrently in the same event
+        loop.
+        """
+        ports = range(9100, 9150)
+
+        async def read(port):
+            await async_wait_server_up('localhost', port)
+            reader, writer = await asyncio.open_connection('localhost', port)
+            msg = await reader.read()
+            writer.close()
+            await writer.wait_closed()
+
+            return msg
+
+        async def main():
+            async with contextlib.AsyncExitStack() as stack:
+                for port in ports:
+                    await stack.enter_async_context(
+                        Server(port=port, message=str(port))
+                    )
+
+                msgs = await asyncio.gather(*(read(port) for port in ports))
+
+            self.assertEqual(
+                ['{0}\0'.format(port).encode() for port in ports], msgs
+            )
+
+            await asyncio.gather(
+                *(async_wait_server_down('localhost', port) for port in ports)
+            )
+
+        asyncio.run(main())
+
+    def test_async_wait_server_up_timeout(self):
+        """
+        ``async_wait_server_up()`` should wait for the given timeout before
+        failing.
+        """
+        timeout = 0.1
+        start = time.time()
+
+        with self.assertRaises(Exception):
+            asyncio.run(async_wait_server_up('localhost', 9000, timeout))
+
+        self.assertTrue(timeout < time.time() - start < 2*timeout)
+
+    def test_async_wait_server_down_timeout(self):
+        """
+        ``async_wait_server_down()`` should wait for the given timeout before
+        failing.
+        """
+        timeout = 0.1
+
+        with Server():
+            start = time.time()
+
+            with self.assertRaises(Exception):
+                asyncio.run(
+                    async_wait_server_down('localhost', 9000, timeout)
+                )
+
+            self.assertTrue(timeout < time.time() - start < 2*timeout)
+
+
+@unittest.skipUnless(
+    os.path.exists('/proc/net/tcp'), 'No TCP sockets table available.'
+)
+class TestListeningTable(unittest.TestCase):
+
+    def test_get_listening_addresses(self):
+        """
+        ``get_listening_addresses()`` should return the addresses of the
+        listening sockets, including IPv6 ones.
+        """
+        with Server('localhost', 9000):
+            self.assertIn(('127.0.0.1', 9000), get_listening_addresses())
+
+        self.assertNotIn(('127.0.0.1', 9000), get_listening_addresses())
+
+        if socket.has_ipv6 and os.path.exists('/proc/net/tcp6'):
+            s = socket.socket(socket.AF_INET6)
+            with contextlib.closing(s):
+                s.bind(('::1', 0))
+                s.listen(1)
+                port = s.getsockname()[1]
+
+                self.assertIn(('::1', port), get_listening_addresses())
+
+    def test_wait_server_down_proc_does_not_connect(self):
+        """
+        ``wait_server_down()`` with ``probe='proc'`` should not connect to the
+        server being waited.
+        """
+        class CountingServer(Server):
+            requests = 0
+
+            def finish_request(self, request, client_address):
+                CountingServer.requests += 1
+                Server.finish_request(self, request, client_address)
+
+        timeout = 0.1
+
+        with CountingServer('localhost', 9000):
+            start = time.time()
+
+            with self.assertRaises(Exception):
+                wait_server_down('localhost', 9000, timeout, probe='proc')
+
+            self.assertTrue(timeout < time.time() - start < 2*timeout)
+
+        self.assertEqual(0, CountingServer.requests)
+
+        wait_server_down('localhost', 9000, timeout, probe='proc')
+
+    def test_wait_servers_down_proc(self):
+        """
+        ``wait_servers_down()`` with ``probe='proc'`` should wait for all
+        servers to stop listening.
+        """
+        delay = 0.01
+        ports = [9000, 9001]
+
+        def serve():
+            servers = [Server(port=port) for port in ports]
+            for server in servers:
+                server.__enter__()
+            yield
+
+            for server in servers:
+                time.sleep(delay)
+                server.__exit__(None, None, None)
+
+        with Process(target=serve) as pc:
+            addresses = [('localhost', port) for port in ports]
+            wait_servers_up(addresses)
+            start = time.time()
+
+            pc.go()
+            wait_servers_down(addresses, probe='proc')
+
+            self.assertTrue(time.time() - start > len(ports) * delay)
+
+    def test_unknown_probe(self):
+        """
+        Unknown probes should be rejected.
+        """
+        with self.assertRaises(ValueError):
+            wait_server_down('localhost', 9000, probe='telepathy')
+
+
 load_tests = TestFinder(__name__, 'inelegant.net').load_tests
 
 if __name__ == "__main__":
@@ -20,10 +20,16 @@
 import unittest
 
 import contextlib
+import gc
+import os
+import signal
+import threading
 import time
 import multiprocessing.connection
 
-from inelegant.process import Process
+from concurrent.futures.process import BrokenProcessPool
+
+from inelegant.process import Process, ProcessPool
 
 from inelegant.finder import TestFinder
 
@@ -204,6 +210,649 @@ class TestProcess(unittest.TestCase):
             p.start()
             p.join()
 
+    def test_send_before_get(self):
+        """
+        Sending a value before getting the yielded one should not block,
+        even if neither fits in the pipe buffer.
+        """
+        def serve(value):
+            value = yield value
+            yield len(value)
+
+        with Process(target=serve, args=(b'x' * 600000,), timeout=5) as p:
+            p.send(b'y' * 600000)
+            self.assertEqual(b'x' * 600000, p.get())
+            self.assertEqual(600000, p.get())
+
+            p.go()
+
+        self.assertFalse(p.is_alive())
+
+    def test_get_after_end(self):
+        """
+        Once the target finishes, getting values should fail instead of
+        blocking, and values sent should be discarded.
+        """
+        def serve():
+            yield 1
+
+        with Process(target=serve, timeout=5) as p:
+            self.assertEqual(1, p.get())
+            p.go()
+
+            with self.assertRaises(EOFError):
+                p.get()
+
+            p.go()
+
+    def test_large_result(self):
+        """
+        A result larger than the pipe buffer should not keep the child from
+        finishing.
+        """
+        def serve():
+            return b'x' * (10 * 1024 * 1024)
+
+        with Process(target=serve, timeout=5) as p:
+            pass
+
+        self.assertFalse(p.is_alive())
+        self.assertEqual(10 * 1024 * 1024, len(p.result))
+
+    def test_large_values_in_shared_memory(self):
+        """
+        Large buffers should be sent through shared memory, keeping their
+        types, and the segments should be gone once received.
+        """
+        def serve(size):
+            value = yield bytearray(b'y' * size)
+            yield len(value)
+            return memoryview(bytearray(b'z' * size)).cast('I')
+
+        size = 4 * 1024 * 1024
+        segments = set(os.listdir('/dev/shm'))
+
+        with Process(target=returns, args=(b'x' * size,), timeout=5) as p:
+            pass
+
+        self.assertIsInstance(p.result, bytes)
+        self.assertEqual(b'x' * size, p.result)
+
+        with Process(target=serve, args=(size,), timeout=5) as p:
+            value = p.get()
+            self.assertIsInstance(value, bytearray)
+            self.assertEqual(bytearray(b'y' * size), value)
+
+            p.send(b'w' * size)
+            self.assertEqual(size, p.get())
+            p.go()
+
+        self.assertEqual(segments, set(os.listdir('/dev/shm')))
+
+    def test_unread_values_in_shared_memory(self):
+        """
+        The segments of values neither process read should be unlinked once
+        the process is joined.
+        """
+        def serve(size):
+            yield 1
+            yield b'x' * size
+
+        size = 4 * 1024 * 1024
+        segments = set(os.listdir('/dev/shm'))
+
+        with Process(target=serve, args=(size,), terminate=True) as p:
+            self.assertEqual(1, p.get())
+            p.go()
+
+            self.assertTrue(p.conversation.parent_connection.poll(5))
+            self.assertNotEqual(segments, set(os.listdir('/dev/shm')))
+
+        self.assertEqual(segments, set(os.listdir('/dev/shm')))
+
+        with Process(target=serve, args=(size,)) as p:
+            self.assertEqual(1, p.get())
+
+            os.kill(p.pid, signal.SIGSTOP)
+            p.send(b'y' * size)
+            os.kill(p.pid, signal.SIGKILL)
+
+        self.assertEqual(segments, set(os.listdir('/dev/shm')))
+
+    def test_memoryview(self):
+        """
+        Memory views should be received as views of the same format and
+        shape, whatever their sizes.
+        """
+        for size in (16, 4 * 1024 * 1024):
+            view = memoryview(bytearray(b'a' * size)).cast('I')
+
+            with Process(target=returns, args=(view,), timeout=5) as p:
+                pass
+
+            self.assertIsInstance(p.result, memoryview)
+            self.assertEqual('I', p.result.format)
+            self.assertEqual(view.shape, p.result.shape)
+            self.assertEqual(view.tobytes(), p.result.tobytes())
+
+    def test_stream(self):
+        """
+        With a window, the values yielded by the target should be streamed,
+        and read by iterating over the process.
+        """
+        def produce(count):
+            for i in range(count):
+                value = yield i
+                assert value is None
+
+        with Process(target=produce, args=(1000,), window=8) as p:
+            self.assertEqual(0, p.get())
+            self.assertEqual(list(range(1, 10)), p.get_many(9))
+            self.assertEqual(list(range(10, 1000)), list(p))
+            self.assertEqual([], p.get_many(1))
+
+        self.assertIsNone(p.exception)
+
+    def test_stream_backpressure(self):
+        """
+        The target should not get more than ``window`` values ahead of the
+        ones read.
+        """
+        produced = multiprocessing.Value('i', 0)
+
+        def produce():
+            for i in range(100):
+                produced.value = i + 1
+                yield i
+
+        def wait_produced(count):
+            deadline = time.monotonic() + 5
+
+            while produced.value < count and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        with Process(target=produce, window=4) as p:
+            wait_produced(5)
+            self.assertEqual(5, produced.value)
+
+            self.assertEqual([0, 1], p.get_many(2))
+            wait_produced(7)
+            self.assertEqual(7, produced.value)
+
+            self.assertEqual(list(range(2, 100)), list(p))
+
+    def test_stream_exception(self):
+        """
+        If the streaming target fails, the stream should end and the
+        exception should be available after the block.
+        """
+        def produce():
+            yield 1
+            yield 2
+            raise AssertionError('Actually, it is expected')
+
+        with Process(target=produce, window=4) as p:
+            self.assertEqual([1, 2], list(p))
+
+        self.assertIsInstance(p.exception, AssertionError)
+
+    def test_stream_send_fails(self):
+        """
+        Values cannot be sent to a streaming target, nor streamed from one
+        that is not.
+        """
+        def produce():
+            yield 1
+
+        with Process(target=produce, window=4) as p:
+            with self.assertRaises(ValueError):
+                p.send(1)
+
+            with self.assertRaises(ValueError):
+                p.go()
+
+            self.assertEqual([1], list(p))
+
+        with Process(target=produce) as p:
+            with self.assertRaises(ValueError):
+                list(p)
+
+            p.get()
+            p.go()
+
+    def test_stream_invalid_window(self):
+        """
+        The window should hold at least one value.
+        """
+        def produce():
+            yield 1
+
+        for window in (0, -1):
+            with self.assertRaises(ValueError):
+                Process(target=produce, window=window)
+
+    def test_join_again(self):
+        """
+        If the first join times out, a later one should still get the result.
+        """
+        def serve():
+            time.sleep(0.1)
+            return 1
+
+        p = Process(target=serve)
+        p.start()
+        p.join(0.01)
+
+        self.assertIsNone(p.result)
+
+        p.join()
+
+        self.assertEqual(1, p.result)
+
+    def test_no_leaks(self):
+        """
+        Processes should not leave file descriptors open nor threads running
+        once joined.
+        """
+        def serve():
+            return 1
+
+        threads = threading.active_count()
+        fds = []
+
+        for i in range(20):
+            with Process(target=serve) as p:
+                pass
+
+            self.assertEqual(1, p.result)
+
+            gc.collect()
+            fds.append(len(os.listdir('/proc/self/fd')))
+
+        self.assertEqual(threads, threading.active_count())
+        self.assertEqual([fds[0]] * 20, fds)
+
+    def test_no_pipes_before_start(self):
+        """
+        Processes should only create their pipes to the child once started,
+        even if the target is a generator function.
+        """
+        fds = len(os.listdir('/proc/self/fd'))
+        processes = [Process(target=os.getpid) for i in range(20)]
+        processes += [Process(target=converse, args=(1,)) for i in range(20)]
+        processes += [
+            Process(target=converse, args=(1,), window=4) for i in range(20)
+        ]
+
+        self.assertEqual(fds, len(os.listdir('/proc/self/fd')))
+
+        with processes[20] as p:
+            self.assertEqual(1, p.get())
+            p.send(1)
+            self.assertEqual(2, p.get())
+            p.go()
+
+
+class TestProcessPool(unittest.TestCase):
+
+    def test_result(self):
+        """
+        ``ProcessPool.process()`` should run the target in a worker, making
+        its result available after the block.
+        """
+        with ProcessPool(workers=2) as pool:
+            with pool.process(target=add, args=(1, 2)) as p:
+                self.assertTrue(p.is_alive())
+
+            self.assertFalse(p.is_alive())
+            self.assertEqual(3, p.result)
+            self.assertIsNone(p.exception)
+
+    def test_exception(self):
+        """
+        Exceptions raised by the target should be available after the block,
+        and re-raised if ``reraise`` is true.
+        """
+        with ProcessPool(workers=2) as pool:
+            with pool.process(target=fail) as p:
+                pass
+
+            self.assertIsInstance(p.exception, AssertionError)
+            self.assertEqual('Actually, it is expected', p.exception.args[0])
+
+            with self.assertRaises(AssertionError):
+                with pool.process(target=fail, reraise=True) as p:
+                    pass
+
+    def test_join(self):
+        """
+        Started processes should have their results after being joined.
+        """
+        with ProcessPool(workers=2) as pool:
+            processes = [
+                pool.process(target=add, args=(i, i)) for i in range(10)
+            ]
+
+            for p in processes:
+                p.start()
+            for p in processes:
+                p.join()
+
+        self.assertEqual(
+            [i + i for i in range(10)], [p.result for p in processes]
+        )
+
+    def test_send_receive_data(self):
+        """
+        A generator target should be able to talk to the parent as the
+        target of a ``Process``.
+        """
+        with ProcessPool(workers=1) as pool:
+            for i in range(3):
+                with pool.process(target=converse, args=(1,)) as p:
+                    self.assertEqual(1, p.get())
+                    p.send(2)
+                    self.assertEqual(3, p.get())
+                    p.go()
+
+    def test_get_after_return(self):
+        """
+        Getting a value from a target that returned should fail.
+        """
+        with ProcessPool(workers=1) as pool:
+            with pool.process(target=converse, args=(1,)) as p:
+                p.get()
+                p.send(2)
+                p.get()
+                p.go()
+
+                with self.assertRaises(EOFError):
+                    p.get()
+
+    def test_get_after_end(self):
+        """
+        Values sent after the target finished should be discarded, instead of
+        being taken by the worker as its next target.
+        """
+        with ProcessPool(workers=1) as pool:
+            with pool.process(target=yields, args=(1, 0.1)) as p:
+                self.assertEqual(1, p.get())
+                p.go()
+                p.go()
+                p.send(2)
+
+                with self.assertRaises(EOFError):
+                    p.get()
+
+            with pool.process(target=add, args=(1, 2)) as p:
+                pass
+
+            self.assertEqual(3, p.result)
+
+    def test_send_receive_data_fails_on_non_generator_function(self):
+        """
+        Sending to or getting from a target that is not a generator function
+        should fail.
+        """
+        with ProcessPool(workers=1) as pool:
+            with pool.process(target=add, args=(1, 2)) as p:
+                with self.assertRaises(ValueError):
+                    p.get()
+
+                with self.assertRaises(ValueError):
+                    p.send(2)
+
+                with self.assertRaises(ValueError):
+                    p.go()
+
+    def test_reuse_workers(self):
+        """
+        The targets should run in the same workers, which are not the
+        current process.
+        """
+        with ProcessPool(workers=2) as pool:
+            pids = set()
+
+            for i in range(10):
+                with pool.process(target=os.getpid) as p:
+                    pass
+
+                pids.add(p.result)
+
+        self.assertLessEqual(len(pids), 2)
+        self.assertNotIn(os.getpid(), pids)
+
+    def test_terminate(self):
+        """
+        If ``terminate`` is true, the worker should be terminated after the
+        block, and replaced by a new one.
+        """
+        with ProcessPool(workers=1) as pool:
+            with pool.process(target=time.sleep, args=(60,),
+                              terminate=True) as p:
+                pass
+
+            self.assertFalse(p.is_alive())
+            self.assertIsNone(p.exception)
+
+            with pool.process(target=add, args=(1, 2), timeout=5) as p:
+                pass
+
+            self.assertEqual(3, p.result)
+
+    def test_terminate_after_timeout(self):
+        """
+        A target still running after the block (and its timeout) should be
+        terminated, since the pool needs its worker.
+        """
+        with ProcessPool(workers=1) as pool:
+            start = time.monotonic()
+
+            with pool.process(target=time.sleep, args=(60,),
+                              timeout=0.1) as p:
+                pass
+
+            self.assertLess(time.monotonic() - start, 10)
+
+            with pool.process(target=add, args=(1, 2), timeout=5) as p:
+                pass
+
+            self.assertEqual(3, p.result)
+
+    def test_terminate_queued(self):
+        """
+        Terminating a process that is waiting for a worker should prevent it
+        from running.
+        """
+        with ProcessPool(workers=1) as pool:
+            busy = pool.submit(time.sleep, 0.1)
+            p = pool.process(target=add, args=(1, 2))
+            p.start()
+            p.terminate()
+            busy.result()
+
+            future = pool.submit(add, 3, 4)
+
+            self.assertEqual(7, future.result(timeout=1))
+            self.assertIsNone(p.result)
+
+    def test_submit(self):
+        """
+        ``ProcessPool`` should work as an executor.
+        """
+        with ProcessPool(workers=2) as pool:
+            futures = [pool.submit(add, i, 1) for i in range(10)]
+            failed = pool.submit(fail)
+
+            self.assertEqual(
+                list(range(1, 11)), [f.result(timeout=1) for f in futures]
+            )
+
+            with self.assertRaises(AssertionError):
+                failed.result(timeout=1)
+
+    def test_map(self):
+        """
+        ``ProcessPool.map()`` should return the results in order, whatever
+        the size of the chunks.
+        """
+        with ProcessPool(workers=2) as pool:
+            for chunksize in (None, 1, 7, 1000):
+                self.assertEqual(
+                    [i + i for i in range(100)],
+                    list(pool.map(
+                        add, range(100), range(100), chunksize=chunksize
+                    ))
+                )
+
+            self.assertEqual([], list(pool.map(add, [], [])))
+
+    def test_large_values(self):
+        """
+        Large arguments and results should go through shared memory.
+        """
+        value = b'x' * (4 * 1024 * 1024)
+
+        with ProcessPool(workers=1) as pool:
+            self.assertEqual(
+                value, pool.submit(returns, value).result(timeout=5)
+            )
+
+            with pool.process(target=returns, args=(value,), timeout=5) as p:
+                pass
+
+            self.assertEqual(value, p.result)
+
+    def test_unread_values_in_shared_memory(self):
+        """
+        If a worker dies before reading a large value, its segment should be
+        unlinked.
+        """
+        size = 4 * 1024 * 1024
+        segments = set(os.listdir('/dev/shm'))
+
+        with ProcessPool(workers=1) as pool:
+            pid = pool.submit(os.getpid).result(timeout=1)
+
+            os.kill(pid, signal.SIGSTOP)
+            future = pool.submit(len, b'x' * size)
+            os.kill(pid, signal.SIGKILL)
+
+            with self.assertRaises(BrokenProcessPool):
+                future.result(timeout=1)
+
+        self.assertEqual(segments, set(os.listdir('/dev/shm')))
+
+    def test_dead_worker(self):
+        """
+        If the worker dies running the target, the process should fail with
+        ``BrokenProcessPool``, and the worker should be replaced.
+        """
+        with ProcessPool(workers=1) as pool:
+            with pool.process(target=os._exit, args=(3,)) as p:
+                pass
+
+            self.assertIsInstance(p.exception, BrokenProcessPool)
+
+            with self.assertRaises(BrokenProcessPool):
+                with pool.process(target=os._exit, args=(3,), timeout=5,
+                                  reraise=True):
+                    pass
+
+            with pool.process(target=add, args=(1, 2), timeout=5) as p:
+                pass
+
+            self.assertEqual(3, p.result)
+
+    def test_replace_worker_without_forking(self):
+        """
+        Workers should be forked from the current process only before the
+        pool starts its threads. Replacements should not be forked from it.
+        """
+        with ProcessPool(workers=1) as pool:
+            self.assertEqual(
+                os.getpid(), pool.submit(os.getppid).result(timeout=1)
+            )
+
+            with pool.process(target=os._exit, args=(3,)) as p:
+                pass
+
+            self.assertNotEqual(
+                os.getpid(), pool.submit(os.getppid).result(timeout=5)
+            )
+
+    def test_broken_worker(self):
+        """
+        If a worker dies, the future should fail and the worker should be
+        replaced.
+        """
+        with ProcessPool(workers=1) as pool:
+            future = pool.submit(os._exit, 1)
+
+            with self.assertRaises(BrokenProcessPool):
+                future.result(timeout=1)
+
+            self.assertEqual(3, pool.submit(add, 1, 2).result(timeout=5))
+
+    def test_release_worker_without_join(self):
+        """
+        The worker should be given back to the pool once the target finishes,
+        even if the process is never joined.
+        """
+        pool = ProcessPool(workers=1)
+        pool.process(target=add, args=(1, 2)).start()
+
+        self.assertEqual(7, pool.submit(add, 3, 4).result(timeout=1))
+
+        thread = threading.Thread(target=pool.shutdown, daemon=True)
+        thread.start()
+        thread.join(1)
+
+        self.assertFalse(thread.is_alive())
+
+    def test_shutdown(self):
+        """
+        After shutdown, the pool should not accept targets.
+        """
+        pool = ProcessPool(workers=1)
+        pool.shutdown()
+
+        with self.assertRaises(RuntimeError):
+            pool.submit(add, 1, 2)
+
+        p = pool.process(target=add, args=(1, 2))
+
+        with self.assertRaises(RuntimeError):
+            p.start()
+
+        self.assertFalse(p.is_alive())
+
+        with self.assertRaises(RuntimeError):
+            p.join()
+
+
+def add(a, b):
+    return a + b
+
+
+def returns(value):
+    return value
+
+
+def fail():
+    raise AssertionError('Actually, it is expected')
+
+
+def converse(value):
+    value = yield value
+    yield value + 1
+
+
+def yields(value, delay=0):
+    yield value
+    time.sleep(delay)
+
+
 load_tests = TestFinder(__name__, 'inelegant.process').load_tests
 
 if __name__ == "__main__":
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+# Copyright 2015, 2016 Adam Victor Brandizzi
+#
+# This file is part of Inelegant.
+#
+# Inelegant is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Inelegant is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Inelegant.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import random
+
+from inelegant.record import Histogram
+
+from inelegant.finder import TestFinder
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        """
+        The percentiles should be within the precision of the histogram.
+        """
+        values = [random.uniform(0.0001, 10) for i in range(10000)]
+        histogram = Histogram(significant_figures=3)
+
+        for value in values:
+            histogram.record(value)
+
+        values.sort()
+
+        for percent in (1, 10, 50, 90, 99, 99.9):
+            expected = values[int(percent / 100 * len(values)) - 1]
+            self.assertAlmostEqual(
+                expected, histogram.percentile(percent),
+                delta=expected / 1000
+            )
+
+        self.assertAlmostEqual(values[0], histogram.min, delta=0.000001)
+        self.assertAlmostEqual(values[-1], histogram.max, delta=0.000001)
+        self.assertAlmostEqual(
+            sum(values) / len(values), histogram.mean, delta=0.000001
+        )
+
+    def test_empty(self):
+        """
+        An empty histogram has no percentiles.
+        """
+        histogram = Histogram()
+
+        self.assertEqual(0, histogram.count)
+        self.assertIsNone(histogram.percentile(50))
+        self.assertIsNone(histogram.max)
+        self.assertIsNone(histogram.mean)
+
+    def test_merge(self):
+        """
+        Merging histograms should be the same as recording all values in
+        one of them.
+        """
+        histogram1, histogram2, histogram3 = Histogram(), Histogram(), \
+            Histogram()
+
+        for i in range(1000):
+            value = random.expovariate(100)
+            histogram1.record(value)
+            (histogram2 if i % 2 else histogram3).record(value)
+
+        histogram2.merge(histogram3)
+
+        self.assertEqual(histogram1.count, histogram2.count)
+        for percent in (50, 90, 99):
+            self.assertEqual(
+                histogram1.percentile(percent), histogram2.percentile(percent)
+            )
+
+    def test_merge_different_precisions(self):
+        """
+        Histograms with different precisions cannot be merged.
+        """
+        with self.assertRaises(ValueError):
+            Histogram(significant_figures=2).merge(Histogram())
+
+
+load_tests = TestFinder(__name__, 'inelegant.record').load_tests
+
+if __name__ == "__main__":
+    unittest.main()
@@ -27,7 +27,7 @@ setup(
     description='Inelegant, a directory of weird helpers for tests.',
     long_description="""
     "Inelegant" is a set of not very elegant tools to help testing. So far
-    there are eight packages:
+    there are ten packages:
 
     inelegant.net: the most important tools are the waiter functions.
     inelegant.net.wait_server_down() will block until a port in a host is not
@@ -36,6 +36,14 @@ setup(
     also inelegant.net.Server, that sets up a very dumb SocketServer.TCPServer
     subclass for testing.
 
+    inelegant.load: inelegant.load.generate_load() puts load on a TCP server
+    from many connections, at a given rate or as fast as the server answers,
+    and reports the throughput and the latency percentiles.
+
+    inelegant.record: inelegant.record.Histogram records values, such as
+    latencies, and tells their percentiles. The module also has the kinds of
+    frames of the traffic recorded by inelegant.net.Proxy.
+
     inelegant.finder: contains the inelegant.finder.TestFinder class. It is a
     unittest.TestSuite subclass that makes the task of finding test cases and
     doctests way less annoying.